@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+"""
+Benchmarks for GAE Testbed's own hot paths: each mixin's setUp, reading
+10,000 tasks and e-mails back, ``query_count`` with a long query history
+and the overhead of a ``WebTestCase`` request.
+
+Save the results of one revision, then compare another against them::
+    
+    $ python benchmarks/run.py --output=before.json
+    $ git checkout my-branch
+    $ python benchmarks/run.py --output=after.json --compare=before.json
+
+The SDK is found the same way as ``gaetestbed.bootstrap()`` finds it, or
+can be given with ``--sdk``. Times are in milliseconds.
+"""
+
+import optparse
+import os
+import sys
+import time
+import unittest
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gaetestbed
+from gaetestbed import (DataStoreTestCase, MemcacheTestCase, MailTestCase,
+    TaskQueueTestCase, WebTestCase, UnitTestCase, FunctionalTestCase)
+
+# Changes smaller than this (as a fraction) are reported as noise
+NOISE = 0.1
+
+def application(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['OK']
+
+def make_case(mixin):
+    """
+    Returns an instance of a test case using ``mixin``, ready for its
+    ``setUp`` to be called.
+    """
+    attributes = {'runTest': lambda self: None, 'APPLICATION': staticmethod(application)}
+    return type('Benchmark%s' % mixin.__name__, (mixin, unittest.TestCase), attributes)()
+
+def measure(function, repeat):
+    """
+    Calls ``function`` ``repeat`` times and returns the ``runs``, ``mean``,
+    ``min`` and ``max`` time of a call in milliseconds.
+    """
+    times = []
+    for n in range(repeat):
+        start = time.time()
+        function()
+        times.append((time.time() - start) * 1000.0)
+    
+    return {
+        'runs': repeat,
+        'mean': sum(times) / len(times),
+        'min': min(times),
+        'max': max(times),
+    }
+
+def bench_setup(repeat):
+    results = {}
+    for mixin in (DataStoreTestCase, MemcacheTestCase, MailTestCase, TaskQueueTestCase,
+                  WebTestCase, UnitTestCase, FunctionalTestCase):
+        case = make_case(mixin)
+        
+        def run():
+            case.setUp()
+            case.tearDown()
+        
+        results['setUp.%s' % mixin.__name__] = measure(run, repeat)
+    return results
+
+def bench_tasks(repeat, count=10000):
+    try:
+        from google.appengine.api import taskqueue
+    except ImportError:
+        from google.appengine.api.labs import taskqueue
+    
+    case = make_case(TaskQueueTestCase)
+    case.setUp()
+    
+    queue = taskqueue.Queue()
+    for start in range(0, count, 100):
+        queue.add([taskqueue.Task(url='/work', params={'n': n, 'name': 'task'})
+                   for n in range(start, min(count, start + 100))])
+    
+    return {
+        'get_tasks.10k': measure(case.get_tasks, repeat),
+        'get_tasks.10k.by_url': measure(lambda: case.get_tasks(url='/missing'), repeat),
+        'get_task_count.10k': measure(case.get_task_count, repeat),
+    }
+
+def bench_mail(repeat, count=10000):
+    from google.appengine.api import mail
+    
+    case = make_case(MailTestCase)
+    case.setUp()
+    
+    for n in range(count):
+        mail.send_mail('sender@example.org', 'user%d@example.org' % n, 'Message %d' % n, 'Body')
+    
+    last = 'user%d@example.org' % (count - 1)
+    return {
+        'get_sent_messages.10k': measure(case.get_sent_messages, repeat),
+        'get_sent_messages.10k.by_to': measure(lambda: case.get_sent_messages(to=last), repeat),
+        'assertEmailSent.10k': measure(lambda: case.assertEmailSent(to=last), repeat),
+    }
+
+def bench_query_count(repeat, count=1000):
+    from google.appengine.ext import db
+    
+    class BenchmarkModel(db.Model):
+        n = db.IntegerProperty()
+    
+    case = make_case(DataStoreTestCase)
+    case.setUp()
+    
+    # Every filter value makes a separate entry in the query history
+    for n in range(count):
+        BenchmarkModel.all().filter('n =', n).fetch(1)
+    
+    return {
+        'query_count.1k_history': measure(lambda: case.query_count, repeat),
+    }
+
+def bench_web(repeat, count=100):
+    import webtest
+    
+    case = make_case(WebTestCase)
+    case.setUp()
+    plain = webtest.TestApp(application)
+    
+    def requests(app):
+        def run():
+            for n in range(count):
+                app.get('/')
+        return run
+    
+    return {
+        'web.100_requests.webtest': measure(requests(plain), repeat),
+        'web.100_requests.WebTestCase': measure(requests(case), repeat),
+    }
+
+BENCHMARKS = (bench_setup, bench_tasks, bench_mail, bench_query_count, bench_web)
+
+def run(repeat, only=None):
+    results = {}
+    for benchmark in BENCHMARKS:
+        if only and only not in benchmark.__name__:
+            continue
+        
+        sys.stderr.write('%s...\n' % benchmark.__name__)
+        results.update(benchmark(repeat))
+    return results
+
+def compare(before, after):
+    """
+    Returns a line per benchmark comparing the mean times, with changes
+    beyond the noise marked.
+    """
+    lines = ['%-40s %12s %12s %8s' % ('benchmark', 'before ms', 'after ms', 'change')]
+    for name in sorted(set(before) | set(after)):
+        if name not in before or name not in after:
+            lines.append('%-40s %12s %12s' % (
+                name, name in before and '%.2f' % before[name]['mean'] or '-',
+                name in after and '%.2f' % after[name]['mean'] or '-',
+            ))
+            continue
+        
+        old, new = before[name]['mean'], after[name]['mean']
+        change = old and (new - old) / old or 0.0
+        flag = ''
+        if change > NOISE:
+            flag = '  SLOWER'
+        elif change < -NOISE:
+            flag = '  faster'
+        lines.append('%-40s %12.2f %12.2f %+7.0f%%%s' % (name, old, new, change * 100, flag))
+    return '\n'.join(lines)
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--sdk', help='Path to the App Engine SDK')
+    parser.add_option('--repeat', type='int', default=5, help='Runs of each benchmark (default 5)')
+    parser.add_option('--only', help='Only run benchmarks whose function name contains this')
+    parser.add_option('--output', help='Write the results to this JSON file')
+    parser.add_option('--compare', help='Compare the results against this JSON file')
+    options, args = parser.parse_args()
+    
+    gaetestbed.bootstrap(FunctionalTestCase, sdk_path=options.sdk)
+    results = run(options.repeat, options.only)
+    
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(results, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    
+    if options.compare:
+        f = open(options.compare)
+        try:
+            before = json.load(f)
+        finally:
+            f.close()
+        print(compare(before, results))
+    elif not options.output:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
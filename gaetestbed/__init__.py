@@ -14,3 +14,4 @@ from taskqueue import TaskQueueTestCase
 from web import WebTestCase
 from unit import UnitTestCase
 from functional import FunctionalTestCase
+from bootstrap import bootstrap
@@ -6,11 +6,278 @@
 # This software is licensed as described in the file COPYING.txt,
 # which you should have received as part of this distribution.
 
+import time
+
+from baseline import get_baseline, updating_baselines
+from clock import VirtualClock
+from fixtures import timed_fixture
+from impact import coverage_map_path, get_coverage_map, get_coverage_recorder
+from latency import get_default_model
+from memory import get_memory_tracker, tracking_memory
+from rpc import get_rpc_recorder
+from waterfall import Waterfall
+
 class BaseTestCase(object):
     """
     BaseTestCase is the base mixin test case that holds common
     assert methods to be used across all test cases.
+    
+    It also records every App Engine API call made during a test, which
+    the other test cases use for their more specific assertions, and gives
+    each test a ``VirtualClock`` (``self.clock``) for simulations that need
+    time to pass.
     """
+    # The API services the test case needs stubs for; ``bootstrap()``
+    # registers the ones required by any of a test case's mixins.
+    REQUIRED_STUBS = ()
+    
+    # Set PERFORMANCE_BASELINE to the path of a JSON file to check every
+    # test's metrics (see ``get_performance_metrics``) against the ones it
+    # recorded last time, failing tests where any of them grew by more than
+    # PERFORMANCE_TOLERANCE (0.1 is 10%). PERFORMANCE_TOLERANCES overrides
+    # that for particular metrics, and PERFORMANCE_SLACK gives metrics an
+    # absolute amount they can always grow by (milliseconds, for wall_time).
+    # Run with GAETESTBED_UPDATE_BASELINE=1 to write the file instead.
+    PERFORMANCE_BASELINE = None
+    PERFORMANCE_TOLERANCE = 0.1
+    PERFORMANCE_TOLERANCES = {'wall_time': 1.0}
+    PERFORMANCE_SLACK = {'wall_time': 50.0}
+    
+    # The ``gaetestbed.latency.LatencyModel`` used to project how long API
+    # calls would take in production; the default costs if not set.
+    LATENCY_MODEL = None
+    
+    # Set TRACK_MEMORY (or GAETESTBED_TRACK_MEMORY=1 for every test case) to
+    # measure the memory each test retains and the size of each stub's state
+    # after it, reported at the end of the run. It runs the garbage collector
+    # around every test, so it's slow.
+    TRACK_MEMORY = False
+    
+    # Set COVERAGE_MAP (or GAETESTBED_COVERAGE_MAP for every test case) to
+    # the path of a JSON file to record the datastore kinds, memcache key
+    # prefixes, task queues and web routes each test touches, for running
+    # only the tests affected by a change (see ``gaetestbed.impact``).
+    COVERAGE_MAP = None
+    
+    @timed_fixture('BaseTestCase.setUp')
+    def setUp(self):
+        """
+        This method is called at the start of each test case.
+        
+        It clears out the API calls recorded by the previous test and resets
+        the virtual clock, so make sure to call ``super()`` if you override it.
+        """
+        if self.TRACK_MEMORY or tracking_memory():
+            get_memory_tracker().start_test()
+        
+        super(BaseTestCase, self).setUp()
+        if self.COVERAGE_MAP or coverage_map_path():
+            get_coverage_recorder().start_test()
+        
+        self._test_start = time.time()
+        self.clock = VirtualClock()
+        self.rpc_recorder = get_rpc_recorder()
+        self.rpc_recorder.reset()
+    
+    @timed_fixture('BaseTestCase.tearDown')
+    def tearDown(self):
+        """
+        This method is called at the end of each test case.
+        """
+        super(BaseTestCase, self).tearDown()
+        
+        if self.TRACK_MEMORY or tracking_memory():
+            get_memory_tracker().stop_test(self.id(), self.get_stub_sizes())
+        
+        touched = get_coverage_recorder().stop_test()
+        if touched is not None:
+            get_coverage_map(self.COVERAGE_MAP or coverage_map_path()).update(self.id(), touched)
+    
+    def run(self, result=None):
+        """
+        If ``PERFORMANCE_BASELINE`` is set, the test's metrics are checked
+        against (or recorded in) the baseline straight after the test method
+        returns.
+        
+        Doing it as part of the test, rather than in ``tearDown``, means a
+        regression is reported as a failure rather than an error, and tests
+        that have already failed aren't checked at all.
+        """
+        if not self.PERFORMANCE_BASELINE:
+            return super(BaseTestCase, self).run(result)
+        
+        name = self._testMethodName
+        test_method = getattr(self, name)
+        
+        def checked_test_method():
+            test_method()
+            self.assertPerformanceBaseline(self.PERFORMANCE_BASELINE)
+        
+        setattr(self, name, checked_test_method)
+        try:
+            return super(BaseTestCase, self).run(result)
+        finally:
+            delattr(self, name)
+    
+    def get_stub_sizes(self):
+        """
+        Returns the size of the state kept by each stub the test case uses,
+        as a dictionary of name to number (ie, ``datastore_entities``). This
+        is what memory tracking watches for state that isn't being reset.
+        
+        Each test case adds the sizes of its own stubs, so make sure to call
+        ``super()`` if you override it.
+        """
+        return {}
+    
+    def get_performance_metrics(self):
+        """
+        Returns the test's metrics so far as a dictionary of name to number:
+        ``wall_time`` (milliseconds since ``setUp``) and the number of calls
+        to each API method (ie, ``rpc:datastore_v3.Put``).
+        
+        The other test cases add their own metrics (``query_count``,
+        ``memcache_hits`` and ``tasks_enqueued``), so make sure to call
+        ``super()`` if you add some too::
+            
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def get_performance_metrics(self):
+                    metrics = super(MyTestCase, self).get_performance_metrics()
+                    metrics['emails'] = len(outbox)
+                    return metrics
+        """
+        metrics = {'wall_time': round((time.time() - self._test_start) * 1000.0, 1)}
+        for record in self.get_rpcs():
+            name = 'rpc:%s.%s' % (record.service, record.method)
+            metrics[name] = metrics.get(name, 0) + 1
+        return metrics
+    
+    def assertPerformanceBaseline(self, path):
+        """
+        Assert that none of the test's metrics have grown by more than the
+        tolerance since they were recorded in the baseline file ``path``.
+        Tests that aren't in the baseline yet pass.
+        
+        When running with ``GAETESTBED_UPDATE_BASELINE=1`` the metrics are
+        recorded instead, and the file is written when the run finishes.
+        
+        This is called for you at the end of every test that passes if
+        ``PERFORMANCE_BASELINE`` is set.
+        """
+        metrics = self.get_performance_metrics()
+        baseline = get_baseline(path)
+        
+        if updating_baselines():
+            baseline.update(self.id(), metrics)
+            return
+        
+        regressions = baseline.compare(
+            self.id(), metrics, self.PERFORMANCE_TOLERANCE, self.PERFORMANCE_TOLERANCES, self.PERFORMANCE_SLACK,
+        )
+        if regressions:
+            self.fail("Performance regressed since the baseline in %s: %s" % (
+                path, ', '.join(['%s %s -> %s' % regression for regression in regressions])
+            ))
+    
+    def get_rpcs(self, service=None, method=None):
+        """
+        Returns the list of ``RPCRecord`` objects for the API calls made so
+        far in the test, optionally filtered by ``service`` and ``method``.
+        
+        For example::
+            
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def test_puts(self):
+                    models.MyModel(field="value").put()
+                    self.assertLength(self.get_rpcs('datastore_v3', 'Put'), 1)
+        """
+        return get_rpc_recorder().get_records(service=service, method=method)
+    
+    def get_waterfall(self):
+        """
+        Returns a ``gaetestbed.waterfall.Waterfall`` of the API calls made so
+        far in the test.
+        """
+        return Waterfall(self.get_rpcs())
+    
+    def rpc_timeline(self):
+        """
+        Provides a context manager that records a ``Waterfall`` of the API
+        calls made inside a block of code::
+            
+            from __future__ import with_statement
+            
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def test_render_page(self):
+                    with self.rpc_timeline() as timeline:
+                        render_page()
+                    
+                    logging.info(timeline.format_text())
+                    self.assertEqual(timeline.parallelizable(), [])
+        """
+        return self._RPCTimeline()
+    
+    class _RPCTimeline(object):
+        def __enter__(self):
+            self.recorder = get_rpc_recorder()
+            self.first_record = len(self.recorder.records)
+            self.start = time.time()
+            self.waterfall = Waterfall()
+            return self.waterfall
+        
+        def __exit__(self, *args, **kwargs):
+            records = self.recorder.records[self.first_record:]
+            self.waterfall.capture(records, self.start, time.time())
+    
+    def _get_latency_waterfall(self, response):
+        if response is not None:
+            raise TypeError('Only a WebTestCase can project the latency of a response')
+        return Waterfall(self.get_rpcs(), self._test_start, time.time())
+    
+    def get_projected_latency(self, response=None, quantile='p50'):
+        """
+        Returns a ``gaetestbed.latency.LatencyProjection`` of how long the
+        test so far (or, in a ``WebTestCase``, the request for ``response``)
+        would take in production, using the costs in ``LATENCY_MODEL``.
+        
+        ``quantile`` is ``'p50'`` for a typical run or ``'p95'`` for a slow
+        one. Nothing actually sleeps; the local timeline is stretched.
+        """
+        model = self.LATENCY_MODEL or get_default_model()
+        return model.project(self._get_latency_waterfall(response), quantile)
+    
+    def assertProjectedLatencyBelow(self, max_ms, response=None, quantile='p50'):
+        """
+        Assert that the test so far (or the request for ``response``) would
+        take less than ``max_ms`` milliseconds in production.
+        
+        The stubs answer in microseconds, so this is what catches a design
+        like twenty ``db.get`` calls in a row::
+            
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def test_dashboard(self):
+                    render_dashboard()
+                    self.assertProjectedLatencyBelow(200)
+                    self.assertProjectedLatencyBelow(500, quantile='p95')
+        """
+        projection = self.get_projected_latency(response, quantile)
+        if projection.projected_time >= max_ms:
+            self.fail("Projected %s latency is %.1fms (max %.1fms)\n%s" % (
+                quantile, projection.projected_time, max_ms, projection.format(),
+            ))
+    
+    def _count(self, query, limit):
+        """
+        Returns ``query.count(limit)`` without recording the API calls it
+        makes, so assertions don't show up in the test's metrics.
+        """
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        try:
+            return query.count(limit)
+        finally:
+            recorder.resume()
+    
     def assertLength(self, iterable, count):
         """
         Assert that an `iterable` is of a given length.
@@ -20,8 +287,10 @@ class BaseTestCase(object):
         doesn't have the expected length, or the length cannot be determined,
         the test will fail.
         
-        This will first try to call ``item.count()`` (assuming it's a ``QuerySet``)
-        and then try ``len(item)``.
+        This will first try ``len(item)`` and then, for queries, call
+        ``item.count(count + 1)``. Counting stops one past the expected
+        length, so it's as cheap with a million entities as it is with ten,
+        and the count isn't included in ``query_count`` or ``get_rpcs()``.
         
         Let's take a look at an example::
             
@@ -30,7 +299,7 @@ class BaseTestCase(object):
                     # This will call len('asdf')
                     self.assertLength('asdf', 4)
                     
-                    # This will use .count()
+                    # This will use .count(1)
                     self.assertLength(models.MyModel.all(), 0)
                     
                     # These will use len()
@@ -43,12 +312,15 @@ class BaseTestCase(object):
         length = None
         
         if length is None:
-            try: length = iterable.count()
-            except: pass
+            try: length = len(iterable)
+            except TypeError: pass
         
         if length is None:
-            try: length = len(iterable)
-            except: pass
+            try: length = self._count(iterable, count + 1)
+            except (AttributeError, TypeError): pass
+            
+            if length is not None and length > count:
+                self.fail("Expected length %d, got more than %d" % (count, count))
         
         if length is None:
             self.fail("Unable to get length for object %s" % type(iterable))
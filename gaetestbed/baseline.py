@@ -0,0 +1,137 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import atexit
+import os
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+__all__ = ['PerformanceBaseline', 'get_baseline', 'updating_baselines']
+
+# Set this environment variable to write the metrics of this run to the
+# baseline files instead of checking them
+UPDATE_ENVIRON_KEY = 'GAETESTBED_UPDATE_BASELINE'
+
+def updating_baselines():
+    """
+    Returns whether this run should update the baseline files rather than
+    check against them (``GAETESTBED_UPDATE_BASELINE=1``).
+    """
+    return os.environ.get(UPDATE_ENVIRON_KEY, '') not in ('', '0')
+
+class PerformanceBaseline(object):
+    """
+    The metrics (wall time, API calls and so on) recorded for each test by
+    a previous run, stored as JSON in ``path`` and meant to be checked in
+    with the tests.
+    
+    ``tests`` maps each test's id to a dictionary of metric name to value.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tests = self._load()
+        self.updated = {}
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        
+        f = open(self.path)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    
+    def get(self, test_id):
+        """
+        Returns the recorded metrics for ``test_id``, or ``None`` if there
+        aren't any.
+        """
+        return self.tests.get(test_id)
+    
+    def update(self, test_id, metrics):
+        """
+        Replaces the recorded metrics for ``test_id``. Call ``save()`` to
+        write them out.
+        """
+        self.tests[test_id] = metrics
+        self.updated[test_id] = metrics
+    
+    def compare(self, test_id, metrics, tolerance=0.1, tolerances=None, slack=None):
+        """
+        Returns a list of ``(metric, baseline value, value)`` for every
+        metric that grew by more than ``tolerance`` (a fraction, so ``0.1``
+        allows 10% growth) since the baseline. ``tolerances`` can override
+        the tolerance for particular metrics.
+        
+        ``slack`` maps metrics to an absolute amount they may always grow
+        by, whatever the tolerance allows, so that small baselines (a few
+        milliseconds of ``wall_time``) don't fail on noise.
+        
+        Metrics missing from the baseline count as zero. A zero baseline
+        allows no relative growth at all, only the metric's slack, so a new
+        kind of API call is always reported. Tests that aren't in the
+        baseline at all aren't checked.
+        """
+        baseline = self.get(test_id)
+        if baseline is None:
+            return []
+        
+        tolerances = tolerances or {}
+        slack = slack or {}
+        regressions = []
+        for name in sorted(metrics):
+            old, new = baseline.get(name, 0), metrics[name]
+            limit = old + slack.get(name, 0)
+            if old:
+                limit = max(limit, old * (1 + tolerances.get(name, tolerance)))
+            if new > limit:
+                regressions.append((name, old, new))
+        return regressions
+    
+    def save(self):
+        """
+        Writes the updated tests back to ``path``. The file is read again
+        first, so processes running different tests at the same time (ie,
+        the parallel runner's workers) don't undo each other's updates.
+        """
+        if not self.updated:
+            return
+        
+        tests = self._load()
+        tests.update(self.updated)
+        
+        f = open(self.path, 'w')
+        try:
+            json.dump(tests, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        
+        self.tests = tests
+        self.updated = {}
+
+_baselines = {}
+
+def _save_baselines():
+    for baseline in _baselines.values():
+        baseline.save()
+
+atexit.register(_save_baselines)
+
+def get_baseline(path):
+    """
+    Returns the ``PerformanceBaseline`` stored in ``path``, loading it the
+    first time. Changed baselines are saved when the process exits.
+    """
+    path = os.path.abspath(path)
+    if path not in _baselines:
+        _baselines[path] = PerformanceBaseline(path)
+    return _baselines[path]
@@ -0,0 +1,193 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+import sys
+
+from stubs import DEFAULT_SERVICES, STUB_FACTORIES, get_stub, setup_environment
+
+__all__ = ['bootstrap', 'find_sdk', 'required_stubs']
+
+# Where the SDK found by ``find_sdk`` is remembered between runs. Paths
+# starting with ``~`` are expanded each time they're used.
+SDK_CACHE_FILE = os.path.join('~', '.gaetestbed-sdk')
+
+# Places the SDK is installed by default
+COMMON_SDK_PATHS = (
+    '/usr/local/google_appengine',
+    '/opt/google_appengine',
+    os.path.join('~', 'google_appengine'),
+    '/Applications/GoogleAppEngineLauncher.app/Contents/Resources/'
+    'GoogleAppEngine-default.bundle/Contents/Resources/google_appengine',
+    r'C:\Program Files\Google\google_appengine',
+)
+
+# The third party libraries bundled with the SDK, as dev_appserver.py adds
+# them to the path
+SDK_LIBRARIES = (
+    'antlr3', 'django', 'fancy_urllib', 'ipaddr', 'simplejson', 'webob',
+    os.path.join('yaml', 'lib'),
+)
+
+_sdk_path = None
+
+def _is_sdk(path):
+    return bool(path) and os.path.isfile(
+        os.path.join(path, 'google', 'appengine', 'api', 'apiproxy_stub_map.py')
+    )
+
+def _read_cached_sdk():
+    path = os.path.expanduser(SDK_CACHE_FILE)
+    if not os.path.exists(path):
+        return None
+    
+    f = open(path)
+    try:
+        return f.read().strip()
+    finally:
+        f.close()
+
+def _write_cached_sdk(path):
+    try:
+        f = open(os.path.expanduser(SDK_CACHE_FILE), 'w')
+        try:
+            f.write(path)
+        finally:
+            f.close()
+    except IOError:
+        pass
+
+def _sdk_candidates():
+    for name in ('GAE_SDK', 'APPENGINE_SDK'):
+        if os.environ.get(name):
+            yield os.environ[name]
+    
+    # dev_appserver.py on the PATH is often a symlink into the SDK
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        script = os.path.join(directory, 'dev_appserver.py')
+        if os.path.exists(script):
+            yield os.path.dirname(os.path.realpath(script))
+    
+    for path in COMMON_SDK_PATHS:
+        yield os.path.expanduser(path)
+
+def find_sdk(sdk_path=None):
+    """
+    Returns the directory of the App Engine SDK, or ``None`` if it can't be
+    found.
+    
+    The ``sdk_path`` given, the ``GAE_SDK`` (or ``APPENGINE_SDK``)
+    environment variable, the directory of ``dev_appserver.py`` on the
+    ``PATH`` and the usual install locations are tried in turn. What's
+    found is remembered for the rest of the process and in
+    ``~/.gaetestbed-sdk``, so later runs don't have to search again.
+    """
+    global _sdk_path
+    
+    if sdk_path is not None:
+        if _is_sdk(sdk_path):
+            return sdk_path
+        return None
+    
+    if _sdk_path is not None:
+        return _sdk_path
+    
+    cached = _read_cached_sdk()
+    if _is_sdk(cached) and not os.environ.get('GAE_SDK') and not os.environ.get('APPENGINE_SDK'):
+        _sdk_path = cached
+        return _sdk_path
+    
+    for path in _sdk_candidates():
+        if _is_sdk(path):
+            _sdk_path = os.path.abspath(path)
+            if _sdk_path != cached:
+                _write_cached_sdk(_sdk_path)
+            return _sdk_path
+    
+    return None
+
+def _add_sdk_to_path(sdk_path):
+    paths = [sdk_path] + [os.path.join(sdk_path, 'lib', name) for name in SDK_LIBRARIES]
+    for path in reversed(paths):
+        if os.path.isdir(path) and path not in sys.path:
+            sys.path.insert(0, path)
+
+def required_stubs(test_case):
+    """
+    Returns the services whose stubs ``test_case`` (a test case class or
+    instance) needs, from the ``REQUIRED_STUBS`` of every class it
+    inherits from.
+    """
+    if not isinstance(test_case, type):
+        test_case = test_case.__class__
+    
+    services = []
+    for cls in test_case.__mro__:
+        for service in cls.__dict__.get('REQUIRED_STUBS', ()):
+            if service not in services:
+                services.append(service)
+    return services
+
+def bootstrap(test_case=None, sdk_path=None, app_id='gaetestbed', root_path=None):
+    """
+    Gets the App Engine API ready for tests without ``dev_appserver`` or
+    NoseGAE: puts the SDK on ``sys.path`` (if it can't be imported already)
+    and registers stubs for the services ``test_case`` needs, leaving any
+    that are already registered alone. Without a ``test_case``, stubs for
+    ``DEFAULT_SERVICES`` are registered.
+    
+    Only the SDK modules for those services are imported, so it takes
+    milliseconds rather than the seconds NoseGAE needs. Call it at the top
+    of your test module, before anything imports the SDK::
+        
+        import unittest
+        
+        import gaetestbed
+        from gaetestbed import DataStoreTestCase
+        gaetestbed.bootstrap(DataStoreTestCase)
+        
+        from myapp.models import MyModel
+        
+        class MyTestCase(DataStoreTestCase, unittest.TestCase):
+            def test_empty(self):
+                self.assertEqual(MyModel.all().count(), 0)
+    
+    ``root_path`` is the directory holding the app's ``queue.yaml``. Raises
+    ``ImportError`` if the SDK can't be found.
+    """
+    if sdk_path is not None:
+        if find_sdk(sdk_path) is None:
+            raise ImportError('No App Engine SDK in %s' % sdk_path)
+        _add_sdk_to_path(sdk_path)
+    
+    try:
+        from google.appengine.api import apiproxy_stub_map
+    except ImportError:
+        found = find_sdk()
+        if found is None:
+            raise ImportError('Could not find the App Engine SDK; set GAE_SDK to its directory')
+        _add_sdk_to_path(found)
+        from google.appengine.api import apiproxy_stub_map
+    
+    setup_environment(app_id)
+    
+    if test_case is None:
+        services = DEFAULT_SERVICES
+    else:
+        services = required_stubs(test_case)
+    
+    if getattr(apiproxy_stub_map, 'apiproxy', None) is None:
+        apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    
+    for service in services:
+        if get_stub(service) is None:
+            apiproxy_stub_map.apiproxy.RegisterStub(
+                service, STUB_FACTORIES[service](os.environ['APPLICATION_ID'], root_path)
+            )
+    
+    return apiproxy_stub_map.apiproxy
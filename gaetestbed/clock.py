@@ -0,0 +1,44 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+__all__ = ['VirtualClock']
+
+class VirtualClock(object):
+    """
+    A clock that only moves when it's told to.
+    
+    Simulations like pull queue leases are measured against this clock
+    instead of the wall clock, so a test can "wait" five minutes for a lease
+    to expire without actually sleeping::
+        
+        self.clock.advance(300)
+    """
+    def __init__(self, start=0.0):
+        self.start = start
+        self._now = start
+    
+    def now(self):
+        """
+        Returns the current virtual time, in seconds.
+        """
+        return self._now
+    
+    def advance(self, seconds):
+        """
+        Moves the clock forward by ``seconds`` and returns the new time.
+        """
+        if seconds < 0:
+            raise ValueError('The clock can only move forward (got %r seconds)' % seconds)
+        self._now += seconds
+        return self._now
+    
+    def reset(self):
+        """
+        Moves the clock back to where it started.
+        """
+        self._now = self.start
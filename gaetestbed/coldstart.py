@@ -0,0 +1,208 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+# This module is also run as a script in the child process, by file name,
+# so that measuring an import doesn't import all of gaetestbed (and
+# webtest) first. Keep its imports to the standard library.
+
+import os
+import subprocess
+import sys
+import time
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+__all__ = ['ColdStartReport', 'measure_cold_start']
+
+# The child prints its results on a line starting with this, so anything
+# the application prints while it's imported doesn't get in the way.
+RESULT_MARKER = 'GAETESTBED_COLD_START '
+
+class ColdStartReport(object):
+    """
+    What it cost a fresh instance to import ``module`` and handle its first
+    request. Times are in milliseconds.
+    
+    ``modules`` is a list of ``(module name, milliseconds)`` for every module
+    loaded by the import, slowest first; the times exclude the modules each
+    one imported in turn. ``max_rss_kb`` is the peak memory of the child
+    process at the first request, if the platform can report it.
+    """
+    def __init__(self, data):
+        self.module = data['module']
+        self.path = data['path']
+        self.status = data['status']
+        self.stub_setup_time = data['stub_setup_time']
+        self.import_time = data['import_time']
+        self.first_request_time = data['first_request_time']
+        self.max_rss_kb = data['max_rss_kb']
+        self.modules = [tuple(m) for m in data['modules']]
+    
+    @property
+    def total_time(self):
+        """
+        Import time plus first request time (stub setup isn't included,
+        since production instances don't pay for it).
+        """
+        return self.import_time + self.first_request_time
+    
+    def format(self, limit=20):
+        """
+        Returns a summary followed by the ``limit`` slowest module imports.
+        """
+        lines = ['Cold start of %s: %.1fms import + %.1fms first request (%s) = %.1fms%s' % (
+            self.module, self.import_time, self.first_request_time, self.status, self.total_time,
+            self.max_rss_kb and ', %dKB max RSS' % self.max_rss_kb or '',
+        )]
+        for name, elapsed in self.modules[:limit]:
+            lines.append('  %8.1fms  %s' % (elapsed, name))
+        return '\n'.join(lines)
+    
+    def __str__(self):
+        return self.format()
+
+def measure_cold_start(module, attribute='application', path='/', services=None, root_path=None):
+    """
+    Imports ``module`` in a new Python process, with freshly registered
+    stubs, sends ``GET path`` to its ``attribute`` WSGI application and
+    returns a ``ColdStartReport``.
+    
+    The child process gets the same ``sys.path`` and environment variables
+    as this one. Raises ``RuntimeError`` if it fails.
+    """
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    
+    env = dict(os.environ)
+    env['GAETESTBED_COLD_START'] = json.dumps({
+        'sys_path': [os.path.abspath(p or os.curdir) for p in sys.path],
+        'module': module,
+        'attribute': attribute,
+        'path': path,
+        'services': services,
+        'root_path': root_path,
+    })
+    
+    process = subprocess.Popen(
+        [sys.executable, script], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    stdout, stderr = process.communicate()
+    
+    for line in stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return ColdStartReport(json.loads(line[len(RESULT_MARKER):]))
+    
+    raise RuntimeError('Cold start of %s failed (exit code %s):\n%s' % (module, process.returncode, stderr))
+
+class _ImportTimer(object):
+    """
+    Wraps ``__import__`` to time every module loaded for the first time,
+    excluding the time spent loading the modules it imports.
+    """
+    def __init__(self, original_import):
+        self.original_import = original_import
+        self.times = {}
+        self.stack = []
+    
+    def __call__(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self.original_import(name, *args, **kwargs)
+        
+        self.stack.append(0.0)
+        start = time.time()
+        try:
+            return self.original_import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = self.stack.pop()
+            self.times[name] = self.times.get(name, 0.0) + (elapsed - nested)
+            if self.stack:
+                self.stack[-1] += elapsed
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss = max_rss / 1024
+    return max_rss
+
+def _run_child(options):
+    import imp
+    from wsgiref.util import setup_testing_defaults
+    
+    sys.path[:] = options['sys_path']
+    
+    # Loaded under a private name so it can't shadow an app module called
+    # ``stubs``.
+    start = time.time()
+    stubs = imp.load_source('_gaetestbed_stubs', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs.py'))
+    stubs.register_stubs(options['services'], root_path=options['root_path'])
+    stub_setup_time = time.time() - start
+    
+    try:
+        import __builtin__ as builtins
+    except ImportError:
+        import builtins
+    
+    timer = _ImportTimer(builtins.__import__)
+    builtins.__import__ = timer
+    try:
+        start = time.time()
+        __import__(options['module'])
+        import_time = time.time() - start
+    finally:
+        builtins.__import__ = timer.original_import
+    
+    application = getattr(sys.modules[options['module']], options['attribute'])
+    
+    path, _, query = options['path'].partition('?')
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query}
+    setup_testing_defaults(environ)
+    
+    status = []
+    def start_response(response_status, headers, exc_info=None):
+        status.append(response_status)
+        return lambda data: None
+    
+    start = time.time()
+    result = application(environ, start_response)
+    try:
+        for chunk in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    first_request_time = time.time() - start
+    
+    modules = [(name, elapsed * 1000.0) for name, elapsed in timer.times.items()]
+    modules.sort(key=lambda m: -m[1])
+    
+    return {
+        'module': options['module'],
+        'path': options['path'],
+        'status': status and status[0] or None,
+        'stub_setup_time': stub_setup_time * 1000.0,
+        'import_time': import_time * 1000.0,
+        'first_request_time': first_request_time * 1000.0,
+        'max_rss_kb': _max_rss_kb(),
+        'modules': modules,
+    }
+
+if __name__ == '__main__':
+    # Drop this file's directory from the path so gaetestbed's modules
+    # can't shadow the application's.
+    del sys.path[0]
+    result = _run_child(json.loads(os.environ['GAETESTBED_COLD_START']))
+    sys.stdout.write(RESULT_MARKER + json.dumps(result) + '\n')
@@ -6,10 +6,11 @@
 # This software is licensed as described in the file COPYING.txt,
 # which you should have received as part of this distribution.
 
-from google.appengine.api import apiproxy_stub_map, datastore_file_stub
-from google.appengine.ext import db
-
 from base import BaseTestCase
+from factory import EntityFactory
+from fixtures import timed_fixture
+from stubs import get_stub
+from transactions import get_transaction_tracker
 
 __all__ = ['DataStoreTestCase']
 
@@ -64,6 +65,15 @@ class DataStoreTestCase(BaseTestCase):
                 models.MyModel(field="value").put()
                 self.assertLength(models.MyModel.all(), 1)
     """
+    REQUIRED_STUBS = ('datastore_v3',)
+    
+    # The share of transaction commits that fail with a collision, as if
+    # another request had written to the same entity group first, and the
+    # seed deciding which ones. See ``inject_transaction_collisions()``.
+    TRANSACTION_COLLISION_RATE = 0.0
+    TRANSACTION_COLLISION_SEED = 0
+    
+    @timed_fixture('DataStoreTestCase.setUp')
     def setUp(self):
         """
         This method is called at the start of each test case.
@@ -74,9 +84,10 @@ class DataStoreTestCase(BaseTestCase):
         """
         super(DataStoreTestCase, self).setUp()
         self.clear_datastore()
+        get_transaction_tracker().reset(self.TRANSACTION_COLLISION_RATE, self.TRANSACTION_COLLISION_SEED)
     
     def _get_datastore_stub(self):
-        return apiproxy_stub_map.apiproxy._APIProxyStubMap__stub_map['datastore_v3']
+        return get_stub('datastore_v3')
         
     def clear_datastore(self):
         """
@@ -101,6 +112,62 @@ class DataStoreTestCase(BaseTestCase):
                     self.assertLength(models.MyModel.all(), 0)
         """
         self._get_datastore_stub().Clear()
+        self._uncounted_queries = 0
+    
+    def create_entities(self, model, count, fields=None, seed=0, batch_size=500):
+        """
+        Stores ``count`` generated ``model`` entities in the Data Store and
+        returns how many were stored. The same ``seed`` always gives the same
+        entities.
+        
+        ``fields`` maps property names to value generators (see
+        ``gaetestbed.factory``); other properties get values suited to
+        their type. The entities are put ``batch_size`` at a time, so
+        100,000 of them take seconds rather than minutes::
+        
+            from gaetestbed import factory
+            
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def test_front_page_scales(self):
+                    self.create_entities(models.Post, 100000, {
+                        'author': factory.zipf(1000),
+                        'tags': factory.list_of(factory.words(1, 1)),
+                    })
+                    with self.max_queries(2):
+                        render_front_page()
+        """
+        return EntityFactory(model, fields, seed).create(count, batch_size)
+    
+    def get_stub_sizes(self):
+        """
+        Adds the number of ``datastore_entities`` and of entries in the
+        ``datastore_query_history``.
+        """
+        sizes = super(DataStoreTestCase, self).get_stub_sizes()
+        stub = self._get_datastore_stub()
+        
+        entities = 0
+        for name in ('_DatastoreFileStub__entities_by_kind', '_DatastoreFileStub__entities'):
+            stored = getattr(stub, name, None)
+            if stored is not None:
+                entities = sum([len(kind) for kind in stored.values()])
+                break
+        
+        sizes['datastore_entities'] = entities
+        sizes['datastore_query_history'] = len(stub.QueryHistory())
+        return sizes
+    
+    def get_performance_metrics(self):
+        """
+        Adds the ``query_count`` to the test's metrics.
+        """
+        metrics = super(DataStoreTestCase, self).get_performance_metrics()
+        metrics['query_count'] = self.query_count
+        
+        runs = get_transaction_tracker().runs
+        metrics['transactions'] = len(runs)
+        metrics['transaction_retries'] = sum([run.retries for run in runs])
+        return metrics
     
     def max_queries(self, max_queries):
         """
@@ -173,14 +240,195 @@ class DataStoreTestCase(BaseTestCase):
                     # No queries have been run yet
                     self.assertEqual(self.query_count, 0)
                     
-                    # Run one query to count the number of models
-                    self.assertLength(models.MyModel.all(), 1)
+                    # Run one query to fetch the models
+                    models.MyModel.all().fetch(10)
                     
                     # Check that one query was run
                     self.assertEqual(self.query_count, 1)
+                    
+                    # Counting assertions aren't included
+                    self.assertLength(models.MyModel.all(), 1)
+                    self.assertEqual(self.query_count, 1)
         """
+        return self._get_query_history_count() - self._uncounted_queries
+    
+    def _get_query_history_count(self):
         count = 0
         queries = self._get_datastore_stub().QueryHistory()
         for n in queries.itervalues():
             count += n
         return count
+    
+    def _count(self, query, limit):
+        # The stub's query history can't be edited, so queries run by the
+        # assertions are subtracted from ``query_count`` instead.
+        before = self._get_query_history_count()
+        try:
+            return super(DataStoreTestCase, self)._count(query, limit)
+        finally:
+            self._uncounted_queries += self._get_query_history_count() - before
+    
+    def _count_stored_entities(self, kind):
+        # Looks in the stub's own storage, which holds entities by app and
+        # kind; it's called ``__entities_by_kind`` in newer SDKs.
+        stub = self._get_datastore_stub()
+        for name in ('_DatastoreFileStub__entities_by_kind', '_DatastoreFileStub__entities'):
+            entities = getattr(stub, name, None)
+            if entities is not None:
+                return sum([len(stored) for (app, stored_kind), stored in entities.items() if stored_kind == kind])
+        return None
+    
+    def assertQueryCount(self, query, n):
+        """
+        Assert that ``query`` matches exactly ``n`` entities.
+        
+        The count stops at ``n + 1``, so it costs the same however many
+        entities there are, and it isn't included in ``query_count``,
+        ``max_queries()`` or ``get_rpcs()``. For the cheapest count, pass a
+        keys-only query::
+        
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def test_create(self):
+                    create_models(3)
+                    self.assertQueryCount(models.MyModel.all(keys_only=True), 3)
+        """
+        count = self._count(query, n + 1)
+        if count > n:
+            self.fail("Expected %d entities, got more than %d" % (n, n))
+        self.assertEqual(count, n)
+    
+    def assertQueryCountAtMost(self, query, n):
+        """
+        Assert that ``query`` matches no more than ``n`` entities, counting
+        at most ``n + 1`` of them. Like ``assertQueryCount()``, it isn't
+        included in the test's query metrics.
+        """
+        if self._count(query, n + 1) > n:
+            self.fail("Expected at most %d entities, got more" % n)
+    
+    def assertQueryCountAtLeast(self, query, n):
+        """
+        Assert that ``query`` matches at least ``n`` entities, counting at
+        most ``n`` of them. Like ``assertQueryCount()``, it isn't included in
+        the test's query metrics. Any query passes for ``n <= 0``, so nothing
+        is counted.
+        """
+        if n <= 0:
+            return
+        
+        count = self._count(query, n)
+        if count < n:
+            self.fail("Expected at least %d entities, got %d" % (n, count))
+    
+    def assertEntityCount(self, model, n):
+        """
+        Assert that there are exactly ``n`` entities of ``model`` (a model
+        class or kind name) in the Data Store.
+        
+        The entities are counted in the stub's own storage, so no query is
+        run at all. If the SDK's stub doesn't keep them where it's expected
+        to, this falls back to a bounded keys-only count, as in
+        ``assertQueryCount()``.
+        """
+        if isinstance(model, basestring):
+            kind = model
+        else:
+            kind = model.kind()
+        
+        count = self._count_stored_entities(kind)
+        if count is None:
+            from google.appengine.ext import db
+            
+            if isinstance(model, basestring):
+                model = db.class_for_kind(model)
+            self.assertQueryCount(model.all(keys_only=True), n)
+        else:
+            self.assertEqual(count, n, "Expected %d %s entities, got %d" % (n, kind, count))
+    
+    def inject_transaction_collisions(self, rate, seed=0):
+        """
+        Makes ``rate`` (from ``0.0`` to ``1.0``) of the transaction commits
+        from here on fail with a collision, so ``db.run_in_transaction``
+        retries them just as it would in production. The same ``seed``
+        always fails the same commits.
+        
+        The injected collisions are counted in ``get_transactions()`` like
+        real ones, so retry paths can be exercised and measured::
+        
+            class MyTestCase(DataStoreTestCase, unittest.TestCase):
+                def test_increment_survives_contention(self):
+                    self.inject_transaction_collisions(0.5)
+                    counter = models.Counter.increment('hits')
+                    self.assertEqual(counter.count, 1)
+                    self.assertMaxTransactionRetries(3)
+        
+        Set ``TRANSACTION_COLLISION_RATE`` on the test case to inject them
+        in every test.
+        """
+        tracker = get_transaction_tracker()
+        tracker.collision_rate = rate
+        tracker.random.seed(seed)
+    
+    def get_transactions(self):
+        """
+        Returns a ``TransactionRun`` for each ``db.run_in_transaction`` call
+        in the test so far, with its ``attempts``, ``retries``,
+        ``collisions``, the ``entity_groups`` it touched, the number of
+        entities it ``writes`` and the seconds spent inside it
+        (``duration``).
+        
+        Calls are told apart by the datastore API calls they make: attempts
+        after a collision are retries of the same call.
+        """
+        return list(get_transaction_tracker().runs)
+    
+    def get_transaction_report(self):
+        """
+        Returns a line for each transaction in the test so far.
+        """
+        runs = self.get_transactions()
+        lines = ['%d transactions, %d retries' % (len(runs), sum([run.retries for run in runs]))]
+        for run in runs:
+            lines.append('  %d attempts  %d groups  %d writes  %8.1fms  %s' % (
+                len(run.attempts), len(run.entity_groups), run.writes, run.duration * 1000.0,
+                run.committed and 'committed' or 'failed',
+            ))
+        return '\n'.join(lines)
+    
+    def assertMaxTransactionRetries(self, n):
+        """
+        Assert that no transaction in the test so far was retried more than
+        ``n`` times.
+        """
+        for run in self.get_transactions():
+            if run.retries > n:
+                self.fail("Expected at most %d transaction retries, got %d" % (n, run.retries))
+    
+    def assertMaxEntityGroupsPerTransaction(self, n):
+        """
+        Assert that no transaction in the test so far touched more than ``n``
+        entity groups.
+        """
+        for run in self.get_transactions():
+            if len(run.entity_groups) > n:
+                self.fail("Expected at most %d entity groups in a transaction, got %d (%s)" % (
+                    n, len(run.entity_groups), ', '.join(sorted(run.entity_groups)),
+                ))
+    
+    def assertMaxTransactionWrites(self, n):
+        """
+        Assert that no transaction in the test so far wrote more than ``n``
+        entities in its commit.
+        """
+        for run in self.get_transactions():
+            if run.writes > n:
+                self.fail("Expected at most %d entities written in a transaction, got %d" % (n, run.writes))
+    
+    def assertTransactionsCommitted(self):
+        """
+        Assert that every transaction in the test so far committed, ie,
+        none ran out of retries or was rolled back.
+        """
+        for run in self.get_transactions():
+            if not run.committed:
+                self.fail("Transaction failed after %d attempts" % len(run.attempts))
@@ -0,0 +1,176 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import sys
+import threading
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from profiler import RequestProfile, _CPUTimer
+from rpc import get_rpc_recorder
+
+__all__ = ['DeferredCall', 'DEFERRED_URL']
+
+# Where ``deferred.defer()`` sends tasks unless it's given a ``_url``
+DEFERRED_URL = '/_ah/queue/deferred'
+
+def _describe(func):
+    name = getattr(func, '__name__', None)
+    if name is None:
+        # A callable instance
+        return '%s.%s' % (func.__class__.__module__, func.__class__.__name__)
+    
+    owner = getattr(func, 'im_class', None)
+    if owner is not None:
+        return '%s.%s.%s' % (owner.__module__, owner.__name__, name)
+    return '%s.%s' % (getattr(func, '__module__', None), name)
+
+class DeferredCall(object):
+    """
+    A task added with ``deferred.defer()``, decoded from its pickled
+    payload: the function it calls (``func``, described by ``name``), its
+    ``args`` and ``kwargs``, and the size of the pickle in bytes. ``func``
+    is ``None`` if the payload can't be unpickled.
+    
+    Payloads too big for a task are kept in the Data Store by the deferred
+    library; ``stored_in_datastore`` is then set and ``pickled_size`` is the
+    size of the stored pickle.
+    
+    The payload is only unpickled (and looked up in the Data Store) the
+    first time any of those are used, which fails the test if the stored
+    payload has gone missing.
+    
+    Once the task has been run with ``run()``, ``profile`` is a
+    ``RequestProfile`` of what it cost, and ``error`` is the exception
+    that failed it permanently, if one did.
+    """
+    def __init__(self, task, queue_name):
+        self.task = task
+        self.queue_name = queue_name
+        self.payload = task['decoded_body']
+        self.profile = None
+        self.error = None
+        self._decoded = None
+    
+    def _decode(self):
+        if self._decoded is not None:
+            return self._decoded
+        
+        from google.appengine.ext import deferred
+        
+        data = self.payload
+        stored_in_datastore = False
+        try:
+            func, args, kwargs = pickle.loads(data)
+        except Exception:
+            # The deferred handler fails these permanently when run
+            func, args, kwargs = None, (), {}
+        
+        if func is deferred.run_from_datastore:
+            # The deferred package only re-exports the public names of its
+            # deferred module
+            entity_class = getattr(deferred, 'deferred', deferred)._DeferredTaskEntity
+            
+            # Looking the payload up isn't one of the test's API calls
+            recorder = get_rpc_recorder()
+            recorder.pause()
+            try:
+                entity = entity_class.get(args[0])
+            finally:
+                recorder.resume()
+            
+            if entity is None:
+                raise AssertionError(
+                    'Deferred task %s in %s stores its payload in the Data Store, but the '
+                    '_DeferredTaskEntity %s is missing (was the datastore cleared?)' % (
+                        self.task['name'], self.queue_name, args[0],
+                    )
+                )
+            
+            data = entity.data
+            func, args, kwargs = pickle.loads(data)
+            stored_in_datastore = True
+        
+        if func is None:
+            name = '(unreadable payload)'
+        elif func is deferred.invoke_member:
+            # Methods are pickled as (instance, method name, args...)
+            name = '%s.%s' % (_describe(args[0].__class__), args[1])
+        else:
+            name = _describe(func)
+        
+        self._decoded = {
+            'func': func, 'args': args, 'kwargs': kwargs, 'name': name,
+            'pickled_size': len(data), 'stored_in_datastore': stored_in_datastore,
+        }
+        return self._decoded
+    
+    @property
+    def func(self):
+        return self._decode()['func']
+    
+    @property
+    def args(self):
+        return self._decode()['args']
+    
+    @property
+    def kwargs(self):
+        return self._decode()['kwargs']
+    
+    @property
+    def name(self):
+        return self._decode()['name']
+    
+    @property
+    def pickled_size(self):
+        return self._decode()['pickled_size']
+    
+    @property
+    def stored_in_datastore(self):
+        return self._decode()['stored_in_datastore']
+    
+    def run(self):
+        """
+        Runs the task the way the deferred handler does, recording its
+        wall time, CPU time and API calls in ``profile``.
+        
+        ``PermanentTaskFailure`` is kept in ``error`` (the handler drops
+        those tasks); anything else is raised, as a task that would be
+        retried is a bug the test should see.
+        """
+        from google.appengine.ext import deferred
+        
+        # Decoded first: running a stored payload deletes it
+        profile = RequestProfile('POST', self.name)
+        recorder = get_rpc_recorder()
+        first_record = len(recorder.records)
+        thread = threading.currentThread()
+        
+        profile.start = time.time()
+        cpu_timer = _CPUTimer()
+        cpu_timer.start()
+        try:
+            try:
+                deferred.run(self.payload)
+            except deferred.PermanentTaskFailure:
+                self.error = sys.exc_info()[1]
+        finally:
+            profile.cpu_time = cpu_timer.stop()
+            profile.end = time.time()
+            profile.wall_time = profile.end - profile.start
+            profile.rpcs = [r for r in recorder.records[first_record:] if r.thread is thread]
+            self.profile = profile
+        
+        return profile
+    
+    def __repr__(self):
+        return '<DeferredCall %s (%d bytes)>' % (self.name, self.pickled_size)
@@ -0,0 +1,250 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import bisect
+import datetime
+import random
+
+from rpc import get_rpc_recorder
+
+__all__ = [
+    'EntityFactory', 'zipf', 'long_tail', 'choice', 'sequence', 'words',
+    'list_of', 'date_between',
+]
+
+# The datastore won't take more than this many entities in a single put
+MAX_BATCH_SIZE = 500
+
+WORDS = (
+    'the', 'of', 'and', 'to', 'in', 'app', 'engine', 'data', 'store', 'test',
+    'user', 'page', 'model', 'query', 'task', 'queue', 'mail', 'cache', 'key',
+    'value', 'list', 'item', 'order', 'account', 'blog', 'post', 'comment',
+    'photo', 'tag', 'event', 'price', 'report', 'search', 'result', 'index',
+    'google', 'python', 'request', 'response', 'server', 'client', 'update',
+)
+
+# Each of these returns a generator, which is called with the factory's
+# random number generator and the index of the entity being made.
+
+def zipf(n, s=1.1):
+    """
+    Integers from ``0`` to ``n - 1`` following Zipf's law: ``0`` is the most
+    common, ``1`` about half as common, and so on. Use it for skewed keys,
+    like the owner of a post where a few users write most of them.
+    """
+    total = 0.0
+    cumulative = []
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** s
+        cumulative.append(total)
+    
+    def generate(rng, index):
+        return min(n - 1, bisect.bisect_left(cumulative, rng.random() * total))
+    return generate
+
+def long_tail(alpha=1.5, minimum=0, maximum=1000):
+    """
+    Integers from ``minimum`` to ``maximum`` with a Pareto distribution:
+    mostly small, with the occasional very large one. Use it for sizes,
+    like the number of tags on a post.
+    """
+    def generate(rng, index):
+        return min(maximum, minimum + int(rng.paretovariate(alpha)) - 1)
+    return generate
+
+def choice(values, weights=None):
+    """
+    One of ``values``, optionally weighted by ``weights``.
+    """
+    if weights is None:
+        return lambda rng, index: rng.choice(values)
+    
+    total = 0.0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    
+    def generate(rng, index):
+        return values[min(len(values) - 1, bisect.bisect_left(cumulative, rng.random() * total))]
+    return generate
+
+def sequence(format='%d', start=0):
+    """
+    ``format`` filled in with the index of the entity, ie, unique key
+    names: ``sequence('user-%06d')``.
+    """
+    return lambda rng, index: format % (start + index)
+
+def words(minimum=1, maximum=5, vocabulary=WORDS):
+    """
+    Text of ``minimum`` to ``maximum`` words, with a few words much more
+    common than the rest, as in real text.
+    """
+    word = zipf(len(vocabulary))
+    
+    def generate(rng, index):
+        count = rng.randint(minimum, maximum)
+        return ' '.join([vocabulary[word(rng, index)] for n in range(count)])
+    return generate
+
+def list_of(generator, size=None):
+    """
+    A list of values from ``generator``, of a ``size`` from another
+    generator (``long_tail(maximum=100)`` by default).
+    """
+    if size is None:
+        size = long_tail(maximum=100)
+    
+    def generate(rng, index):
+        return [generator(rng, index) for n in range(size(rng, index))]
+    return generate
+
+def date_between(start, end):
+    """
+    A ``datetime`` between ``start`` and ``end``, uniformly distributed.
+    """
+    seconds = int((end - start).days * 86400 + (end - start).seconds)
+    return lambda rng, index: start + datetime.timedelta(seconds=rng.randint(0, seconds))
+
+_START_DATE = datetime.datetime(2009, 1, 1)
+_END_DATE = datetime.datetime(2010, 1, 1)
+
+def _random_float(rng, index):
+    return rng.lognormvariate(0, 1)
+
+def _random_bool(rng, index):
+    return rng.random() < 0.5
+
+def _date_only(generator):
+    return lambda rng, index: generator(rng, index).date()
+
+# Property class name -> generator for properties that aren't given
+_DEFAULT_GENERATORS = {
+    'StringProperty': words(1, 5),
+    'TextProperty': words(10, 200),
+    'IntegerProperty': long_tail(maximum=1000000),
+    'FloatProperty': _random_float,
+    'BooleanProperty': _random_bool,
+    'DateTimeProperty': date_between(_START_DATE, _END_DATE),
+    'DateProperty': _date_only(date_between(_START_DATE, _END_DATE)),
+    'StringListProperty': list_of(words(1, 1)),
+}
+
+def _default_generator(prop):
+    if getattr(prop, 'auto_now', False) or getattr(prop, 'auto_now_add', False):
+        return None
+    
+    # A declared default is the model's to fill in. List properties always
+    # default to an empty list, so only a non-empty one counts.
+    if prop.default is not None and prop.default != []:
+        return None
+    
+    # Anything else would fail validation
+    if prop.choices:
+        return choice(list(prop.choices))
+    
+    name = prop.__class__.__name__
+    if name == 'ListProperty':
+        if prop.item_type in (int, long):
+            return list_of(long_tail(maximum=1000000))
+        if prop.item_type in (str, unicode, basestring):
+            return list_of(words(1, 1))
+        return None
+    
+    return _DEFAULT_GENERATORS.get(name)
+
+class EntityFactory(object):
+    """
+    Makes any number of ``model`` entities, the same ones every time for the
+    same ``seed``.
+    
+    ``fields`` maps property names (and ``key_name`` or ``parent``) to a
+    generator from this module, any callable taking ``(rng, index)``, or a
+    constant. Properties that aren't given get one of their ``choices``,
+    or values suited to their type (short text for strings, long tail
+    integers, dates in 2009, and so on); properties with a ``default``, and
+    anything else, are left to the model::
+        
+        from gaetestbed import factory
+        
+        posts = factory.EntityFactory(models.Post, {
+            'key_name': factory.sequence('post-%06d'),
+            'author': factory.zipf(1000),
+            'tags': factory.list_of(factory.words(1, 1), factory.long_tail(maximum=50)),
+        })
+        posts.create(100000)
+    
+    Entities are made and stored ``batch_size`` at a time, so no more than
+    one batch of model instances is ever in memory.
+    """
+    def __init__(self, model, fields=None, seed=0):
+        self.model = model
+        self.seed = seed
+        
+        generators = {}
+        for name, prop in model.properties().items():
+            generator = _default_generator(prop)
+            if generator is not None:
+                generators[name] = generator
+        
+        for name, value in (fields or {}).items():
+            if not callable(value):
+                value = self._constant(value)
+            generators[name] = value
+        
+        self.generators = sorted(generators.items())
+    
+    def _constant(self, value):
+        return lambda rng, index: value
+    
+    def iter_values(self, count):
+        """
+        Yields the ``count`` dictionaries of constructor arguments, one at a
+        time.
+        """
+        rng = random.Random(self.seed)
+        for index in xrange(count):
+            yield dict([(str(name), generate(rng, index)) for name, generate in self.generators])
+    
+    def iter_batches(self, count, batch_size=MAX_BATCH_SIZE):
+        """
+        Yields the ``count`` entities (unsaved) in lists of ``batch_size``.
+        """
+        batch = []
+        for values in self.iter_values(count):
+            batch.append(self.model(**values))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        
+        if batch:
+            yield batch
+    
+    def create(self, count, batch_size=MAX_BATCH_SIZE):
+        """
+        Stores ``count`` entities with one ``db.put`` per batch and returns
+        how many were stored.
+        
+        The puts aren't recorded as the test's API calls, so loading the data
+        doesn't count against the test's metrics.
+        """
+        from google.appengine.ext import db
+        
+        recorder = get_rpc_recorder()
+        created = 0
+        
+        recorder.pause()
+        try:
+            for batch in self.iter_batches(count, min(batch_size, MAX_BATCH_SIZE)):
+                db.put(batch)
+                created += len(batch)
+        finally:
+            recorder.resume()
+        
+        return created
@@ -0,0 +1,137 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import atexit
+import os
+import sys
+import time
+
+__all__ = ['FixtureTimer', 'timed_fixture', 'get_fixture_timer']
+
+# Set this environment variable to print the fixture report when the test
+# run finishes
+REPORT_ENVIRON_KEY = 'GAETESTBED_FIXTURE_REPORT'
+
+class FixtureTimer(object):
+    """
+    Adds up the time spent in each mixin's ``setUp`` and ``tearDown`` over
+    the whole run, and the time spent in the tests themselves.
+    
+    Fixture times are exclusive: the time ``DataStoreTestCase.setUp`` spends
+    waiting on ``BaseTestCase.setUp`` (through ``super()``) is counted
+    against ``BaseTestCase.setUp`` only. The test body time runs from the end
+    of the outermost timed ``setUp`` to the start of the outermost timed
+    ``tearDown``, so it includes your own ``setUp`` code after ``super()``.
+    """
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """
+        Forgets everything timed so far.
+        """
+        # Fixture name -> [calls, seconds]
+        self.fixtures = {}
+        self.tests = 0
+        self.body_time = 0.0
+        self._stack = []
+        self._body_start = None
+    
+    def start(self, name):
+        now = time.time()
+        if not self._stack and self._body_start is not None:
+            self.body_time += now - self._body_start
+            self._body_start = None
+        self._stack.append([name, now, 0.0])
+    
+    def stop(self, body_follows=False):
+        now = time.time()
+        name, start, nested = self._stack.pop()
+        elapsed = now - start
+        
+        stats = self.fixtures.setdefault(name, [0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed - nested
+        
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        elif body_follows:
+            self.tests += 1
+            self._body_start = now
+    
+    @property
+    def harness_time(self):
+        """
+        Seconds spent in all of the timed fixtures.
+        """
+        return sum([seconds for calls, seconds in self.fixtures.values()])
+    
+    def slowest(self, limit=None):
+        """
+        Returns ``(name, calls, seconds)`` for each fixture, most total time
+        first.
+        """
+        fixtures = [(name, calls, seconds) for name, (calls, seconds) in self.fixtures.items()]
+        fixtures.sort(key=lambda f: -f[2])
+        return fixtures[:limit]
+    
+    def format(self, limit=10):
+        """
+        Returns the harness overhead against the test body time, followed by
+        the ``limit`` slowest fixtures.
+        """
+        total = self.harness_time + self.body_time
+        lines = ['%d tests: %.1fms in fixtures (%.0f%%), %.1fms in test bodies' % (
+            self.tests, self.harness_time * 1000.0,
+            total and self.harness_time / total * 100 or 0, self.body_time * 1000.0,
+        )]
+        for name, calls, seconds in self.slowest(limit):
+            lines.append('  %10.1fms %6d calls %8.2fms/call  %s' % (
+                seconds * 1000.0, calls, seconds / calls * 1000.0, name,
+            ))
+        return '\n'.join(lines)
+    
+    def __str__(self):
+        return self.format()
+
+_timer = FixtureTimer()
+
+def get_fixture_timer():
+    """
+    Returns the ``FixtureTimer`` shared by all test cases.
+    """
+    return _timer
+
+def timed_fixture(name):
+    """
+    Decorates a ``setUp`` or ``tearDown`` method so its time is added to
+    the fixture ``name`` (ie, ``'DataStoreTestCase.setUp'``).
+    """
+    def decorator(method):
+        body_follows = method.__name__ == 'setUp'
+        
+        def wrapper(self, *args, **kwargs):
+            _timer.start(name)
+            try:
+                result = method(self, *args, **kwargs)
+            except:
+                _timer.stop()
+                raise
+            _timer.stop(body_follows)
+            return result
+        
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorator
+
+def _print_report():
+    if _timer.fixtures and os.environ.get(REPORT_ENVIRON_KEY, '') not in ('', '0'):
+        sys.stderr.write('\n%s\n' % _timer.format())
+
+atexit.register(_print_report)
@@ -0,0 +1,416 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import atexit
+import inspect
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+try:
+    from nose.plugins import Plugin
+except ImportError:
+    Plugin = object
+
+from rpc import get_rpc_recorder
+
+__all__ = [
+    'CoverageMap', 'ImpactPlugin', 'get_coverage_map', 'get_coverage_recorder',
+    'coverage_map_path', 'memcache_prefix',
+]
+
+# Set this environment variable to the path of a JSON file to record what
+# every test touches into it
+ENVIRON_KEY = 'GAETESTBED_COVERAGE_MAP'
+
+DEFAULT_COVERAGE_FILE = '.gaetestbed-coverage.json'
+
+# What a test can touch: datastore kinds, memcache key prefixes, task
+# queues and web routes (handler classes, or ``route_for()`` routes when
+# the handler can't be found)
+FIELDS = ('kinds', 'memcache', 'queues', 'routes')
+
+# Memcache keys are usually a prefix followed by an ID, ie, ``user:123``
+MEMCACHE_PREFIX_RE = re.compile(r'^(.*?)[:/.|\-]')
+TRAILING_DIGITS_RE = re.compile(r'\d+$')
+
+def coverage_map_path():
+    """
+    Returns the coverage map file given with ``GAETESTBED_COVERAGE_MAP``,
+    or ``None``.
+    """
+    return os.environ.get(ENVIRON_KEY) or None
+
+def memcache_prefix(key):
+    """
+    Returns the part of a memcache key that names what it's caching: what
+    comes before the first ``:``, ``/``, ``.``, ``|`` or ``-``, or the key
+    without any trailing digits.
+    """
+    match = MEMCACHE_PREFIX_RE.match(key)
+    if match and match.group(1):
+        return match.group(1)
+    return TRAILING_DIGITS_RE.sub('', key) or key
+
+def _kind(reference):
+    path = reference.path()
+    return path.element(path.element_size() - 1).type()
+
+def _memcache_keys(method, request):
+    if method == 'Get':
+        return request.key_list()
+    if method in ('Set', 'Delete', 'BatchIncrement'):
+        return [item.key() for item in request.item_list()]
+    if method == 'Increment':
+        return [request.key()]
+    return []
+
+class _CoverageRecorder(object):
+    """
+    Collects what the current test touches from the RPC recorder's finished
+    calls, while ``touched`` isn't ``None``.
+    
+    Calls made while the recorder is paused count too: data loaded with
+    ``create_entities()`` and the queries run by counting assertions are
+    left out of the test's metrics, but the test still depends on their
+    kinds.
+    """
+    def __init__(self):
+        self.touched = None
+    
+    def start_test(self):
+        self.touched = dict([(field, set()) for field in FIELDS])
+    
+    def stop_test(self):
+        """
+        Stops recording and returns what the test touched, as a dictionary
+        of each field to a sorted list.
+        """
+        touched, self.touched = self.touched, None
+        if touched is None:
+            return None
+        return dict([(field, sorted(values)) for field, values in touched.items()])
+    
+    def add_route(self, route):
+        if self.touched is not None:
+            self.touched['routes'].add(route)
+    
+    def __call__(self, record):
+        if self.touched is None:
+            return
+        
+        request = record.request
+        if record.service == 'datastore_v3':
+            kinds = self.touched['kinds']
+            if record.method in ('Get', 'Delete'):
+                for key in request.key_list():
+                    kinds.add(_kind(key))
+            elif record.method == 'Put':
+                for entity in request.entity_list():
+                    kinds.add(_kind(entity.key()))
+            elif record.method in ('RunQuery', 'Count') and request.has_kind():
+                kinds.add(request.kind())
+        
+        elif record.service == 'memcache':
+            for key in _memcache_keys(record.method, request):
+                self.touched['memcache'].add(memcache_prefix(key))
+        
+        elif record.service == 'taskqueue':
+            if record.method == 'BulkAdd':
+                for add_request in request.add_request_list():
+                    self.touched['queues'].add(add_request.queue_name())
+            elif hasattr(request, 'queue_name'):
+                self.touched['queues'].add(request.queue_name())
+
+_recorder = _CoverageRecorder()
+
+def get_coverage_recorder():
+    """
+    Returns the recorder collecting what the current test touches, hooked
+    up to the RPC recorder.
+    """
+    get_rpc_recorder().add_listener(_recorder, paused=True)
+    return _recorder
+
+def _module_name(path, root):
+    root = os.path.abspath(root or os.getcwd())
+    path = os.path.abspath(os.path.join(root, path))
+    if not path.endswith('.py') or not path.startswith(root + os.sep):
+        return None
+    
+    name = path[len(root) + 1:-len('.py')].replace(os.sep, '.')
+    if name.endswith('.__init__'):
+        name = name[:-len('.__init__')]
+    return name
+
+def _inspect_module(name):
+    # Returns the kinds of the models the module defines, the names of the
+    # other classes it defines, and whether it holds test cases.
+    try:
+        __import__(name)
+    except Exception:
+        return None
+    module = sys.modules[name]
+    
+    try:
+        from google.appengine.ext import db
+        model = db.Model
+    except ImportError:
+        model = None
+    
+    kinds, classes, has_tests = [], [], False
+    for value in vars(module).values():
+        if not inspect.isclass(value) or value.__module__ != name:
+            continue
+        
+        if model is not None and issubclass(value, model):
+            kinds.append(value.kind())
+        elif issubclass(value, unittest.TestCase):
+            has_tests = True
+        else:
+            classes.append('%s.%s' % (name, value.__name__))
+    return kinds, classes, has_tests
+
+class CoverageMap(object):
+    """
+    What each test touched (datastore kinds, memcache key prefixes, task
+    queues and web routes) the last time it ran, stored as JSON in
+    ``path``.
+    
+    ``tests`` maps each test's id to a dictionary of field (see
+    ``FIELDS``) to a list of the things it touched.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tests = self._load()
+        self.updated = {}
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        
+        f = open(self.path)
+        try:
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+        finally:
+            f.close()
+    
+    def update(self, test_id, touched):
+        """
+        Replaces what ``test_id`` touched. Call ``save()`` to write it out.
+        """
+        self.tests[test_id] = touched
+        self.updated[test_id] = touched
+    
+    def save(self):
+        """
+        Writes the updated tests back to ``path``. The file is read again
+        first, so runs of only some of the tests (or the parallel runner's
+        workers) keep everyone else's entries.
+        """
+        if not self.updated:
+            return
+        
+        tests = self._load()
+        tests.update(self.updated)
+        
+        f = open(self.path, 'w')
+        try:
+            json.dump(tests, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        
+        self.tests = tests
+        self.updated = {}
+    
+    def get_changes(self, entries, root=None):
+        """
+        Works out what changed from ``entries``: changed files (ie, from
+        ``git diff --name-only``), relative to ``root``, or things named
+        directly as ``field:value`` (ie, ``kinds:BlogPost``,
+        ``memcache:user``, ``queues:mail``).
+        
+        Returns a dictionary of each field to a set of changed values, plus
+        the changed test ``modules``, or ``None`` if something changed whose
+        impact can't be worked out from the map: a file that isn't Python,
+        or a module that defines no models, handlers or tests seen before.
+        A model module changes the kinds it defines, and a handler module
+        the routes served by its classes.
+        """
+        changes = dict([(field, set()) for field in FIELDS + ('modules',)])
+        
+        routes = set()
+        for touched in self.tests.values():
+            routes.update(touched.get('routes', []))
+        
+        for entry in entries:
+            field, value = (entry.split(':', 1) + [''])[:2]
+            if field in FIELDS and value:
+                changes[field].add(value)
+                continue
+            
+            name = _module_name(entry, root)
+            found = name and _inspect_module(name)
+            if not found:
+                return None
+            
+            kinds, classes, has_tests = found
+            handlers = [c for c in classes if c in routes]
+            if has_tests:
+                changes['modules'].add(name)
+            elif kinds or handlers:
+                changes['kinds'].update(kinds)
+                changes['routes'].update(handlers)
+            else:
+                return None
+        
+        return changes
+    
+    def is_affected(self, test_id, changes):
+        """
+        Returns whether ``test_id`` could be affected by ``changes`` (from
+        ``get_changes()``). Tests that aren't in the map always are.
+        """
+        touched = self.tests.get(test_id)
+        if changes is None or touched is None:
+            return True
+        
+        for module in changes['modules']:
+            if test_id.startswith(module + '.'):
+                return True
+        
+        for field in FIELDS:
+            for value in touched.get(field, []):
+                if value in changes[field]:
+                    return True
+        return False
+
+_coverage_maps = {}
+
+def _save_coverage_maps():
+    for coverage_map in _coverage_maps.values():
+        coverage_map.save()
+
+atexit.register(_save_coverage_maps)
+
+def get_coverage_map(path):
+    """
+    Returns the ``CoverageMap`` stored in ``path``, loading it the first
+    time. Changed maps are saved when the process exits.
+    """
+    path = os.path.abspath(path)
+    if path not in _coverage_maps:
+        _coverage_maps[path] = CoverageMap(path)
+    return _coverage_maps[path]
+
+def _git_changes(since, root):
+    process = subprocess.Popen(
+        ['git', 'diff', '--name-only', since], cwd=root, stdout=subprocess.PIPE,
+    )
+    output = process.communicate()[0]
+    if process.returncode:
+        return None
+    
+    top = subprocess.Popen(
+        ['git', 'rev-parse', '--show-toplevel'], cwd=root, stdout=subprocess.PIPE,
+    ).communicate()[0].strip()
+    return [os.path.join(top, name) for name in output.splitlines() if name]
+
+class ImpactPlugin(Plugin):
+    """
+    A nose plugin that records what every test touches, and can then run
+    only the tests that touched what changed.
+    
+    Run with ``--with-gaetestbed-impact`` to record the coverage map (in
+    ``--gaetestbed-coverage-map``, which defaults to
+    ``.gaetestbed-coverage.json``). Add ``--gaetestbed-since=REV`` to only
+    run the tests affected by the files changed since ``REV``, or
+    ``--gaetestbed-changed`` to name the changes yourself::
+        
+        $ nosetests --with-gae --with-gaetestbed-impact
+        $ nosetests --with-gae --with-gaetestbed-impact --gaetestbed-since=HEAD
+        $ nosetests --with-gae --with-gaetestbed-impact --gaetestbed-changed=models.py,memcache:user
+    
+    Tests that aren't in the map yet are always run, as is everything if a
+    change can't be traced (see ``CoverageMap.get_changes()``). The tests
+    that do run update their entries in the map.
+    
+    The selection is a heuristic, not a guarantee. It only knows what went
+    through the API proxy (and which routes were requested) the last time
+    each test ran. Tests that depend on a changed module some other way,
+    such as a helper or a constant that changes which kinds they touch,
+    can be skipped. Run the whole suite before you ship.
+    """
+    name = 'gaetestbed-impact'
+    score = 2
+    
+    def options(self, parser, env=os.environ):
+        Plugin.options(self, parser, env)
+        parser.add_option(
+            '--gaetestbed-coverage-map', dest='gaetestbed_coverage_map',
+            default=env.get(ENVIRON_KEY, DEFAULT_COVERAGE_FILE),
+            help='File holding what each test touched [GAETESTBED_COVERAGE_MAP]',
+        )
+        parser.add_option(
+            '--gaetestbed-since', dest='gaetestbed_since',
+            help='Only run tests affected by the files changed since this git revision',
+        )
+        parser.add_option(
+            '--gaetestbed-changed', dest='gaetestbed_changed',
+            help='Only run tests affected by these changes (comma-separated files or field:value)',
+        )
+    
+    def configure(self, options, conf):
+        Plugin.configure(self, options, conf)
+        if not self.enabled:
+            return
+        
+        self.coverage_map = get_coverage_map(options.gaetestbed_coverage_map)
+        self.since = options.gaetestbed_since
+        self.changed = options.gaetestbed_changed
+        self.root_path = conf.workingDir
+        self.changes = None
+        
+        # Test cases record into the map while this is set, which also
+        # carries it into the parallel runner's workers
+        os.environ[ENVIRON_KEY] = self.coverage_map.path
+    
+    def begin(self):
+        # Model and handler modules are imported to find what they define,
+        # so this waits until the SDK is on the path.
+        entries = None
+        if self.since:
+            entries = _git_changes(self.since, self.root_path)
+        if self.changed:
+            entries = (entries or []) + [e.strip() for e in self.changed.split(',') if e.strip()]
+        
+        if entries is not None:
+            self.changes = self.coverage_map.get_changes(entries, self.root_path)
+    
+    def wantMethod(self, method):
+        if self.changes is None:
+            return None
+        
+        test_class = getattr(method, 'im_class', None)
+        if test_class is None:
+            return None
+        
+        test_id = '%s.%s.%s' % (test_class.__module__, test_class.__name__, method.__name__)
+        if self.coverage_map.is_affected(test_id, self.changes):
+            return None
+        return False
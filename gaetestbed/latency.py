@@ -0,0 +1,155 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import heapq
+
+__all__ = ['Cost', 'LatencyModel', 'LatencyProjection', 'DEFAULT_COSTS', 'get_default_model']
+
+class Cost(object):
+    """
+    What a single API call costs in production, in milliseconds: ``p50``
+    (the median) and ``p95`` (three times the median if not given), plus
+    ``per_kb`` for every kilobyte sent and received.
+    """
+    def __init__(self, p50, p95=None, per_kb=0.0):
+        if p95 is None:
+            p95 = p50 * 3
+        self.p50 = p50
+        self.p95 = p95
+        self.per_kb = per_kb
+    
+    def estimate(self, size, quantile='p50'):
+        """
+        Returns the cost in milliseconds of a call moving ``size`` bytes.
+        """
+        return getattr(self, quantile) + self.per_kb * size / 1024.0
+    
+    def __repr__(self):
+        return '<Cost p50=%sms p95=%sms per_kb=%sms>' % (self.p50, self.p95, self.per_kb)
+
+# Rough production costs, by ``service.method`` or just ``service``. They're
+# meant as a starting point; pass your own measurements to LatencyModel.
+DEFAULT_COSTS = {
+    'datastore_v3': Cost(20, 80, 0.05),
+    'datastore_v3.Get': Cost(10, 40, 0.05),
+    'datastore_v3.Put': Cost(25, 100, 0.1),
+    'datastore_v3.Delete': Cost(20, 80),
+    'datastore_v3.RunQuery': Cost(30, 120, 0.05),
+    'datastore_v3.Next': Cost(20, 80, 0.05),
+    'datastore_v3.Count': Cost(30, 150),
+    'datastore_v3.BeginTransaction': Cost(10, 40),
+    'datastore_v3.Commit': Cost(30, 120),
+    'datastore_v3.Rollback': Cost(10, 40),
+    'datastore_v3.AllocateIds': Cost(10, 40),
+    'memcache': Cost(1.5, 5, 0.01),
+    'taskqueue': Cost(8, 30, 0.02),
+    'taskqueue.BulkAdd': Cost(10, 40, 0.02),
+    'urlfetch': Cost(100, 500, 0.1),
+    'mail': Cost(30, 100, 0.02),
+    'user': Cost(1, 3),
+}
+
+# The cost of calls to services that aren't in the model at all
+DEFAULT_COST = Cost(10, 40)
+
+def _size(message):
+    try:
+        return message.ByteSize()
+    except AttributeError:
+        return 0
+
+class LatencyProjection(object):
+    """
+    The projected production latency of a test or request, in
+    milliseconds.
+    
+    ``wall_time`` is how long it took locally, ``rpc_time`` the total cost of
+    its API calls one after the other, and ``projected_time`` how long it
+    would take in production: the local time with every API call stretched
+    to its production cost. Calls that overlapped locally are assumed to
+    overlap in production too. ``costs`` holds ``(record, cost)`` for every
+    call.
+    """
+    def __init__(self, wall_time, projected_time, costs):
+        self.wall_time = wall_time
+        self.projected_time = projected_time
+        self.costs = costs
+    
+    @property
+    def rpc_time(self):
+        return sum([cost for record, cost in self.costs])
+    
+    def format(self):
+        lines = ['Projected %.1fms (%.1fms locally, %.1fms of API calls)' % (
+            self.projected_time, self.wall_time, self.rpc_time,
+        )]
+        for record, cost in self.costs:
+            lines.append('  %8.1fms  %s.%s' % (cost, record.service, record.method))
+        return '\n'.join(lines)
+    
+    def __str__(self):
+        return self.format()
+
+class LatencyModel(object):
+    """
+    Works out how long API calls would take in production, from ``costs``
+    (a dictionary of ``service.method`` or ``service`` to ``Cost``), falling
+    back to ``DEFAULT_COSTS`` and then ``default``.
+    """
+    def __init__(self, costs=None, default=DEFAULT_COST):
+        self.costs = dict(DEFAULT_COSTS)
+        self.costs.update(costs or {})
+        self.default = default
+    
+    def cost(self, record, quantile='p50'):
+        """
+        Returns the production cost of the ``RPCRecord`` in milliseconds.
+        """
+        cost = self.costs.get('%s.%s' % (record.service, record.method))
+        if cost is None:
+            cost = self.costs.get(record.service, self.default)
+        return cost.estimate(_size(record.request) + _size(record.response), quantile)
+    
+    def project(self, waterfall, quantile='p50'):
+        """
+        Returns a ``LatencyProjection`` for the calls in ``waterfall``.
+        
+        Every call is pushed back by the extra production time of the calls
+        that had finished before it started, so calls made one after the
+        other add up while calls made in parallel don't.
+        """
+        costs = []
+        finished = []
+        delay = 0.0
+        latest = 0.0
+        
+        for record in waterfall.records:
+            while finished and finished[0][0] <= record.start:
+                delay = max(delay, heapq.heappop(finished)[1])
+            
+            cost = self.cost(record, quantile)
+            costs.append((record, cost))
+            
+            # How much later than locally anything after this call happens
+            lateness = delay + cost - record.duration * 1000.0
+            heapq.heappush(finished, (record.end, lateness))
+            latest = max(latest, lateness)
+        
+        wall_time = waterfall.wall_time * 1000.0
+        return LatencyProjection(wall_time, wall_time + latest, costs)
+
+_default_model = None
+
+def get_default_model():
+    """
+    Returns a ``LatencyModel`` using ``DEFAULT_COSTS``.
+    """
+    global _default_model
+    if _default_model is None:
+        _default_model = LatencyModel()
+    return _default_model
@@ -0,0 +1,171 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import sys
+import threading
+import time
+
+from rpc import get_rpc_recorder
+from stats import mean, percentile
+
+__all__ = ['LoadReport', 'run_load']
+
+class LoadReport(object):
+    """
+    The results of a ``run_load()``.
+    
+    ``latencies`` are in seconds and ``rpc_counts`` holds the number of API
+    calls made by each request, both in the order the requests finished.
+    The percentile properties are in milliseconds. Any exceptions raised
+    while making requests are kept in ``exceptions``.
+    """
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.duration = 0.0
+        self.latencies = []
+        self.rpc_counts = []
+        self.statuses = {}
+        self.errors = 0
+        self.exceptions = []
+    
+    @property
+    def requests(self):
+        return len(self.latencies)
+    
+    @property
+    def throughput(self):
+        """
+        Requests per second over the whole run.
+        """
+        if not self.duration:
+            return 0.0
+        return self.requests / self.duration
+    
+    def percentile(self, p):
+        """
+        The ``p``-th percentile latency, in milliseconds.
+        """
+        value = percentile(self.latencies, p)
+        if value is None:
+            return None
+        return value * 1000.0
+    
+    @property
+    def p50(self):
+        return self.percentile(50)
+    
+    @property
+    def p95(self):
+        return self.percentile(95)
+    
+    @property
+    def p99(self):
+        return self.percentile(99)
+    
+    @property
+    def rpcs_per_request(self):
+        return mean(self.rpc_counts) or 0.0
+    
+    @property
+    def max_rpcs_per_request(self):
+        return max(self.rpc_counts or [0])
+    
+    def __str__(self):
+        return ('%d requests (%d errors) in %.2fs with concurrency %d: %.1f req/s, '
+                'p50 %.1fms, p95 %.1fms, p99 %.1fms, %.1f RPCs/request') % (
+            self.requests, self.errors, self.duration, self.concurrency,
+            self.throughput, self.p50 or 0, self.p95 or 0, self.p99 or 0,
+            self.rpcs_per_request,
+        )
+
+def _get_script(path_or_script):
+    if callable(path_or_script):
+        return lambda app, i: path_or_script(app)
+    
+    if isinstance(path_or_script, basestring):
+        paths = [path_or_script]
+    else:
+        paths = list(path_or_script)
+    
+    return lambda app, i: app.get(paths[i % len(paths)], status='*')
+
+def run_load(application, path_or_script, concurrency=1, requests=1):
+    """
+    Drives the WSGI ``application`` with ``requests`` requests from
+    ``concurrency`` threads and returns a ``LoadReport``.
+    
+    ``path_or_script`` is either a path to ``GET``, a list of paths (used in
+    turn), or a callable that takes a ``webtest.TestApp`` and makes one
+    request with it, returning the response. Each thread gets its own
+    ``TestApp`` so cookies aren't shared between them.
+    
+    Requests that raise an exception, or return a 5xx status, are counted
+    as errors.
+    """
+    import webtest
+    
+    script = _get_script(path_or_script)
+    recorder = get_rpc_recorder()
+    report = LoadReport(concurrency)
+    lock = threading.Lock()
+    counter = [0]
+    
+    def next_request():
+        lock.acquire()
+        try:
+            if counter[0] >= requests:
+                return None
+            counter[0] += 1
+            return counter[0] - 1
+        finally:
+            lock.release()
+    
+    def worker():
+        app = webtest.TestApp(application)
+        thread = threading.currentThread()
+        
+        i = next_request()
+        while i is not None:
+            first_record = len(recorder.records)
+            start = time.time()
+            
+            status = None
+            exception = None
+            try:
+                response = script(app, i)
+                status = getattr(response, 'status_int', None)
+            except Exception:
+                exception = sys.exc_info()[1]
+            
+            elapsed = time.time() - start
+            rpcs = len([r for r in recorder.records[first_record:] if r.thread is thread])
+            
+            lock.acquire()
+            try:
+                report.latencies.append(elapsed)
+                report.rpc_counts.append(rpcs)
+                report.statuses[status] = report.statuses.get(status, 0) + 1
+                if status is None or status >= 500:
+                    report.errors += 1
+                if exception is not None:
+                    report.exceptions.append(exception)
+            finally:
+                lock.release()
+            
+            i = next_request()
+    
+    threads = [threading.Thread(target=worker) for n in range(concurrency)]
+    
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.duration = time.time() - start
+    
+    return report
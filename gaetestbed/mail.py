@@ -6,9 +6,9 @@
 # This software is licensed as described in the file COPYING.txt,
 # which you should have received as part of this distribution.
 
-from google.appengine.api import apiproxy_stub_map, mail_stub
-
 from base import BaseTestCase
+from fixtures import timed_fixture
+from stubs import replace_stub
 
 __all__ = ['MailTestCase']
 
@@ -64,6 +64,9 @@ class MailTestCase(BaseTestCase):
                 
                 self.assertEmailSent()
     """
+    REQUIRED_STUBS = ('mail',)
+    
+    @timed_fixture('MailTestCase.setUp')
     def setUp(self):
         """
         This method is called at the start of each test case.
@@ -97,16 +100,15 @@ class MailTestCase(BaseTestCase):
         as sent, and adds it to the list of sent messages. You can retrieve the sent
         messages that are intercepted with the ``get_sent_messages`` helper method.
         """
+        from google.appengine.api import mail_stub
+        
         test_case = self
         class MailStub(mail_stub.MailServiceStub):
             def _GenerateLog(self, method, message, log, *args, **kwargs):
                 test_case._sent_messages.append(message)
                 return super(MailStub, self)._GenerateLog(method, message, log, *args, **kwargs)
         
-        if 'mail' in apiproxy_stub_map.apiproxy._APIProxyStubMap__stub_map:
-            del apiproxy_stub_map.apiproxy._APIProxyStubMap__stub_map['mail']
-        
-        apiproxy_stub_map.apiproxy.RegisterStub('mail', MailStub())
+        replace_stub('mail', MailStub())
     
     def clear_sent_messages(self):
         """
@@ -142,6 +144,14 @@ class MailTestCase(BaseTestCase):
         """
         self._sent_messages = []
     
+    def get_stub_sizes(self):
+        """
+        Adds the number of ``sent_messages`` captured so far.
+        """
+        sizes = super(MailTestCase, self).get_stub_sizes()
+        sizes['sent_messages'] = len(self._sent_messages)
+        return sizes
+    
     def get_sent_messages(self, to=None, sender=None, subject=None, body=None, html=None):
         """
         Returns a list of ``mail.EmailMessage`` that would've been sent via App
@@ -6,12 +6,102 @@
 # This software is licensed as described in the file COPYING.txt,
 # which you should have received as part of this distribution.
 
-from google.appengine.api import memcache
-
 from base import BaseTestCase
+from fixtures import timed_fixture
+from rpc import get_rpc_recorder
+from stats import peak_rate
 
 __all__ = ['MemcacheTestCase']
 
+class _KeyStats(object):
+    """
+    The operations made on a single memcache key during a test.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.times = []
+        self.counts = {}
+        self.cas_failures = 0
+        self.cas_retries = 0
+        self.max_cas_retries = 0
+    
+    def add(self, op, now):
+        self.times.append(now)
+        self.counts[op] = self.counts.get(op, 0) + 1
+    
+    def add_cas(self, stored, now):
+        self.add('cas', now)
+        if stored:
+            self.cas_retries = 0
+        else:
+            # Each failure in a row means the caller has to get and try again
+            self.cas_failures += 1
+            self.cas_retries += 1
+            self.max_cas_retries = max(self.max_cas_retries, self.cas_retries)
+
+class _KeyTracker(object):
+    """
+    Records every operation on every memcache key, timed with the current
+    test's ``VirtualClock``, from the RPC recorder's finished calls.
+    """
+    def __init__(self):
+        self.reset(None)
+    
+    def reset(self, clock):
+        self.clock = clock
+        self.keys = {}
+    
+    def _get(self, key):
+        if key not in self.keys:
+            self.keys[key] = _KeyStats(key)
+        return self.keys[key]
+    
+    def __call__(self, record):
+        if record.service != 'memcache' or self.clock is None:
+            return
+        
+        from google.appengine.api.memcache import memcache_service_pb as pb
+        
+        now = self.clock.now()
+        request = record.request
+        
+        if record.method == 'Get':
+            op = getattr(request, 'for_cas', lambda: False)() and 'gets' or 'get'
+            for key in request.key_list():
+                self._get(key).add(op, now)
+        
+        elif record.method == 'Set':
+            statuses = record.response.set_status_list()
+            for i, item in enumerate(request.item_list()):
+                policy = item.set_policy()
+                if policy == getattr(pb.MemcacheSetRequest, 'CAS', None):
+                    stored = i < len(statuses) and statuses[i] == pb.MemcacheSetResponse.STORED
+                    self._get(item.key()).add_cas(stored, now)
+                elif policy == pb.MemcacheSetRequest.ADD:
+                    self._get(item.key()).add('add', now)
+                elif policy == pb.MemcacheSetRequest.REPLACE:
+                    self._get(item.key()).add('replace', now)
+                else:
+                    self._get(item.key()).add('set', now)
+        
+        elif record.method == 'Delete':
+            for item in request.item_list():
+                self._get(item.key()).add('delete', now)
+        
+        elif record.method in ('Increment', 'BatchIncrement'):
+            if record.method == 'Increment':
+                items = [request]
+            else:
+                items = request.item_list()
+            
+            for item in items:
+                if item.direction() == pb.MemcacheIncrementRequest.DECREMENT:
+                    self._get(item.key()).add('decr', now)
+                else:
+                    self._get(item.key()).add('incr', now)
+
+_key_tracker = _KeyTracker()
+
 class MemcacheTestCase(BaseTestCase):
     """
     The ``MemcacheTestCase`` is a base test case that provides helper methods
@@ -61,6 +151,13 @@ class MemcacheTestCase(BaseTestCase):
         self.assertMemcacheItems(0)
         self.assertMemcacheHits(0)
     """
+    REQUIRED_STUBS = ('memcache',)
+    
+    # About how many operations a second a single key can take before the
+    # memcache server holding it becomes the bottleneck
+    MEMCACHE_MAX_OPS_PER_KEY = 1000
+    
+    @timed_fixture('MemcacheTestCase.setUp')
     def setUp(self):
         """
         This method is called at the start of each test case.
@@ -82,6 +179,20 @@ class MemcacheTestCase(BaseTestCase):
         """
         super(MemcacheTestCase, self).setUp()
         self.clear_memcache()
+        get_rpc_recorder().add_listener(_key_tracker)
+        _key_tracker.reset(self.clock)
+    
+    @timed_fixture('MemcacheTestCase.tearDown')
+    def tearDown(self):
+        """
+        This method is called at the end of each test case. It stops
+        tracking memcache keys, so the calls made by tests that aren't
+        ``MemcacheTestCase`` tests aren't tracked (or kept).
+        """
+        try:
+            super(MemcacheTestCase, self).tearDown()
+        finally:
+            _key_tracker.reset(None)
     
     def clear_memcache(self):
         """
@@ -110,7 +221,27 @@ class MemcacheTestCase(BaseTestCase):
                     self.clear_memcache()
                     self.assertMemcacheItems(0)
         """
-        memcache.flush_all()
+        from google.appengine.api import memcache
+        
+        # Resetting the sandbox isn't one of the test's API calls
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        try:
+            memcache.flush_all()
+        finally:
+            recorder.resume()
+    
+    def _get_memcache_stats(self):
+        # Like the counting assertions, looking at the stats isn't recorded
+        # as one of the test's API calls.
+        from google.appengine.api import memcache
+        
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        try:
+            return memcache.get_stats()
+        finally:
+            recorder.resume()
     
     def assertMemcacheHits(self, hits):
         """
@@ -151,7 +282,7 @@ class MemcacheTestCase(BaseTestCase):
                     # Assert that still one hit
                     self.assertMemcacheHits(1)
         """
-        self.assertEqual(memcache.get_stats()['hits'], hits)
+        self.assertEqual(self._get_memcache_stats()['hits'], hits)
     
     def assertMemcacheItems(self, items):
         """
@@ -185,4 +316,137 @@ class MemcacheTestCase(BaseTestCase):
                     # Test that the cache has zero items
                     self.assertMemcacheHits(0)
         """
-        self.assertEqual(memcache.get_stats()['items'], items)
+        self.assertEqual(self._get_memcache_stats()['items'], items)
+    
+    def get_performance_metrics(self):
+        """
+        Adds the number of ``memcache_hits`` to the test's metrics.
+        """
+        metrics = super(MemcacheTestCase, self).get_performance_metrics()
+        metrics['memcache_hits'] = self._get_memcache_stats()['hits']
+        return metrics
+    
+    def get_stub_sizes(self):
+        """
+        Adds the number of ``memcache_items`` and ``memcache_bytes``. Getting
+        them isn't recorded as one of the test's API calls.
+        """
+        stats = self._get_memcache_stats()
+        
+        sizes = super(MemcacheTestCase, self).get_stub_sizes()
+        sizes['memcache_items'] = stats['items']
+        sizes['memcache_bytes'] = stats['bytes']
+        return sizes
+    
+    def get_memcache_key_stats(self):
+        """
+        Returns a dictionary of each memcache key used so far in the test to
+        its statistics:
+        
+        * ``ops``: the number of operations of any kind,
+        * ``ops_per_second``: the most operations in any one second of the
+          test's virtual clock (``self.clock``),
+        * ``counts``: the number of each kind of operation (``get``,
+          ``gets``, ``set``, ``add``, ``replace``, ``cas``, ``delete``,
+          ``incr`` and ``decr``),
+        * ``cas_failures``: the number of compare-and-set calls that failed
+          because the value had changed, and
+        * ``max_cas_retries``: the longest run of those failures in a row,
+          ie, how many times a ``Client.cas()`` loop had to retry.
+        """
+        stats = {}
+        for key, key_stats in _key_tracker.keys.items():
+            stats[key] = {
+                'ops': len(key_stats.times),
+                'ops_per_second': peak_rate(key_stats.times),
+                'counts': dict(key_stats.counts),
+                'cas_failures': key_stats.cas_failures,
+                'max_cas_retries': key_stats.max_cas_retries,
+            }
+        return stats
+    
+    def get_hot_keys(self, max_ops_per_second=None):
+        """
+        Returns ``(key, ops per second)`` for each key used more than
+        ``max_ops_per_second`` times (``MEMCACHE_MAX_OPS_PER_KEY`` by
+        default) in any one second of the test's virtual clock, busiest
+        first.
+        """
+        if max_ops_per_second is None:
+            max_ops_per_second = self.MEMCACHE_MAX_OPS_PER_KEY
+        
+        hot = []
+        for key, stats in self.get_memcache_key_stats().items():
+            if stats['ops_per_second'] > max_ops_per_second:
+                hot.append((key, stats['ops_per_second']))
+        hot.sort(key=lambda k: -k[1])
+        return hot
+    
+    def assertMaxOpsPerKey(self, n, key=None):
+        """
+        Assert that no memcache key (or just ``key``) had more than ``n``
+        operations in any one second.
+        
+        Time is measured with ``self.clock``, so simulate traffic by moving
+        it forward between requests; anything done without moving it counts
+        as happening in the same second::
+        
+            class MyTestCase(MemcacheTestCase, unittest.TestCase):
+                def test_page_counter(self):
+                    # 500 views over 10 seconds
+                    for n in range(500):
+                        view_page()
+                        self.clock.advance(0.02)
+                    
+                    self.assertMaxOpsPerKey(100)
+        """
+        stats = self.get_memcache_key_stats()
+        if key is not None:
+            stats = {key: stats.get(key, {'ops_per_second': 0})}
+        
+        for name, key_stats in stats.items():
+            if key_stats['ops_per_second'] > n:
+                self.fail("Memcache key %r had %d operations in one second (max %d)" % (
+                    name, key_stats['ops_per_second'], n,
+                ))
+    
+    def assertNoHotKeys(self):
+        """
+        Assert that no memcache key was used more than
+        ``MEMCACHE_MAX_OPS_PER_KEY`` times in any one second.
+        """
+        self.assertMaxOpsPerKey(self.MEMCACHE_MAX_OPS_PER_KEY)
+    
+    def assertMaxCASRetries(self, n, key=None):
+        """
+        Assert that no compare-and-set loop (on any key, or just ``key``)
+        failed more than ``n`` times in a row.
+        """
+        stats = self.get_memcache_key_stats()
+        if key is not None:
+            stats = {key: stats.get(key, {'max_cas_retries': 0})}
+        
+        for name, key_stats in stats.items():
+            if key_stats['max_cas_retries'] > n:
+                self.fail("Memcache key %r needed %d compare-and-set retries in a row (max %d)" % (
+                    name, key_stats['max_cas_retries'], n,
+                ))
+    
+    def get_memcache_report(self):
+        """
+        Returns a line per memcache key, busiest first, with its peak
+        operations per second, the operations made on it, and any failed
+        compare-and-set calls. Hot keys are marked.
+        """
+        stats = self.get_memcache_key_stats()
+        lines = []
+        for key in sorted(stats, key=lambda k: -stats[k]['ops_per_second']):
+            key_stats = stats[key]
+            counts = ', '.join(['%s=%d' % item for item in sorted(key_stats['counts'].items())])
+            line = '%6d ops/s  %-40r %s' % (key_stats['ops_per_second'], key, counts)
+            if key_stats['cas_failures']:
+                line += ', %d CAS failures (%d in a row)' % (key_stats['cas_failures'], key_stats['max_cas_retries'])
+            if key_stats['ops_per_second'] > self.MEMCACHE_MAX_OPS_PER_KEY:
+                line += '  HOT'
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,161 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import atexit
+import gc
+import os
+import sys
+
+__all__ = ['MemoryTracker', 'get_memory_tracker', 'tracking_memory', 'is_growing']
+
+# Set this environment variable to track memory for every test case, and
+# print the report when the run finishes
+ENVIRON_KEY = 'GAETESTBED_TRACK_MEMORY'
+
+def tracking_memory():
+    """
+    Returns whether memory tracking was turned on for the whole run with
+    ``GAETESTBED_TRACK_MEMORY=1``.
+    """
+    return os.environ.get(ENVIRON_KEY, '') not in ('', '0')
+
+def _measure():
+    # Bytes allocated if tracemalloc is around (Python 3.4+, or the
+    # pytracemalloc backport), otherwise the number of objects the garbage
+    # collector knows about.
+    gc.collect()
+    try:
+        import tracemalloc
+    except ImportError:
+        return len(gc.get_objects()), 'objects'
+    
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return tracemalloc.get_traced_memory()[0], 'bytes'
+
+def is_growing(values, min_samples=5, ratio=0.75):
+    """
+    Returns whether ``values`` (one per test, in order) keep growing: there
+    are at least ``min_samples`` of them, the last is bigger than the first,
+    and at least ``ratio`` of the steps between them went up.
+    """
+    if len(values) < min_samples or values[-1] <= values[0]:
+        return False
+    
+    steps = list(zip(values[:-1], values[1:]))
+    increases = len([1 for before, after in steps if after > before])
+    return increases >= ratio * len(steps)
+
+class MemoryTracker(object):
+    """
+    Measures the memory retained by each test, and the size of each stub's
+    state (see ``get_stub_sizes()`` on the test cases) at the end of each
+    test.
+    
+    ``tests`` is a list of ``(test id, retained, stub sizes)`` in the order
+    the tests ran. Retained memory is in ``unit``: bytes if ``tracemalloc``
+    is available, otherwise live objects.
+    """
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """
+        Forgets all of the tests measured so far.
+        """
+        self.tests = []
+        self.memory = []
+        self.unit = None
+        self._start = None
+    
+    def start_test(self):
+        self._start, self.unit = _measure()
+    
+    def stop_test(self, test_id, stub_sizes):
+        if self._start is None:
+            return
+        
+        end, self.unit = _measure()
+        self.tests.append((test_id, end - self._start, stub_sizes))
+        self.memory.append(end)
+        self._start = None
+    
+    def leaky_tests(self, limit=10):
+        """
+        Returns ``(test id, retained)`` for the ``limit`` tests that left
+        the most memory behind them.
+        """
+        tests = [(test_id, retained) for test_id, retained, sizes in self.tests if retained > 0]
+        tests.sort(key=lambda t: -t[1])
+        return tests[:limit]
+    
+    def stub_series(self):
+        """
+        Returns a dictionary of each stub measurement (ie,
+        ``datastore_entities``) to its values at the end of every test.
+        """
+        series = {}
+        for test_id, retained, sizes in self.tests:
+            for name, size in sizes.items():
+                series.setdefault(name, []).append(size)
+        return series
+    
+    def growing_stubs(self):
+        """
+        Returns the names of the stub measurements that keep growing from
+        test to test, ie, state that isn't being reset.
+        """
+        series = self.stub_series()
+        return sorted([name for name, values in series.items() if is_growing(values)])
+    
+    @property
+    def memory_growing(self):
+        """
+        Whether the memory in use keeps growing from test to test.
+        """
+        return is_growing(self.memory)
+    
+    def format(self, limit=10):
+        """
+        Returns the overall memory trend, any stubs whose state keeps
+        growing, and the ``limit`` tests that retained the most memory.
+        """
+        if not self.tests:
+            return 'No tests measured'
+        
+        lines = ['%d tests: %s %s in use after the first, %s after the last%s' % (
+            len(self.tests), self.memory[0], self.unit, self.memory[-1],
+            self.memory_growing and ' (keeps growing)' or '',
+        )]
+        
+        series = self.stub_series()
+        for name in self.growing_stubs():
+            lines.append('  %s keeps growing: %s after the first test, %s after the last' % (
+                name, series[name][0], series[name][-1],
+            ))
+        
+        for test_id, retained in self.leaky_tests(limit):
+            lines.append('  %12d %s retained  %s' % (retained, self.unit, test_id))
+        return '\n'.join(lines)
+    
+    def __str__(self):
+        return self.format()
+
+_tracker = MemoryTracker()
+
+def get_memory_tracker():
+    """
+    Returns the ``MemoryTracker`` shared by all test cases.
+    """
+    return _tracker
+
+def _print_report():
+    if _tracker.tests:
+        sys.stderr.write('\n%s\n' % _tracker.format())
+
+atexit.register(_print_report)
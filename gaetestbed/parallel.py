@@ -0,0 +1,332 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+try:
+    from nose.plugins import Plugin
+except ImportError:
+    Plugin = object
+
+from bootstrap import bootstrap
+from stubs import isolate_stubs
+
+__all__ = ['ParallelPlugin', 'shard_tests', 'load_durations', 'save_durations']
+
+DEFAULT_DURATIONS_FILE = '.gaetestbed-durations.json'
+
+# The plugin's own options, which only make sense in the parent process
+PARENT_OPTIONS = (
+    '--gaetestbed-workers', '--gaetestbed-durations', '--gaetestbed-worker-output',
+)
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+def _read_json(path, default):
+    if not path or not os.path.exists(path):
+        return default
+    
+    f = open(path)
+    try:
+        try:
+            return json.load(f)
+        except ValueError:
+            return default
+    finally:
+        f.close()
+
+def _write_json(path, data):
+    f = open(path, 'w')
+    try:
+        json.dump(data, f, indent=2, sort_keys=True)
+    finally:
+        f.close()
+
+def load_durations(path):
+    """
+    Reads the test durations (test name -> seconds) saved by a previous
+    run, or returns an empty dictionary if there aren't any.
+    """
+    return _read_json(path, {})
+
+def save_durations(path, durations):
+    """
+    Writes the test durations (test name -> seconds) to ``path``.
+    """
+    _write_json(path, durations)
+
+def shard_tests(test_ids, durations, workers):
+    """
+    Splits ``test_ids`` into (at most) ``workers`` lists whose total
+    historical duration is as even as possible, longest tests first.
+    
+    Tests without a recorded duration are assumed to take as long as the
+    average test that has one.
+    """
+    known = [durations[t] for t in test_ids if t in durations]
+    default = known and sum(known) / len(known) or 1.0
+    
+    shards = [[] for n in range(max(1, min(workers, len(test_ids))))]
+    totals = [0.0] * len(shards)
+    
+    ordered = sorted(test_ids, key=lambda t: -durations.get(t, default))
+    for test_id in ordered:
+        lightest = totals.index(min(totals))
+        shards[lightest].append(test_id)
+        totals[lightest] += durations.get(test_id, default)
+    
+    # Keep each shard in the original order so tests from the same module
+    # still run together.
+    positions = dict([(t, i) for i, t in enumerate(test_ids)])
+    for shard in shards:
+        shard.sort(key=lambda t: positions[t])
+    
+    return [shard for shard in shards if shard]
+
+def _test_name(test):
+    # nose's address for a test (``module:Class.method``) is what it takes
+    # on the command line, so that's what the workers are given.
+    if hasattr(test, 'address'):
+        address = test.address()
+        if address and address[1]:
+            if address[2]:
+                return '%s:%s' % (address[1], address[2])
+            return address[1]
+    return test.id()
+
+def _worker_args(argv, test_names):
+    # Workers get the same command line, less the test names (each gets its
+    # own) and the options that would make them parallel. The plugin's
+    # options may be given as ``--opt=value`` or as ``--opt value``.
+    args = []
+    skip_value = False
+    for arg in argv:
+        if skip_value:
+            skip_value = False
+        elif arg in PARENT_OPTIONS:
+            skip_value = True
+        elif arg.split('=', 1)[0] in PARENT_OPTIONS:
+            pass
+        elif arg not in test_names and arg != '--with-gaetestbed-parallel':
+            args.append(arg)
+    return args
+
+def _flatten(suite):
+    try:
+        tests = iter(suite)
+    except TypeError:
+        return [suite]
+    
+    flattened = []
+    for test in tests:
+        flattened.extend(_flatten(test))
+    return flattened
+
+class _RemoteTest(object):
+    """
+    Stands in for a test that ran in a worker, so its failures can be
+    reported by the parent's test result.
+    """
+    def __init__(self, test_id):
+        self.test_id = test_id
+    
+    def id(self):
+        return self.test_id
+    
+    def shortDescription(self):
+        return None
+    
+    def __str__(self):
+        return self.test_id
+
+class _ParallelRunner(object):
+    def __init__(self, plugin, runner):
+        self.plugin = plugin
+        self.runner = runner
+    
+    def run(self, test):
+        ids = []
+        for name in [_test_name(t) for t in _flatten(test)]:
+            if name not in ids:
+                ids.append(name)
+        
+        durations = load_durations(self.plugin.durations_file)
+        shards = shard_tests(ids, durations, self.plugin.workers)
+        
+        start = time.time()
+        workers = []
+        for shard in shards:
+            fd, output = tempfile.mkstemp(suffix='.json', prefix='gaetestbed-worker-')
+            os.close(fd)
+            workers.append((subprocess.Popen(self._command(output, shard)), output))
+        
+        result = self.runner._makeResult()
+        for process, output in workers:
+            process.wait()
+            self._merge(result, durations, process, output)
+        
+        self.runner.stream.writeln()
+        result.printErrors()
+        self.runner.stream.writeln(result.separator2)
+        self.runner.stream.writeln('Ran %d tests in %.3fs with %d workers' % (
+            result.testsRun, time.time() - start, len(shards)
+        ))
+        self.runner.stream.writeln()
+        skipped = len(getattr(result, 'skipped', []))
+        if result.wasSuccessful():
+            if skipped:
+                self.runner.stream.writeln('OK (SKIP=%d)' % skipped)
+            else:
+                self.runner.stream.writeln('OK')
+        else:
+            self.runner.stream.writeln('FAILED (failures=%d, errors=%d, skipped=%d)' % (
+                len(result.failures), len(result.errors), skipped
+            ))
+        
+        save_durations(self.plugin.durations_file, durations)
+        return result
+    
+    def _command(self, output, shard):
+        # Workers are started with ``-m nose`` rather than ``sys.argv[0]``,
+        # which isn't nose's script when nose was started from Python.
+        return [sys.executable, '-m', 'nose'] + self.plugin.worker_args + [
+            '--gaetestbed-worker-output=%s' % output,
+        ] + shard
+    
+    def _merge(self, result, durations, process, output):
+        tests = _read_json(output, [])
+        os.remove(output)
+        
+        if not tests and process.returncode:
+            result.errors.append((_RemoteTest('worker'), 'Worker exited with status %d' % process.returncode))
+        
+        for test in tests:
+            result.testsRun += 1
+            durations[test['id']] = test['duration']
+            
+            if test['outcome'] == 'failure':
+                result.failures.append((_RemoteTest(test['id']), test['traceback']))
+            elif test['outcome'] == 'error':
+                result.errors.append((_RemoteTest(test['id']), test['traceback']))
+            elif test['outcome'] == 'skip':
+                if not hasattr(result, 'skipped'):
+                    result.skipped = []
+                result.skipped.append((_RemoteTest(test['id']), test.get('reason') or ''))
+
+class ParallelPlugin(Plugin):
+    """
+    A nose plugin that runs the test suite across several processes.
+    
+    Run your tests with ``--with-gaetestbed-parallel`` (and optionally
+    ``--gaetestbed-workers=N``; the default is one per CPU)::
+        
+        $ nosetests --with-gae --with-gaetestbed-parallel --gaetestbed-workers=4
+    
+    The tests are split between the workers using the durations recorded by
+    previous runs (in ``--gaetestbed-durations``, which defaults to
+    ``.gaetestbed-durations.json``), so each worker gets about the same
+    amount of work. Every worker is a separate ``nosetests`` process with
+    its own, empty, in-memory datastore, memcache, mail and task queue
+    stubs; the results are merged and reported by the parent process.
+    """
+    name = 'gaetestbed-parallel'
+    score = 1
+    
+    def options(self, parser, env=os.environ):
+        Plugin.options(self, parser, env)
+        parser.add_option(
+            '--gaetestbed-workers', type='int', dest='gaetestbed_workers',
+            default=env.get('GAETESTBED_WORKERS') and int(env['GAETESTBED_WORKERS']) or _cpu_count(),
+            help='Number of worker processes [GAETESTBED_WORKERS]',
+        )
+        parser.add_option(
+            '--gaetestbed-durations', dest='gaetestbed_durations',
+            default=env.get('GAETESTBED_DURATIONS', DEFAULT_DURATIONS_FILE),
+            help='File holding test durations from previous runs [GAETESTBED_DURATIONS]',
+        )
+        parser.add_option(
+            '--gaetestbed-worker-output', dest='gaetestbed_worker_output',
+            help='(Internal) where a worker writes its results',
+        )
+    
+    def configure(self, options, conf):
+        Plugin.configure(self, options, conf)
+        self.output = options.gaetestbed_worker_output
+        self.workers = options.gaetestbed_workers
+        self.durations_file = options.gaetestbed_durations
+        self.root_path = conf.workingDir
+        
+        if self.output:
+            self.enabled = True
+            self.isolated = False
+            self.tests = []
+            return
+        
+        if self.enabled:
+            self.worker_args = _worker_args(sys.argv[1:], set(conf.testNames or []))
+    
+    def prepareTestRunner(self, runner):
+        if not self.output:
+            return _ParallelRunner(self, runner)
+    
+    def startTest(self, test):
+        if self.output and not self.isolated:
+            # This waits for the first test, by when the test modules have
+            # been imported and whatever sets up the SDK (NoseGAE or a call
+            # to ``bootstrap``) has run. ``bootstrap`` only finds the SDK
+            # and registers stubs if nothing has yet.
+            bootstrap(root_path=self.root_path)
+            isolate_stubs(root_path=self.root_path)
+            self.isolated = True
+        
+        self._started = time.time()
+    
+    def addSuccess(self, test):
+        self._add(test, 'success')
+    
+    def addFailure(self, test, err):
+        self._add(test, 'failure', err)
+    
+    def addError(self, test, err):
+        outcome = 'error'
+        if err[0].__name__ == 'SkipTest':
+            outcome = 'skip'
+        self._add(test, outcome, err)
+    
+    def _add(self, test, outcome, err=None):
+        if not self.output:
+            return
+        
+        details = {
+            'id': _test_name(test),
+            'outcome': outcome,
+            'duration': time.time() - self._started,
+            'traceback': err and ''.join(traceback.format_exception(*err)) or None,
+        }
+        if outcome == 'skip':
+            details['reason'] = str(err[1])
+        self.tests.append(details)
+    
+    def finalize(self, result):
+        if self.output:
+            _write_json(self.output, self.tests)
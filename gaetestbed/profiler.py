@@ -0,0 +1,262 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import cProfile
+import gzip
+import os
+import re
+import threading
+import time
+
+from cStringIO import StringIO
+
+from rpc import get_rpc_recorder
+from waterfall import Waterfall
+
+__all__ = ['RequestProfile', 'ProfilingMiddleware', 'ResponsePayload', 'TimingMiddleware']
+
+def _cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+class _CPUTimer(object):
+    """
+    Measures the CPU time used while a request runs.
+    
+    ``os.times()`` only knows about the whole process, so the measurement
+    is only good if nothing else was running. Timers that overlap with
+    another (ie, requests made by a load test's threads) give ``None``
+    instead of counting each other's work.
+    """
+    _lock = threading.Lock()
+    _running = []
+    
+    def start(self):
+        self._lock.acquire()
+        try:
+            self.overlapped = bool(self._running)
+            for timer in self._running:
+                timer.overlapped = True
+            self._running.append(self)
+        finally:
+            self._lock.release()
+        
+        self._start = _cpu_time()
+    
+    def stop(self):
+        """
+        Returns the CPU seconds used since ``start()``, or ``None`` if
+        another timer was running at some point in between.
+        """
+        cpu_time = _cpu_time() - self._start
+        
+        self._lock.acquire()
+        try:
+            self._running.remove(self)
+        finally:
+            self._lock.release()
+        
+        if self.overlapped:
+            return None
+        return cpu_time
+
+class RequestProfile(object):
+    """
+    What it cost to handle a single request.
+    
+    ``wall_time`` and ``cpu_time`` are in seconds, ``rpcs`` is the list of
+    ``RPCRecord`` objects for the API calls the request made, and
+    ``profile_path`` is the file the cProfile stats were dumped to (if the
+    middleware was given a ``profile_dir``).
+    
+    ``cpu_time`` is the CPU time of the whole process while the request
+    ran, as the platform can't measure a single thread. It's ``None`` if
+    other profiled requests ran at the same time, as with ``load()``.
+    """
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.start = None
+        self.end = None
+        self.wall_time = None
+        self.cpu_time = None
+        self.rpcs = []
+        self.profile_path = None
+    
+    @property
+    def rpc_counts(self):
+        """
+        A dictionary of the number of API calls made, by service.
+        """
+        counts = {}
+        for record in self.rpcs:
+            counts[record.service] = counts.get(record.service, 0) + 1
+        return counts
+    
+    @property
+    def waterfall(self):
+        """
+        A ``gaetestbed.waterfall.Waterfall`` of the API calls the request made.
+        """
+        return Waterfall(self.rpcs, self.start, self.end)
+    
+    def rpc_count(self, service=None):
+        """
+        The number of API calls made, optionally only to ``service``.
+        """
+        if service is None:
+            return len(self.rpcs)
+        return self.rpc_counts.get(service, 0)
+    
+    def __repr__(self):
+        return '<RequestProfile %s %s>' % (self.method, self.path)
+
+class ProfilingMiddleware(object):
+    """
+    WSGI middleware that records a ``RequestProfile`` for each request.
+    
+    The profile is stored in the WSGI environ under ``ENVIRON_KEY``, which
+    is how ``WebTestCase`` gets it back onto the response. If
+    ``profile_dir`` is given, each request is also run under cProfile and
+    the stats are dumped to a ``.prof`` file in that directory.
+    """
+    ENVIRON_KEY = 'gaetestbed.profile'
+    
+    def __init__(self, application, profile_dir=None):
+        self.application = application
+        self.profile_dir = profile_dir
+        self._dump_count = 0
+        self._lock = threading.Lock()
+    
+    def __call__(self, environ, start_response):
+        profile = RequestProfile(environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'))
+        environ[self.ENVIRON_KEY] = profile
+        
+        recorder = get_rpc_recorder()
+        first_record = len(recorder.records)
+        thread = threading.currentThread()
+        
+        wall_start = time.time()
+        cpu_timer = _CPUTimer()
+        cpu_timer.start()
+        
+        try:
+            if self.profile_dir:
+                profiler = cProfile.Profile()
+                body = profiler.runcall(self._run, environ, start_response)
+            else:
+                profiler = None
+                body = self._run(environ, start_response)
+        finally:
+            profile.cpu_time = cpu_timer.stop()
+        
+        profile.start = wall_start
+        profile.end = time.time()
+        profile.wall_time = profile.end - wall_start
+        profile.rpcs = [r for r in recorder.records[first_record:] if r.thread is thread]
+        
+        if profiler is not None:
+            profile.profile_path = self._dump(profiler, profile)
+        
+        return body
+    
+    def _run(self, environ, start_response):
+        # The response has to be consumed here so that lazy iterables are
+        # included in the measurements.
+        result = self.application(environ, start_response)
+        try:
+            return list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    
+    def _dump(self, profiler, profile):
+        self._lock.acquire()
+        try:
+            self._dump_count += 1
+            count = self._dump_count
+        finally:
+            self._lock.release()
+        
+        name = re.sub(r'[^A-Za-z0-9]+', '_', profile.path or '').strip('_') or 'root'
+        path = os.path.join(self.profile_dir, '%04d_%s_%s.prof' % (count, profile.method, name))
+        
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        profiler.dump_stats(path)
+        return path
+
+class ResponsePayload(object):
+    """
+    The size of a response body and how well it compresses.
+    
+    ``gzip_size`` is only worked out the first time it's asked for.
+    ``time_to_first_byte`` is in seconds (``None`` if the body was empty).
+    ``status`` is the response's status code.
+    """
+    def __init__(self, method, url, body, content_type=None, time_to_first_byte=None, status=None):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.content_type = content_type
+        self.time_to_first_byte = time_to_first_byte
+        self.status = status
+        self._gzip_size = None
+    
+    @property
+    def size(self):
+        return len(self.body)
+    
+    @property
+    def gzip_size(self):
+        if self._gzip_size is None:
+            buffer = StringIO()
+            compressed = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6)
+            compressed.write(self.body)
+            compressed.close()
+            self._gzip_size = len(buffer.getvalue())
+        return self._gzip_size
+    
+    @property
+    def compression_ratio(self):
+        """
+        ``gzip_size / size`` (so smaller is better), or ``None`` for an
+        empty body.
+        """
+        if not self.body:
+            return None
+        return float(self.gzip_size) / self.size
+    
+    def __repr__(self):
+        return '<ResponsePayload %s %s (%d bytes)>' % (self.method, self.url, self.size)
+
+class TimingMiddleware(object):
+    """
+    WSGI middleware that records when a request started and when its first
+    non-empty chunk of body was produced, in the WSGI environ under
+    ``ENVIRON_KEY``.
+    """
+    ENVIRON_KEY = 'gaetestbed.timing'
+    
+    def __init__(self, application):
+        self.application = application
+    
+    def __call__(self, environ, start_response):
+        timing = {'start': time.time(), 'first_byte': None}
+        environ[self.ENVIRON_KEY] = timing
+        return self._iterate(self.application(environ, start_response), timing)
+    
+    def _iterate(self, result, timing):
+        try:
+            for chunk in result:
+                if chunk and timing['first_byte'] is None:
+                    timing['first_byte'] = time.time()
+                yield chunk
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
@@ -0,0 +1,386 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import calendar
+import re
+import threading
+import time
+import urlparse
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+from rpc import get_rpc_recorder
+from stats import mean, percentile
+
+__all__ = [
+    'ReplayRequest', 'ReplayReport', 'parse_access_log', 'parse_har',
+    'load_requests', 'route_for', 'replay', 'compare_reports',
+]
+
+class ReplayRequest(object):
+    """
+    A single recorded request to replay. ``timestamp`` is in seconds since
+    the epoch (or ``None`` if it isn't known) and is only used for pacing.
+    """
+    def __init__(self, method, path, query='', body='', cookies=None, headers=None, timestamp=None):
+        self.method = method.upper()
+        self.path = path
+        self.query = query
+        self.body = body or ''
+        self.cookies = cookies or {}
+        self.headers = headers or {}
+        self.timestamp = timestamp
+    
+    @property
+    def url(self):
+        if self.query:
+            return '%s?%s' % (self.path, self.query)
+        return self.path
+    
+    def __repr__(self):
+        return '<ReplayRequest %s %s>' % (self.method, self.url)
+
+# Common and combined log formats, which is also what App Engine's request
+# logs look like:
+# 1.2.3.4 - user [10/Oct/2009:13:55:36 -0700] "GET /path?q=1 HTTP/1.1" 200 2326 ...
+ACCESS_LOG_RE = re.compile(
+    r'^\S+ \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<url>\S+)(?: [^"]*)?"'
+)
+
+MONTHS = dict([(name, i + 1) for i, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+)])
+
+def _parse_log_time(value):
+    # strptime can't handle the offset (%z) in Python 2, so it's done by hand
+    match = re.match(r'(\d+)/(\w+)/(\d+):(\d+):(\d+):(\d+)(?: ([+-])(\d\d)(\d\d))?', value)
+    if not match or match.group(2) not in MONTHS:
+        return None
+    
+    day, month, year, hour, minute, second = match.groups()[:6]
+    timestamp = calendar.timegm((int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)))
+    
+    if match.group(7):
+        offset = int(match.group(8)) * 3600 + int(match.group(9)) * 60
+        if match.group(7) == '+':
+            offset = -offset
+        timestamp += offset
+    
+    return timestamp
+
+def _parse_iso_time(value):
+    match = re.match(r'(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+)(\.\d+)?(Z|[+-]\d\d:?\d\d)?', value or '')
+    if not match:
+        return None
+    
+    timestamp = calendar.timegm(tuple([int(g) for g in match.groups()[:6]]))
+    if match.group(7):
+        timestamp += float(match.group(7))
+    
+    zone = match.group(8)
+    if zone and zone != 'Z':
+        offset = int(zone[1:3]) * 3600 + int(zone[-2:]) * 60
+        if zone[0] == '+':
+            offset = -offset
+        timestamp += offset
+    
+    return timestamp
+
+def parse_access_log(lines):
+    """
+    Parses an access log (an iterable of lines in common or combined log
+    format) into a list of ``ReplayRequest``. Lines that can't be parsed
+    are skipped.
+    
+    Access logs don't include request bodies or cookies, so neither do the
+    requests.
+    """
+    requests = []
+    for line in lines:
+        match = ACCESS_LOG_RE.match(line.strip())
+        if not match:
+            continue
+        
+        path, _, query = match.group('url').partition('?')
+        requests.append(ReplayRequest(
+            method = match.group('method'),
+            path = path,
+            query = query,
+            timestamp = _parse_log_time(match.group('time')),
+        ))
+    
+    return requests
+
+def parse_har(data):
+    """
+    Parses a HAR (HTTP Archive) document, as a string or an already decoded
+    dictionary, into a list of ``ReplayRequest``.
+    """
+    if isinstance(data, basestring):
+        data = json.loads(data)
+    
+    requests = []
+    for entry in data.get('log', {}).get('entries', []):
+        request = entry['request']
+        url = urlparse.urlsplit(request['url'])
+        
+        cookies = dict([(c['name'], c['value']) for c in request.get('cookies', [])])
+        headers = {}
+        for header in request.get('headers', []):
+            name = header['name']
+            if name.lower() == 'content-type':
+                headers['Content-Type'] = header['value']
+        
+        requests.append(ReplayRequest(
+            method = request['method'],
+            path = url[2] or '/',
+            query = url[3],
+            body = request.get('postData', {}).get('text', ''),
+            cookies = cookies,
+            headers = headers,
+            timestamp = _parse_iso_time(entry.get('startedDateTime')),
+        ))
+    
+    return requests
+
+def load_requests(path):
+    """
+    Reads a HAR file (``.har``, or anything that looks like JSON) or an
+    access log from ``path`` and returns its list of ``ReplayRequest``.
+    """
+    f = open(path)
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    
+    if path.endswith('.har') or data.lstrip().startswith('{'):
+        return parse_har(data)
+    return parse_access_log(data.splitlines())
+
+# Path segments that are almost certainly IDs: numbers, hex digests,
+# UUIDs and datastore keys.
+ID_SEGMENT_RE = re.compile(r'^(\d+|[0-9a-fA-F]{16,}|[0-9a-fA-F-]{36}|ag[A-Za-z0-9_-]{10,})$')
+
+def route_for(method, path):
+    """
+    Returns the route a request belongs to, used to group the results:
+    the method and path, with ID-looking segments replaced by ``:id``
+    (ie, ``GET /articles/:id/``).
+    """
+    segments = []
+    for segment in path.split('/'):
+        if ID_SEGMENT_RE.match(segment):
+            segment = ':id'
+        segments.append(segment)
+    return '%s %s' % (method, '/'.join(segments))
+
+class ReplayReport(object):
+    """
+    Latency and API call counts per route from a ``replay()``.
+    
+    Each entry in ``routes`` has the ``latencies`` (in seconds) and
+    ``rpc_counts`` of every request to that route, along with the number of
+    ``errors`` (exceptions or 5xx statuses). ``summary()`` boils those down
+    to numbers, and is what ``save()`` writes out so runs against two code
+    revisions can be compared with ``compare_reports()``.
+    """
+    def __init__(self):
+        self.routes = {}
+        self.duration = 0.0
+    
+    def add(self, route, latency, rpc_count, error=False):
+        stats = self.routes.setdefault(route, {'latencies': [], 'rpc_counts': [], 'errors': 0})
+        stats['latencies'].append(latency)
+        stats['rpc_counts'].append(rpc_count)
+        if error:
+            stats['errors'] += 1
+    
+    def summary(self):
+        """
+        Returns a dictionary of route to ``requests``, ``errors``, ``p50``,
+        ``p95`` and ``p99`` latency (in milliseconds), ``mean_rpcs`` and
+        ``max_rpcs``.
+        """
+        summary = {}
+        for route, stats in self.routes.items():
+            summary[route] = {
+                'requests': len(stats['latencies']),
+                'errors': stats['errors'],
+                'p50': percentile(stats['latencies'], 50) * 1000.0,
+                'p95': percentile(stats['latencies'], 95) * 1000.0,
+                'p99': percentile(stats['latencies'], 99) * 1000.0,
+                'mean_rpcs': mean(stats['rpc_counts']),
+                'max_rpcs': max(stats['rpc_counts']),
+            }
+        return summary
+    
+    def save(self, path):
+        """
+        Writes the ``summary()`` to ``path`` as JSON.
+        """
+        f = open(path, 'w')
+        try:
+            json.dump({'duration': self.duration, 'routes': self.summary()}, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a report written by ``save()``. The returned report only has a
+        ``summary()``; the raw latencies aren't saved.
+        """
+        f = open(path)
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        
+        report = _SavedReplayReport(data['routes'])
+        report.duration = data.get('duration', 0.0)
+        return report
+    
+    def format(self):
+        """
+        Returns the summary as a table, slowest route (by p95) first.
+        """
+        summary = self.summary()
+        lines = ['%-50s %8s %7s %9s %9s %9s' % ('route', 'requests', 'errors', 'p50 ms', 'p95 ms', 'RPCs')]
+        for route in sorted(summary, key=lambda r: -summary[r]['p95']):
+            stats = summary[route]
+            lines.append('%-50s %8d %7d %9.1f %9.1f %9.1f' % (
+                route, stats['requests'], stats['errors'], stats['p50'], stats['p95'], stats['mean_rpcs']
+            ))
+        return '\n'.join(lines)
+
+class _SavedReplayReport(ReplayReport):
+    def __init__(self, summary):
+        ReplayReport.__init__(self)
+        self._summary = summary
+    
+    def summary(self):
+        return self._summary
+
+def compare_reports(before, after):
+    """
+    Compares two ``ReplayReport`` (ie, one saved from the last release and
+    one from the current code) and returns a list with a dictionary per
+    route: the ``route``, and ``before``/``after``/``delta`` values for
+    ``p50``, ``p95`` and ``mean_rpcs``. Routes only in one report have
+    ``None`` for the other side. The biggest p95 regressions come first.
+    """
+    before, after = before.summary(), after.summary()
+    
+    rows = []
+    for route in set(before) | set(after):
+        row = {'route': route}
+        for name in ('p50', 'p95', 'mean_rpcs'):
+            old = new = delta = None
+            if route in before:
+                old = before[route][name]
+            if route in after:
+                new = after[route][name]
+            if old is not None and new is not None:
+                delta = new - old
+            row[name] = {'before': old, 'after': new, 'delta': delta}
+        rows.append(row)
+    
+    rows.sort(key=lambda row: -(row['p95']['delta'] or 0))
+    return rows
+
+def _make_request(app, request):
+    headers = dict(request.headers)
+    if request.cookies:
+        # Values are sent exactly as they were recorded
+        headers['Cookie'] = '; '.join(['%s=%s' % (k, v) for k, v in request.cookies.items()])
+    
+    params = {'method': request.method, 'headers': headers}
+    if request.body:
+        params['body'] = request.body
+    
+    return app.request(request.url, status='*', **params)
+
+def replay(application, requests, concurrency=1, speed=None, route=route_for):
+    """
+    Replays ``requests`` (a list of ``ReplayRequest``) against the WSGI
+    ``application`` from ``concurrency`` threads and returns a
+    ``ReplayReport``.
+    
+    If ``speed`` is given, requests are paced using their timestamps:
+    ``speed=1`` replays them as fast as they originally arrived, ``speed=10``
+    ten times faster. Otherwise they're sent as fast as possible.
+    
+    ``route`` is called with the method and path of each request to decide
+    which route it's reported under (see ``route_for``).
+    """
+    import webtest
+    
+    recorder = get_rpc_recorder()
+    report = ReplayReport()
+    lock = threading.Lock()
+    pending = list(requests)
+    pending.reverse()
+    
+    timestamps = [r.timestamp for r in requests if r.timestamp is not None]
+    first_timestamp = min(timestamps) if timestamps else None
+    
+    def next_request():
+        lock.acquire()
+        try:
+            if pending:
+                return pending.pop()
+            return None
+        finally:
+            lock.release()
+    
+    def worker():
+        app = webtest.TestApp(application)
+        thread = threading.currentThread()
+        
+        request = next_request()
+        while request is not None:
+            if speed and first_timestamp is not None and request.timestamp is not None:
+                delay = started + (request.timestamp - first_timestamp) / float(speed) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            
+            first_record = len(recorder.records)
+            start = time.time()
+            
+            error = False
+            try:
+                response = _make_request(app, request)
+                error = response.status_int >= 500
+            except Exception:
+                error = True
+            
+            elapsed = time.time() - start
+            rpcs = len([r for r in recorder.records[first_record:] if r.thread is thread])
+            
+            lock.acquire()
+            try:
+                report.add(route(request.method, request.path), elapsed, rpcs, error)
+            finally:
+                lock.release()
+            
+            request = next_request()
+    
+    threads = [threading.Thread(target=worker) for n in range(concurrency)]
+    
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.duration = time.time() - started
+    
+    return report
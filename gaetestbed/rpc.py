@@ -0,0 +1,196 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import threading
+import time
+
+__all__ = ['RPCRecord', 'RPCRecorder', 'get_rpc_recorder']
+
+class RPCRecord(object):
+    """
+    A single call made through the App Engine API proxy.
+    
+    ``start`` and ``end`` are ``time.time()`` values taken by the pre- and
+    post-call hooks. ``end`` stays ``None`` if the call raised an error (the
+    post-call hooks are only run for successful calls).
+    """
+    def __init__(self, service, method, request, response, start=None):
+        self.service = service
+        self.method = method
+        self.request = request
+        self.response = response
+        self.start = start
+        self.end = None
+        self.thread = threading.currentThread()
+    
+    @property
+    def duration(self):
+        """
+        The number of seconds the call took, or ``None`` if it didn't finish.
+        """
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+    
+    def __repr__(self):
+        return '<RPCRecord %s.%s>' % (self.service, self.method)
+
+class RPCRecorder(object):
+    """
+    Records every call made through ``apiproxy_stub_map.apiproxy``.
+    
+    The recorder hooks itself into the API proxy's pre- and post-call hooks,
+    which can't be removed once added, so there is only ever one recorder per
+    process (see ``get_rpc_recorder()``). Test cases call ``reset()`` at the
+    start of each test so that ``records`` only holds calls for that test.
+    
+    Listeners added with ``add_listener()`` are called with each finished
+    ``RPCRecord`` and, unlike the records, are kept across resets.
+    Listeners that ask for them are also told about calls made while
+    recording is paused.
+    """
+    HOOK_KEY = 'gaetestbed'
+    
+    def __init__(self):
+        self.records = []
+        self._pending = {}
+        self._listeners = []
+        self._paused_listeners = []
+        self._apiproxy = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+    
+    def install(self):
+        """
+        Adds the recording hooks to the current API proxy.
+        
+        This is safe to call more than once; the hooks are only added again
+        if the API proxy has been replaced since the last call.
+        """
+        from google.appengine.api import apiproxy_stub_map
+        
+        apiproxy = apiproxy_stub_map.apiproxy
+        if apiproxy is not self._apiproxy:
+            apiproxy.GetPreCallHooks().Append(self.HOOK_KEY, self._pre_call)
+            apiproxy.GetPostCallHooks().Append(self.HOOK_KEY, self._post_call)
+            self._apiproxy = apiproxy
+    
+    def add_listener(self, listener, paused=False):
+        """
+        Calls ``listener(record)`` after every successful API call.
+        
+        With ``paused`` set, it's also called for the calls made while
+        recording is paused (see ``pause()``), with records that aren't kept
+        in ``records``.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+        if paused and listener not in self._paused_listeners:
+            self._paused_listeners.append(listener)
+    
+    def pause(self):
+        """
+        Stops recording calls (and calling listeners) made by the current
+        thread until ``resume()`` is called. Calls to ``pause()`` can be
+        nested.
+        
+        Other threads (ie, requests made by a load test) are still recorded
+        while one thread is paused.
+        """
+        self._local.paused = self._get_pause_depth() + 1
+    
+    def resume(self):
+        """
+        Undoes a call to ``pause()`` made by the current thread.
+        """
+        self._local.paused = self._get_pause_depth() - 1
+    
+    @property
+    def paused(self):
+        """
+        Whether the current thread has paused recording.
+        """
+        return self._get_pause_depth() > 0
+    
+    def _get_pause_depth(self):
+        return getattr(self._local, 'paused', 0)
+    
+    def reset(self):
+        """
+        Forgets all of the calls recorded so far.
+        """
+        self._lock.acquire()
+        try:
+            self.records = []
+            self._pending = {}
+        finally:
+            self._lock.release()
+    
+    def get_records(self, service=None, method=None):
+        """
+        Returns the recorded calls, optionally filtered by ``service`` (ie,
+        ``'datastore_v3'``) and ``method`` (ie, ``'Put'``).
+        """
+        records = self.records
+        
+        if service is not None:
+            records = [r for r in records if r.service == service]
+        
+        if method is not None:
+            records = [r for r in records if r.method == method]
+        
+        return records
+    
+    def _pre_call(self, service, call, request, response):
+        if self.paused:
+            return
+        
+        record = RPCRecord(service, call, request, response, time.time())
+        
+        self._lock.acquire()
+        try:
+            self._pending[id(request)] = record
+            self.records.append(record)
+        finally:
+            self._lock.release()
+    
+    def _post_call(self, service, call, request, response):
+        if self.paused:
+            if self._paused_listeners:
+                record = RPCRecord(service, call, request, response)
+                record.end = time.time()
+                for listener in self._paused_listeners:
+                    listener(record)
+            return
+        
+        end = time.time()
+        
+        self._lock.acquire()
+        try:
+            record = self._pending.pop(id(request), None)
+            if record is None:
+                record = RPCRecord(service, call, request, response)
+                self.records.append(record)
+        finally:
+            self._lock.release()
+        
+        record.response = response
+        record.end = end
+        
+        for listener in self._listeners:
+            listener(record)
+
+_recorder = RPCRecorder()
+
+def get_rpc_recorder():
+    """
+    Returns the process-wide ``RPCRecorder``, installing it on the current
+    API proxy if needed.
+    """
+    _recorder.install()
+    return _recorder
@@ -0,0 +1,44 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+__all__ = ['mean', 'percentile', 'peak_rate']
+
+def mean(values):
+    """
+    Returns the arithmetic mean of ``values`` (or ``None`` if it's empty).
+    """
+    if not values:
+        return None
+    return float(sum(values)) / len(values)
+
+def percentile(values, p):
+    """
+    Returns the ``p``-th percentile (0-100) of ``values``, interpolating
+    linearly between the closest ranks, or ``None`` if it's empty.
+    """
+    if not values:
+        return None
+    
+    values = sorted(values)
+    rank = (len(values) - 1) * (p / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+def peak_rate(times, window=1.0):
+    """
+    Returns the largest number of ``times`` that fall inside any ``window``
+    seconds long.
+    """
+    times = sorted(times)
+    peak = first = 0
+    for last in range(len(times)):
+        while times[last] - times[first] >= window:
+            first += 1
+        peak = max(peak, last - first + 1)
+    return peak
@@ -0,0 +1,140 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+
+__all__ = [
+    'DEFAULT_SERVICES', 'ISOLATED_SERVICES', 'get_stub', 'replace_stub',
+    'setup_environment', 'register_stubs', 'isolate_stubs',
+]
+
+# The services registered when none are asked for specifically
+DEFAULT_SERVICES = ('datastore_v3', 'memcache', 'mail', 'taskqueue', 'urlfetch', 'user')
+
+# The services that keep state between calls, and so need their own stubs
+# in every process running tests at the same time
+ISOLATED_SERVICES = ('datastore_v3', 'memcache', 'mail', 'taskqueue')
+
+def _datastore_stub(app_id, root_path):
+    from google.appengine.api import datastore_file_stub
+    return datastore_file_stub.DatastoreFileStub(app_id, None, None)
+
+def _memcache_stub(app_id, root_path):
+    from google.appengine.api.memcache import memcache_stub
+    return memcache_stub.MemcacheServiceStub()
+
+def _mail_stub(app_id, root_path):
+    from google.appengine.api import mail_stub
+    return mail_stub.MailServiceStub()
+
+def _taskqueue_stub(app_id, root_path):
+    try:
+        from google.appengine.api.taskqueue import taskqueue_stub
+    except ImportError:
+        from google.appengine.api.labs.taskqueue import taskqueue_stub
+    return taskqueue_stub.TaskQueueServiceStub(root_path=root_path)
+
+def _urlfetch_stub(app_id, root_path):
+    from google.appengine.api import urlfetch_stub
+    return urlfetch_stub.URLFetchServiceStub()
+
+def _user_stub(app_id, root_path):
+    from google.appengine.api import user_service_stub
+    return user_service_stub.UserServiceStub()
+
+# Service name -> factory(app_id, root_path). The SDK modules are only
+# imported when a stub for that service is actually created.
+STUB_FACTORIES = {
+    'datastore_v3': _datastore_stub,
+    'memcache': _memcache_stub,
+    'mail': _mail_stub,
+    'taskqueue': _taskqueue_stub,
+    'urlfetch': _urlfetch_stub,
+    'user': _user_stub,
+}
+
+def get_stub(service):
+    """
+    Returns the stub registered for ``service`` on the current API proxy,
+    or ``None`` if there isn't one.
+    """
+    from google.appengine.api import apiproxy_stub_map
+    
+    apiproxy = apiproxy_stub_map.apiproxy
+    if hasattr(apiproxy, 'GetStub'):
+        return apiproxy.GetStub(service)
+    return apiproxy._APIProxyStubMap__stub_map.get(service)
+
+def replace_stub(service, stub):
+    """
+    Registers ``stub`` for ``service`` on the current API proxy, replacing
+    any stub already registered for it.
+    """
+    from google.appengine.api import apiproxy_stub_map
+    
+    apiproxy = apiproxy_stub_map.apiproxy
+    stub_map = apiproxy._APIProxyStubMap__stub_map
+    if service in stub_map:
+        del stub_map[service]
+    apiproxy.RegisterStub(service, stub)
+
+def setup_environment(app_id='gaetestbed'):
+    """
+    Sets the environment variables the SDK expects to find when running in
+    an App Engine server, unless they're already set.
+    """
+    os.environ.setdefault('APPLICATION_ID', app_id)
+    os.environ.setdefault('AUTH_DOMAIN', 'gmail.com')
+    os.environ.setdefault('SERVER_NAME', 'localhost')
+    os.environ.setdefault('SERVER_PORT', '80')
+    os.environ.setdefault('USER_EMAIL', '')
+
+def register_stubs(services=None, app_id='gaetestbed', root_path=None):
+    """
+    Replaces ``apiproxy_stub_map.apiproxy`` with a fresh API proxy holding
+    new, empty stubs for ``services`` (``DEFAULT_SERVICES`` if not given),
+    and sets up the environment variables the SDK expects.
+    
+    ``root_path`` is the directory holding the app's ``queue.yaml``.
+    Returns the new API proxy.
+    """
+    from google.appengine.api import apiproxy_stub_map
+    
+    setup_environment(app_id)
+    
+    if services is None:
+        services = DEFAULT_SERVICES
+    
+    apiproxy = apiproxy_stub_map.APIProxyStubMap()
+    for service in services:
+        apiproxy.RegisterStub(service, STUB_FACTORIES[service](os.environ['APPLICATION_ID'], root_path))
+    
+    apiproxy_stub_map.apiproxy = apiproxy
+    return apiproxy
+
+def isolate_stubs(services=ISOLATED_SERVICES, root_path=None):
+    """
+    Replaces the stubs for ``services`` on the current API proxy with new,
+    empty, in-memory ones, leaving any other stubs alone. If there's no API
+    proxy yet, a new one is set up with ``register_stubs``.
+    
+    This is what each worker of the parallel runner does, so that workers
+    don't share a datastore file or anything else. A stub that was given
+    its own ``root_path`` (to find ``queue.yaml``) keeps it; ``root_path``
+    is used for the rest.
+    """
+    from google.appengine.api import apiproxy_stub_map
+    
+    if getattr(apiproxy_stub_map, 'apiproxy', None) is None:
+        return register_stubs(services, root_path=root_path)
+    
+    app_id = os.environ.setdefault('APPLICATION_ID', 'gaetestbed')
+    for service in services:
+        path = getattr(get_stub(service), '_root_path', None) or root_path
+        replace_stub(service, STUB_FACTORIES[service](app_id, path))
+    return apiproxy_stub_map.apiproxy
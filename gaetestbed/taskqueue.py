@@ -7,21 +7,146 @@
 # which you should have received as part of this distribution.
 
 import base64
+import time
 
-from google.appengine.api import apiproxy_stub_map
+try:
+    from urlparse import parse_qsl
+except ImportError:
+    try:
+        from urllib.parse import parse_qsl
+    except ImportError:
+        # Python 2.5
+        from cgi import parse_qsl
 
 from base import BaseTestCase
+from deferred_tasks import DeferredCall, DEFERRED_URL
+from fixtures import timed_fixture
+from rpc import get_rpc_recorder
+from stubs import get_stub
 
-__all__ = ['TaskQueueTestCase']
+__all__ = ['TaskQueueTestCase', 'TaskParams']
+
+def _get_add_requests(record):
+    # The individual TaskQueueAddRequests of an ``Add`` or ``BulkAdd`` call
+    if record.method == 'Add':
+        return [record.request]
+    if record.method == 'BulkAdd':
+        return record.request.add_request_list()
+    return []
+
+class _QueueTracker(object):
+    """
+    Caches the queue names read from the stub until the stub is replaced,
+    and remembers which queues have had tasks added to them (even while the
+    RPC recorder is paused), so only those need flushing or counting.
+    
+    Asking the stub about its queues re-reads ``queue.yaml``, so it's only
+    done once for every new stub, which might already hold tasks.
+    """
+    def __init__(self):
+        self.stub = None
+        self.queue_names = None
+        self.cleared_stub = None
+        self.used = set()
+    
+    def __call__(self, record):
+        if record.service == 'taskqueue':
+            for request in _get_add_requests(record):
+                self.used.add(request.queue_name())
+    
+    def get_queue_names(self, stub):
+        if stub is not self.stub:
+            self.stub = stub
+            self.queue_names = [q['name'] for q in stub.GetQueues()]
+        return self.queue_names
+    
+    def get_used_queue_names(self, stub):
+        if stub is not self.cleared_stub:
+            return self.get_queue_names(stub)
+        return list(self.used)
+    
+    def clear(self, stub):
+        for name in self.get_used_queue_names(stub):
+            stub.FlushQueue(name)
+        self.cleared_stub = stub
+        self.used = set()
+    
+    def get_task_counts(self, stub):
+        used = self.get_used_queue_names(stub)
+        if not used:
+            return {}
+        
+        counts = {}
+        for queue in stub.GetQueues():
+            if queue['name'] in used:
+                counts[queue['name']] = queue['tasks_in_queue']
+        return counts
+
+_queue_tracker = _QueueTracker()
+
+class _PullQueue(object):
+    """
+    The lease state the test case keeps for a single pull queue.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.leases = {}
+        self.lease_counts = {}
+        self.deleted = set()
+        self.lease_calls = 0
+        self.delete_calls = 0
+    
+    def is_available(self, task_name, now):
+        if task_name in self.deleted:
+            return False
+        return self.leases.get(task_name, now) <= now
+
+class TaskParams(dict):
+    """
+    The parameters of a task, decoded from its form-encoded body.
+    
+    It's a dictionary of each name to its last value (as WebOb's
+    ``MultiDict`` reads), so it works anywhere a ``dict`` does, including
+    ``json.dumps``; ``getall(name)`` returns every value given for a name,
+    in order.
+    """
+    def __init__(self, body):
+        # Parsed straight away: dict's own C code (``dict(params)``, the
+        # json encoder) reads the entries without calling any of our
+        # methods, so they can't be filled in lazily.
+        dict.__init__(self)
+        self._lists = {}
+        for name, value in parse_qsl(body, True):
+            self._lists.setdefault(name, []).append(value)
+            self[name] = value
+    
+    def getall(self, name):
+        return list(self._lists.get(name, []))
+
+def _get_task_size(task):
+    # Measured the way the SDK's ``Task.size`` is: the payload, the URL and
+    # the headers.
+    size = len(task['decoded_body']) + len(task['url'])
+    for name, value in task.get('headers') or []:
+        size += len(name) + len(value)
+    return size
 
 class TaskQueueTestCase(BaseTestCase):
     """
     """
+    REQUIRED_STUBS = ('taskqueue',)
     
     # This is the format usable with strftime/strptime for parsing the
     # ``eta`` field for a particular task
     TASK_ETA_FORMAT = "%Y/%m/%d %H:%M:%S"
     
+    # The largest task the Task Queue API accepts, in bytes
+    TASK_SIZE_LIMIT = 100 * 1024
+    
+    # The URL of the deferred library's handler (``deferred.defer(_url=...)``)
+    DEFERRED_URL = DEFERRED_URL
+    
+    @timed_fixture('TaskQueueTestCase.setUp')
     def setUp(self):
         """
         """
@@ -38,12 +163,54 @@ class TaskQueueTestCase(BaseTestCase):
         else:
             self.assertLength(tasks, n)
     
+    def assertTasksAddedInBatches(self, max_calls=1, queue_names=None):
+        """
+        Asserts that the tasks added so far in the test were enqueued with
+        at most ``max_calls`` ``Add``/``BulkAdd`` calls, rather than one
+        call per task.
+        
+        For example::
+            
+            class MyTestCase(TaskQueueTestCase, unittest.TestCase):
+                def test_batched(self):
+                    tasks = [taskqueue.Task(url='/worker/') for i in range(10)]
+                    taskqueue.Queue('default').add(tasks)
+                    
+                    # Passes: all ten tasks went over in a single call
+                    self.assertTasksAddedInBatches()
+        """
+        calls = self.get_task_add_calls(queue_names=queue_names)
+        tasks = sum([call['tasks'] for call in calls])
+        
+        error = 'Tasks were not batched: %d tasks were added with %d Add/BulkAdd calls (expected at most %d).' % (
+            tasks, len(calls), max_calls
+        )
+        self.assertTrue(len(calls) <= max_calls, error)
+    
     def clear_task_queue(self):
         """
+        Flushes the queues tasks have been added to since the last time,
+        leaving the others alone.
         """
-        stub = self.get_task_queue_stub()
-        for name in self.get_task_queue_names():
-            stub.FlushQueue(name)
+        get_rpc_recorder().add_listener(_queue_tracker, paused=True)
+        _queue_tracker.clear(self.get_task_queue_stub())
+        
+        self._pull_queues = {}
+        self._decoded_bodies = {}
+        self._deferred_runs = []
+    
+    def get_task_count(self, queue_names=None):
+        """
+        Returns the number of tasks in the queues, as counted by the stub,
+        without fetching (and decoding) the tasks themselves, so it's much
+        cheaper than ``len(self.get_tasks())``. The stub isn't asked at all
+        if no tasks have been added since the queues were last cleared.
+        """
+        counts = _queue_tracker.get_task_counts(self.get_task_queue_stub())
+        
+        if queue_names is not None:
+            return sum([counts.get(name, 0) for name in queue_names])
+        return sum(counts.values())
     
     def get_tasks(self, url=None, name=None, queue_names=None):
         """
@@ -61,17 +228,7 @@ class TaskQueueTestCase(BaseTestCase):
             tasks = [t for t in tasks if t['name'] == name]
         
         for task in tasks:
-            params = {}
-            decoded_body = base64.b64decode(task['body'])
-            
-            if decoded_body:
-                # urlparse.parse_qs doesn't seem to be in Python 2.5...
-                params = dict([item.split('=', 2) for item in decoded_body.split('&')])
-            
-            task.update({
-                'decoded_body': decoded_body,
-                'params': params,
-            })
+            task.update(self._decode_body(task['body']))
             
             # These lines have to remain commented out as (for some reason) the strptime() call
             # throws a SystemError: Parent module 'gaetestbed' not loaded
@@ -91,6 +248,389 @@ class TaskQueueTestCase(BaseTestCase):
         
         return tasks
     
+    def _decode_body(self, body):
+        # The stub hands out new task dictionaries on every call, so bodies
+        # are decoded (and their params parsed) once per test and shared.
+        if body not in self._decoded_bodies:
+            decoded_body = base64.b64decode(body)
+            self._decoded_bodies[body] = {
+                'decoded_body': decoded_body,
+                'params': TaskParams(decoded_body),
+            }
+        return self._decoded_bodies[body]
+    
+    def get_task_sizes(self, url=None, queue_names=None):
+        """
+        Returns ``(size, task)`` for each task in the queues, largest first.
+        The size is in bytes and counts the payload, URL and headers, as the
+        Task Queue API does against ``TASK_SIZE_LIMIT``.
+        """
+        sizes = [(_get_task_size(task), task) for task in self.get_tasks(url=url, queue_names=queue_names)]
+        sizes.sort(key=lambda s: -s[0])
+        return sizes
+    
+    def get_task_size_report(self, limit=10, url=None, queue_names=None):
+        """
+        Returns the total size of the tasks in the queues, and a line for
+        each of the ``limit`` largest with its share of ``TASK_SIZE_LIMIT``.
+        """
+        sizes = self.get_task_sizes(url=url, queue_names=queue_names)
+        lines = ['%d tasks, %d bytes' % (len(sizes), sum([size for size, task in sizes]))]
+        for size, task in sizes[:limit]:
+            lines.append('  %8d bytes %5.1f%%  %s %s' % (
+                size, 100.0 * size / self.TASK_SIZE_LIMIT, task['url'], task['name'],
+            ))
+        return '\n'.join(lines)
+    
+    def assertMaxTaskPayload(self, max_bytes=None, url=None, queue_names=None):
+        """
+        Asserts that no task in the queues is bigger than ``max_bytes``
+        (``TASK_SIZE_LIMIT`` by default), counting the payload, URL and
+        headers.
+        
+        For example::
+            
+            class MyTestCase(TaskQueueTestCase, unittest.TestCase):
+                def test_small_tasks(self):
+                    schedule_reports()
+                    
+                    # Workers should get IDs, not the data itself
+                    self.assertMaxTaskPayload(1024, url='/worker/report')
+        """
+        if max_bytes is None:
+            max_bytes = self.TASK_SIZE_LIMIT
+        
+        sizes = self.get_task_sizes(url=url, queue_names=queue_names)
+        if sizes and sizes[0][0] > max_bytes:
+            size, task = sizes[0]
+            self.fail('Task %s to %s is %d bytes (expected %d (max)).' % (task['name'], task['url'], size, max_bytes))
+    
+    def get_deferred_tasks(self, queue_names=None):
+        """
+        Returns a ``DeferredCall`` for each task added with
+        ``deferred.defer()`` that's still in the queues, with the function
+        it calls, its arguments and the size of its pickled payload.
+        """
+        calls = []
+        for queue_name in queue_names or self.get_task_queue_names():
+            for task in self.get_tasks(url=self.DEFERRED_URL, queue_names=[queue_name]):
+                calls.append(DeferredCall(task, queue_name))
+        return calls
+    
+    def run_deferred_tasks(self, queue_names=None):
+        """
+        Runs the deferred tasks in the queues inline, removes them from the
+        queues, and returns them as ``DeferredCall`` objects whose
+        ``profile`` holds their wall time, CPU time and API calls.
+        
+        Tasks deferred by the tasks being run are left in the queue for the
+        next call, so chains of tasks can be stepped through::
+            
+            class MyTestCase(TaskQueueTestCase, unittest.TestCase):
+                def test_rebuild_index(self):
+                    deferred.defer(rebuild_index, 'posts')
+                    
+                    calls = self.run_deferred_tasks()
+                    self.assertLength(calls, 1)
+                    self.assertMaxDeferredRPCs(20)
+                    self.assertMaxDeferredTime(500)
+        """
+        stub = self.get_task_queue_stub()
+        calls = self.get_deferred_tasks(queue_names=queue_names)
+        
+        for call in calls:
+            # Removed first, like a leased task, so a task that fails isn't
+            # run again by the next call.
+            stub.DeleteTask(call.queue_name, call.task['name'])
+            self._deferred_runs.append(call)
+            call.run()
+        
+        return calls
+    
+    def get_deferred_report(self):
+        """
+        Returns a line for each deferred task run so far in the test, and
+        for each one still queued, with its pickled size and (for those
+        that ran) what it cost.
+        """
+        lines = []
+        for call in self._deferred_runs:
+            lines.append('  %8d bytes %8.1fms %4d RPCs  %s%s' % (
+                call.pickled_size, call.profile.wall_time * 1000.0, call.profile.rpc_count(),
+                call.name, call.error is not None and ' (failed)' or '',
+            ))
+        
+        queued = self.get_deferred_tasks()
+        for call in queued:
+            lines.append('  %8d bytes   queued            %s' % (call.pickled_size, call.name))
+        
+        lines.insert(0, '%d deferred tasks run, %d queued' % (len(self._deferred_runs), len(queued)))
+        return '\n'.join(lines)
+    
+    def assertMaxDeferredPayload(self, max_bytes, queue_names=None):
+        """
+        Asserts that no deferred task (queued, or run so far in the test)
+        pickled to more than ``max_bytes``, which usually means it's carrying
+        an entity or a big list instead of keys.
+        """
+        calls = self._deferred_runs + self.get_deferred_tasks(queue_names=queue_names)
+        for call in calls:
+            if queue_names is not None and call.queue_name not in queue_names:
+                continue
+            
+            error = 'Deferred call to %s pickled to %d bytes (expected %d (max)).' % (
+                call.name, call.pickled_size, max_bytes
+            )
+            self.assertTrue(call.pickled_size <= max_bytes, error)
+    
+    def assertMaxDeferredRPCs(self, n, service=None):
+        """
+        Asserts that no deferred task run so far in the test made more than
+        ``n`` API calls (only counting calls to ``service``, if given).
+        """
+        for call in self._deferred_runs:
+            count = call.profile.rpc_count(service)
+            
+            error = 'Too many API calls for deferred %s: expected %d (max) got %d %r' % (
+                call.name, n, count, call.profile.rpc_counts
+            )
+            self.assertTrue(count <= n, error)
+    
+    def assertMaxDeferredTime(self, max_ms):
+        """
+        Asserts that no deferred task run so far in the test took more than
+        ``max_ms`` milliseconds of wall time.
+        """
+        for call in self._deferred_runs:
+            elapsed = call.profile.wall_time * 1000.0
+            
+            error = 'Deferred %s took %.1fms (max %.1fms)' % (call.name, elapsed, max_ms)
+            self.assertTrue(elapsed <= max_ms, error)
+    
+    def get_task_add_calls(self, queue_names=None):
+        """
+        Returns one dictionary per ``Add`` or ``BulkAdd`` call made to the Task
+        Queue API so far in the test, in the order they were made. Each has
+        the ``method`` used, the number of ``tasks`` it carried, and the
+        ``queue_names`` they were added to.
+        
+        If ``queue_names`` is given, only tasks added to those queues are
+        counted, and calls that didn't touch any of them are left out.
+        """
+        calls = []
+        
+        for record in self.get_rpcs('taskqueue'):
+            requests = _get_add_requests(record)
+            if not requests:
+                continue
+            
+            if queue_names is not None:
+                requests = [r for r in requests if r.queue_name() in queue_names]
+                if not requests:
+                    continue
+            
+            names = []
+            for request in requests:
+                if request.queue_name() not in names:
+                    names.append(request.queue_name())
+            
+            calls.append({
+                'method': record.method,
+                'tasks': len(requests),
+                'queue_names': names,
+            })
+        
+        return calls
+    
+    def get_stub_sizes(self):
+        """
+        Adds the number of ``queued_tasks``, read from the stub, so tasks
+        added or removed without going through the recorded API calls are
+        counted too.
+        """
+        sizes = super(TaskQueueTestCase, self).get_stub_sizes()
+        sizes['queued_tasks'] = self.get_task_count()
+        return sizes
+    
+    def get_performance_metrics(self):
+        """
+        Adds the number of ``tasks_enqueued`` to the test's metrics.
+        """
+        metrics = super(TaskQueueTestCase, self).get_performance_metrics()
+        metrics['tasks_enqueued'] = sum([call['tasks'] for call in self.get_task_add_calls()])
+        return metrics
+    
+    def lease_tasks(self, queue_name, lease_seconds, max_tasks, tag=None):
+        """
+        Leases up to ``max_tasks`` tasks from the pull queue ``queue_name``
+        for ``lease_seconds`` of virtual time, and returns them the same way
+        ``get_tasks`` does (with each task's ``tag`` added), oldest ``eta``
+        first.
+        
+        Leases are measured against ``self.clock``, so a task becomes
+        available again once the clock has been advanced past its lease
+        without it being deleted::
+            
+            class MyTestCase(TaskQueueTestCase, unittest.TestCase):
+                def test_lease_expires(self):
+                    taskqueue.Queue('pull-queue').add(taskqueue.Task(payload='x', method='PULL'))
+                    
+                    self.assertLength(self.lease_tasks('pull-queue', 60, 10), 1)
+                    self.assertLength(self.lease_tasks('pull-queue', 60, 10), 0)
+                    
+                    # The consumer never deleted the task, so it comes back
+                    self.clock.advance(61)
+                    self.assertLength(self.lease_tasks('pull-queue', 60, 10), 1)
+        
+        Tasks whose ``eta`` hasn't come yet aren't leased; advancing the
+        clock brings it closer, as if that much time had passed.
+        
+        If ``tag`` is given, only tasks with that tag are leased.
+        
+        This is a simulation kept by the test case, not the stub's
+        ``QueryAndOwnTasks``, so that leases can run on the virtual clock:
+        the stub never sees the leases (``get_tasks`` still lists leased
+        tasks) and leasing isn't recorded as an API call.
+        """
+        return self._lease_tasks(queue_name, lease_seconds, max_tasks, tag, tag is not None)
+    
+    def lease_tasks_by_tag(self, queue_name, lease_seconds, max_tasks, tag=None):
+        """
+        Leases up to ``max_tasks`` tasks that share a tag, like ``lease_tasks``.
+        
+        If ``tag`` isn't given, the tag of the first available task in the
+        queue is used (and if that task has no tag, only untagged tasks are
+        leased).
+        """
+        if tag is None:
+            tasks = self._get_available_tasks(queue_name)
+            if tasks:
+                tag = tasks[0]['tag']
+        
+        return self._lease_tasks(queue_name, lease_seconds, max_tasks, tag, True)
+    
+    def _lease_tasks(self, queue_name, lease_seconds, max_tasks, tag, match_tag):
+        pull_queue = self._get_pull_queue(queue_name)
+        pull_queue.lease_calls += 1
+        now = self.clock.now()
+        
+        tasks = []
+        for task in self._get_available_tasks(queue_name):
+            if len(tasks) >= max_tasks:
+                break
+            if match_tag and task['tag'] != tag:
+                continue
+            
+            pull_queue.leases[task['name']] = now + lease_seconds
+            pull_queue.lease_counts[task['name']] = pull_queue.lease_counts.get(task['name'], 0) + 1
+            tasks.append(task)
+        
+        return tasks
+    
+    def _get_available_tasks(self, queue_name):
+        # The task dictionaries don't carry tags (and only newer SDKs give
+        # ``eta_usec``), so those come from a QueryTasks call made straight
+        # to the stub, which isn't recorded.
+        from google.appengine.api.taskqueue import taskqueue_service_pb
+        
+        pull_queue = self._get_pull_queue(queue_name)
+        now = self.clock.now()
+        eta_now = time.time() + (now - self.clock.start)
+        
+        request = taskqueue_service_pb.TaskQueueQueryTasksRequest()
+        request.set_queue_name(queue_name)
+        request.set_max_rows(max(1, self.get_task_count(queue_names=[queue_name])))
+        response = taskqueue_service_pb.TaskQueueQueryTasksResponse()
+        self.get_task_queue_stub().MakeSyncCall('taskqueue', 'QueryTasks', request, response)
+        
+        found = {}
+        for task in response.task_list():
+            tag = task.has_tag() and task.tag() or None
+            found[task.task_name()] = (task.eta_usec() / 1000000.0, tag)
+        
+        tasks = []
+        for task in self.get_tasks(queue_names=[queue_name]):
+            if task['name'] not in found or not pull_queue.is_available(task['name'], now):
+                continue
+            
+            eta, task['tag'] = found[task['name']]
+            if eta <= eta_now:
+                tasks.append(task)
+        return tasks
+    
+    def delete_tasks(self, queue_name, tasks):
+        """
+        Deletes ``tasks`` (task dictionaries or task names) from the pull
+        queue ``queue_name`` in a single batch.
+        """
+        pull_queue = self._get_pull_queue(queue_name)
+        pull_queue.delete_calls += 1
+        stub = self.get_task_queue_stub()
+        
+        for task in tasks:
+            if isinstance(task, dict):
+                task = task['name']
+            if task in pull_queue.deleted:
+                continue
+            
+            stub.DeleteTask(queue_name, task)
+            pull_queue.deleted.add(task)
+            pull_queue.leases.pop(task, None)
+    
+    def get_pull_queue_stats(self, queue_name):
+        """
+        Returns a dictionary describing how the pull queue ``queue_name`` has
+        been consumed so far in the test:
+        
+        * ``lease_calls``, ``delete_calls``: the number of batches
+        * ``leased``: the total number of tasks handed out (including redeliveries)
+        * ``redelivered``: how many of those were tasks that had been leased before
+        * ``deleted``: the number of tasks deleted
+        * ``outstanding``: tasks leased but not deleted whose lease is still active
+        * ``expired``: tasks leased but not deleted whose lease has run out
+        """
+        pull_queue = self._get_pull_queue(queue_name)
+        now = self.clock.now()
+        
+        leased = sum(pull_queue.lease_counts.values())
+        outstanding = [n for n, expires in pull_queue.leases.items() if expires > now]
+        
+        return {
+            'lease_calls': pull_queue.lease_calls,
+            'delete_calls': pull_queue.delete_calls,
+            'leased': leased,
+            'redelivered': leased - len(pull_queue.lease_counts),
+            'deleted': len(pull_queue.deleted),
+            'outstanding': len(outstanding),
+            'expired': len(pull_queue.leases) - len(outstanding),
+        }
+    
+    def assertNoOutstandingLeases(self, queue_name):
+        """
+        Asserts that every task leased from ``queue_name`` was deleted,
+        whether or not its lease has expired yet.
+        """
+        stats = self.get_pull_queue_stats(queue_name)
+        leased_not_deleted = stats['outstanding'] + stats['expired']
+        
+        error = '%d task(s) leased from %s were never deleted.' % (leased_not_deleted, queue_name)
+        self.assertEqual(leased_not_deleted, 0, error)
+    
+    def assertMaxRedeliveries(self, n, queue_name):
+        """
+        Asserts that tasks from ``queue_name`` were handed out again after
+        their lease expired no more than ``n`` times.
+        """
+        redelivered = self.get_pull_queue_stats(queue_name)['redelivered']
+        
+        error = 'Too many redeliveries from %s: expected %d (max) got %d.' % (queue_name, n, redelivered)
+        self.assertTrue(redelivered <= n, error)
+    
+    def _get_pull_queue(self, queue_name):
+        if queue_name not in self._pull_queues:
+            self._pull_queues[queue_name] = _PullQueue(queue_name)
+        return self._pull_queues[queue_name]
+    
     def get_task_queues(self):
         """
         """
@@ -98,11 +638,15 @@ class TaskQueueTestCase(BaseTestCase):
     
     def get_task_queue_names(self):
         """
+        Returns the names of all the queues.
+        
+        Queues can't be added while the app is running, so the names are
+        only read once for each new stub.
         """
-        return [q['name'] for q in self.get_task_queues()]
+        return list(_queue_tracker.get_queue_names(self.get_task_queue_stub()))
     
     def get_task_queue_stub(self):
         """
         """
-        return apiproxy_stub_map.apiproxy._APIProxyStubMap__stub_map['taskqueue']
-    
+        return get_stub('taskqueue')
+
@@ -0,0 +1,232 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import random
+import time
+
+from rpc import get_rpc_recorder
+from stubs import get_stub
+
+__all__ = ['TransactionRun', 'TransactionAttempt', 'get_transaction_tracker']
+
+class TransactionAttempt(object):
+    """
+    A single try at a transaction, from ``BeginTransaction`` to ``Commit``
+    or ``Rollback``. ``outcome`` is ``'committed'``, ``'collision'``,
+    ``'rolled back'`` or ``None`` while it's still open.
+    """
+    def __init__(self, start):
+        self.start = start
+        self.end = None
+        self.handle = None
+        self.entity_groups = set()
+        self.writes = 0
+        self.outcome = None
+    
+    @property
+    def duration(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+class TransactionRun(object):
+    """
+    A single ``db.run_in_transaction`` call: every attempt it made until one
+    committed, it gave up, or the function raised an exception.
+    """
+    def __init__(self):
+        self.attempts = []
+    
+    @property
+    def retries(self):
+        return len(self.attempts) - 1
+    
+    @property
+    def collisions(self):
+        return len([a for a in self.attempts if a.outcome == 'collision'])
+    
+    @property
+    def committed(self):
+        return bool(self.attempts) and self.attempts[-1].outcome == 'committed'
+    
+    @property
+    def entity_groups(self):
+        """
+        The entity groups touched by any attempt.
+        """
+        groups = set()
+        for attempt in self.attempts:
+            groups.update(attempt.entity_groups)
+        return groups
+    
+    @property
+    def writes(self):
+        """
+        The number of entities written by the last attempt.
+        """
+        return self.attempts and self.attempts[-1].writes or 0
+    
+    @property
+    def duration(self):
+        """
+        Seconds spent inside the transaction over all of the attempts.
+        """
+        return sum([a.duration or 0.0 for a in self.attempts])
+
+def _entity_group(reference):
+    root = reference.path().element(0)
+    if root.has_name():
+        return '%s:%s' % (root.type(), root.name())
+    return '%s:%s' % (root.type(), root.id())
+
+class _TransactionTracker(object):
+    """
+    Follows transactions through the datastore API calls.
+    
+    Attempts are told apart from separate ``run_in_transaction`` calls by
+    what happened to the previous attempt: a ``BeginTransaction`` after a
+    collision is a retry. A call that gives up after its last retry can't be
+    told apart from a new call that starts straight after it.
+    
+    It also injects collisions: with ``collision_rate`` set, that share of
+    commits have their transaction rolled back by the stub, which then
+    fails them with ``CONCURRENT_TRANSACTION`` exactly as if another request
+    had written to the entity group first. The error comes back through the
+    API call like a real one, so the datastore library turns it into
+    ``TransactionFailedError`` and ``db.run_in_transaction`` retries.
+    """
+    HOOK_KEY = 'gaetestbed-transactions'
+    
+    def __init__(self):
+        self._apiproxy = None
+        self._stub = None
+        self.reset()
+    
+    def reset(self, collision_rate=0.0, seed=0):
+        self.runs = []
+        self.collision_rate = collision_rate
+        self.random = random.Random(seed)
+        self._attempts = {}
+    
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        
+        get_rpc_recorder().add_listener(self._finished)
+        
+        apiproxy = apiproxy_stub_map.apiproxy
+        if apiproxy is not self._apiproxy:
+            apiproxy.GetPreCallHooks().Append(self.HOOK_KEY, self._pre_call)
+            self._apiproxy = apiproxy
+        
+        stub = get_stub('datastore_v3')
+        if stub is not self._stub:
+            self._wrap_commit(stub)
+            self._stub = stub
+    
+    def _wrap_commit(self, stub):
+        # The stub looks its handlers up by name on every call, so the
+        # instance attribute takes over from the class's method.
+        commit = stub._Dynamic_Commit
+        
+        def _Dynamic_Commit(transaction, response):
+            attempt = self._attempts.get(transaction.handle())
+            if self.collision_rate and not get_rpc_recorder().paused:
+                if self.random.random() < self.collision_rate:
+                    self._collide(stub, transaction, attempt)
+            return commit(transaction, response)
+        
+        stub._Dynamic_Commit = _Dynamic_Commit
+    
+    def _current_attempt(self):
+        if self.runs and self.runs[-1].attempts:
+            return self.runs[-1].attempts[-1]
+        return None
+    
+    def _pre_call(self, service, call, request, response):
+        if service != 'datastore_v3' or get_rpc_recorder().paused:
+            return
+        
+        if call == 'BeginTransaction':
+            attempt = self._current_attempt()
+            if attempt is not None and attempt.outcome is None and attempt.end is not None:
+                # The commit never came back, so it must have collided
+                attempt.outcome = 'collision'
+            
+            if attempt is None or attempt.outcome != 'collision':
+                self.runs.append(TransactionRun())
+            self.runs[-1].attempts.append(TransactionAttempt(time.time()))
+        
+        elif call == 'Commit':
+            attempt = self._attempts.get(request.handle())
+            if attempt is not None:
+                attempt.end = time.time()
+    
+    def _collide(self, stub, transaction, attempt):
+        from google.appengine.api import api_base_pb
+        from google.appengine.datastore import datastore_pb
+        from google.appengine.runtime import apiproxy_errors
+        
+        # Roll the stub's transaction back so it lets go of the entity
+        # group, as the real datastore does.
+        stub._Dynamic_Rollback(transaction, api_base_pb.VoidProto())
+        if attempt is not None:
+            attempt.outcome = 'collision'
+        
+        raise apiproxy_errors.ApplicationError(
+            datastore_pb.Error.CONCURRENT_TRANSACTION, 'Collision injected by gaetestbed'
+        )
+    
+    def _attempt_for(self, request):
+        if not request.has_transaction():
+            return None
+        return self._attempts.get(request.transaction().handle())
+    
+    def _finished(self, record):
+        if record.service != 'datastore_v3':
+            return
+        
+        if record.method == 'BeginTransaction':
+            attempt = self._current_attempt()
+            if attempt is not None:
+                attempt.handle = record.response.handle()
+                self._attempts[attempt.handle] = attempt
+        
+        elif record.method in ('Commit', 'Rollback'):
+            attempt = self._attempts.pop(record.request.handle(), None)
+            if attempt is not None:
+                attempt.end = time.time()
+                attempt.outcome = record.method == 'Commit' and 'committed' or 'rolled back'
+        
+        elif record.method == 'Put':
+            attempt = self._attempt_for(record.request)
+            if attempt is not None:
+                attempt.writes += len(record.request.entity_list())
+                for key in record.response.key_list():
+                    attempt.entity_groups.add(_entity_group(key))
+        
+        elif record.method in ('Get', 'Delete'):
+            attempt = self._attempt_for(record.request)
+            if attempt is not None:
+                if record.method == 'Delete':
+                    attempt.writes += len(record.request.key_list())
+                for key in record.request.key_list():
+                    attempt.entity_groups.add(_entity_group(key))
+        
+        elif record.method == 'RunQuery':
+            attempt = self._attempt_for(record.request)
+            if attempt is not None and record.request.has_ancestor():
+                attempt.entity_groups.add(_entity_group(record.request.ancestor()))
+
+_tracker = _TransactionTracker()
+
+def get_transaction_tracker():
+    """
+    Installs (if needed) and returns the transaction tracker.
+    """
+    _tracker.install()
+    return _tracker
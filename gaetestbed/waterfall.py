@@ -0,0 +1,216 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import cgi
+
+try:
+    import json
+except ImportError:
+    from django.utils import simplejson as json
+
+__all__ = ['Waterfall']
+
+class Waterfall(object):
+    """
+    A timeline of the API calls made during a test, a block of a test, or
+    a request.
+    
+    Besides drawing the timeline (``format_text``, ``format_html`` and
+    ``to_json``), it works out how much of the time spent waiting on API
+    calls was serial and how much overlapped, and which calls look like
+    they could have been made in parallel.
+    
+    Calls made with ``make_rpc``/``get_async`` are included; they start when
+    the call is made and end when its result is waited on.
+    """
+    def __init__(self, records=None, start=None, end=None):
+        self.records = []
+        self.start = start
+        self.end = end
+        if records is not None:
+            self.capture(records, start, end)
+    
+    def capture(self, records, start=None, end=None):
+        """
+        Replaces the calls in the waterfall. Calls that never finished are
+        left out.
+        """
+        self.records = [r for r in records if r.start is not None and r.end is not None]
+        self.records.sort(key=lambda r: r.start)
+        
+        self.start = start
+        if self.start is None and self.records:
+            self.start = self.records[0].start
+        
+        self.end = end
+        if self.end is None and self.records:
+            self.end = max([r.end for r in self.records])
+    
+    @property
+    def wall_time(self):
+        """
+        Seconds from the start to the end of the waterfall.
+        """
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+    
+    @property
+    def serial_time(self):
+        """
+        Seconds the calls would take one after the other (the sum of their
+        durations).
+        """
+        return sum([r.duration for r in self.records])
+    
+    @property
+    def busy_time(self):
+        """
+        Seconds during which at least one call was in flight. This is the
+        part of the wall time that was spent waiting on API calls.
+        """
+        busy = 0.0
+        current_start = current_end = None
+        
+        for record in self.records:
+            if current_end is None or record.start > current_end:
+                if current_end is not None:
+                    busy += current_end - current_start
+                current_start, current_end = record.start, record.end
+            else:
+                current_end = max(current_end, record.end)
+        
+        if current_end is not None:
+            busy += current_end - current_start
+        return busy
+    
+    @property
+    def overlapped_time(self):
+        """
+        Seconds saved by calls running at the same time
+        (``serial_time - busy_time``).
+        """
+        return self.serial_time - self.busy_time
+    
+    def parallelizable(self):
+        """
+        Returns runs of calls that look like they could have been made in
+        parallel (or batched): two or more consecutive calls to the same
+        service and method where each started only after the previous one
+        had finished, ie, ``db.get`` in a loop.
+        
+        Each run is a dictionary with the ``service``, ``method``, the
+        ``records`` and the ``savings`` in seconds had they all overlapped.
+        """
+        runs = []
+        run = []
+        
+        for record in self.records:
+            if run and (record.service, record.method) == (run[-1].service, run[-1].method) \
+                    and record.start >= run[-1].end:
+                run.append(record)
+                continue
+            
+            if len(run) > 1:
+                runs.append(run)
+            run = [record]
+        
+        if len(run) > 1:
+            runs.append(run)
+        
+        return [{
+            'service': run[0].service,
+            'method': run[0].method,
+            'records': run,
+            'savings': sum([r.duration for r in run]) - max([r.duration for r in run]),
+        } for run in runs]
+    
+    def to_dict(self):
+        """
+        Returns the waterfall as plain data; times are milliseconds from the
+        start of the waterfall.
+        """
+        def offset(t):
+            return (t - self.start) * 1000.0
+        
+        return {
+            'wall_time': self.wall_time * 1000.0,
+            'serial_time': self.serial_time * 1000.0,
+            'busy_time': self.busy_time * 1000.0,
+            'overlapped_time': self.overlapped_time * 1000.0,
+            'rpcs': [{
+                'service': r.service,
+                'method': r.method,
+                'start': offset(r.start),
+                'end': offset(r.end),
+                'duration': r.duration * 1000.0,
+            } for r in self.records],
+            'parallelizable': [{
+                'service': run['service'],
+                'method': run['method'],
+                'count': len(run['records']),
+                'savings': run['savings'] * 1000.0,
+            } for run in self.parallelizable()],
+        }
+    
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+    
+    def _summary_lines(self):
+        lines = ['%d RPCs in %.1fms: %.1fms serial, %.1fms waiting (%.1fms saved by overlap)' % (
+            len(self.records), self.wall_time * 1000.0, self.serial_time * 1000.0,
+            self.busy_time * 1000.0, self.overlapped_time * 1000.0,
+        )]
+        for run in self.parallelizable():
+            lines.append('%d sequential %s.%s calls could run in parallel (saving ~%.1fms)' % (
+                len(run['records']), run['service'], run['method'], run['savings'] * 1000.0,
+            ))
+        return lines
+    
+    def format_text(self, width=50):
+        """
+        Draws the waterfall as text, one line per call::
+            
+            datastore_v3.Get        0.0ms   1.2ms |####                 |
+            datastore_v3.Get        1.3ms   1.1ms |    ####             |
+        """
+        lines = []
+        scale = self.wall_time and width / self.wall_time or 0
+        
+        for r in self.records:
+            left = int((r.start - self.start) * scale)
+            length = max(1, int(r.duration * scale))
+            bar = (' ' * left + '#' * length)[:width].ljust(width)
+            lines.append('%-30s %8.1fms %7.1fms |%s|' % (
+                '%s.%s' % (r.service, r.method), (r.start - self.start) * 1000.0, r.duration * 1000.0, bar,
+            ))
+        
+        return '\n'.join(lines + self._summary_lines())
+    
+    def format_html(self):
+        """
+        Draws the waterfall as a standalone HTML table.
+        """
+        rows = []
+        wall_time = self.wall_time or 1.0
+        
+        for r in self.records:
+            rows.append(
+                '<tr><td>%s.%s</td><td>%.1fms</td><td style="width:600px">'
+                '<div style="margin-left:%.2f%%;width:%.2f%%;min-width:1px;background:#36c">&nbsp;</div>'
+                '</td></tr>' % (
+                    cgi.escape(r.service), cgi.escape(r.method), r.duration * 1000.0,
+                    (r.start - self.start) / wall_time * 100, r.duration / wall_time * 100,
+                )
+            )
+        
+        summary = ''.join(['<p>%s</p>' % cgi.escape(line) for line in self._summary_lines()])
+        return '<html><body><table>%s</table>%s</body></html>' % (''.join(rows), summary)
+    
+    def __str__(self):
+        return self.format_text()
@@ -5,21 +5,72 @@
 # 
 # This software is licensed as described in the file COPYING.txt,
 # which you should have received as part of this distribution.
-import webtest
+import email.utils
+import sys
+import time
 
 from base import BaseTestCase
+from coldstart import measure_cold_start
+from impact import get_coverage_recorder
+from load import run_load
+from profiler import ProfilingMiddleware, ResponsePayload, TimingMiddleware
+from replay import load_requests, replay, route_for
+from stats import mean
 
 __all__ = ['WebTestCase']
 
+# Content types App Engine will gzip when the browser accepts it
+COMPRESSIBLE_CONTENT_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/x-javascript',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+)
+
+# webtest.TestApp wrappers, shared by every test that uses the same
+# APPLICATION. Keyed by (id(APPLICATION), profile settings); the
+# application itself is kept alongside so its id can't be reused.
+_test_apps = {}
+
 class WebTestCase(BaseTestCase):
     APPLICATION = None
     
+    # Most handlers check who's logged in or fetch URLs
+    REQUIRED_STUBS = ('user', 'urlfetch')
+    
+    # Set PROFILE_REQUESTS to record a RequestProfile (wall time, CPU time
+    # and API calls) on ``response.profile`` for every request. If
+    # PROFILE_DIR is also set, cProfile stats are dumped there per request.
+    PROFILE_REQUESTS = False
+    PROFILE_DIR = None
+    
+    # The module (and attribute in it) that defines APPLICATION, for
+    # measuring cold starts. If not set, APPLICATION's own ``__module__`` is
+    # used, which only works when APPLICATION is a function.
+    COLD_START_MODULE = None
+    COLD_START_ATTRIBUTE = None
+    
     def get_application(self):
+        """
+        Returns the ``webtest.TestApp`` wrapping ``APPLICATION``.
+        
+        The ``TestApp`` is built once and shared between every test (and
+        test case) using the same ``APPLICATION``; its cookies are cleared
+        the first time each test asks for it, so tests stay sandboxed.
+        """
         if not hasattr(self, '_app'):
             self._app = None
         
         if not self._app and self.APPLICATION:
-            self._app = webtest.TestApp(self.APPLICATION)
+            self._app = self._get_test_app()
+            if hasattr(self._app, 'reset'):
+                self._app.reset()
+            else:
+                self._app.cookies.clear()
         
         error = 'Missing class variable APPLICATION'
         self.assertTrue(self._app is not None, error)
@@ -28,6 +79,37 @@ class WebTestCase(BaseTestCase):
     
     app = property(get_application)
     
+    @classmethod
+    def prepare_application(cls):
+        """
+        Builds the shared ``TestApp`` for ``APPLICATION`` ahead of time.
+        
+        Call this at import time to keep the cost of wrapping a large
+        application out of the first test that uses it::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+            
+            MyTestCase.prepare_application()
+        """
+        if cls.APPLICATION:
+            cls._get_test_app()
+    
+    @classmethod
+    def _get_test_app(cls):
+        profiled = bool(cls.PROFILE_REQUESTS or cls.PROFILE_DIR)
+        key = (id(cls.APPLICATION), profiled, cls.PROFILE_DIR)
+        
+        if key not in _test_apps:
+            import webtest
+            
+            application = TimingMiddleware(cls.APPLICATION)
+            if profiled:
+                application = ProfilingMiddleware(application, cls.PROFILE_DIR)
+            _test_apps[key] = (cls.APPLICATION, webtest.TestApp(application))
+        
+        return _test_apps[key][1]
+    
     def assertRedirects(self, response, to=None):
         """
         Asserts that a response from the test web server (using `get` or `post)
@@ -38,7 +120,7 @@ class WebTestCase(BaseTestCase):
         non-redirecting status code.
         
         For example::
-        
+            
             import unittest
             
             from gaetestbed import WebTestCase
@@ -75,7 +157,7 @@ class WebTestCase(BaseTestCase):
         and instead the server tells the browser to redirect elsewhere.
         
         For example::
-        
+            
             import unittest
             
             from gaetestbed import WebTestCase
@@ -98,6 +180,444 @@ class WebTestCase(BaseTestCase):
         error = 'Response did not return a 200 OK (status code was %i)' % response.status_int
         return self.assertEqual(response.status_int, 200, error)
     
+    def assertResponseTime(self, response, max_ms):
+        """
+        Asserts that handling the request for ``response`` took no more than
+        ``max_ms`` milliseconds of wall time.
+        
+        This needs ``PROFILE_REQUESTS`` to be turned on::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+                PROFILE_REQUESTS = True
+                
+                def test_home_page_budget(self):
+                    response = self.get('/')
+                    self.assertResponseTime(response, 50)
+                    self.assertMaxRPCs(response, 3)
+        """
+        profile = self._get_profile(response)
+        elapsed = profile.wall_time * 1000.0
+        
+        error = 'Response for %s took %.1fms (max %.1fms)' % (profile.path, elapsed, max_ms)
+        self.assertTrue(elapsed <= max_ms, error)
+    
+    def assertMaxRPCs(self, response, n, service=None):
+        """
+        Asserts that handling the request for ``response`` made no more than
+        ``n`` API calls (only counting calls to ``service``, if given).
+        
+        Like ``assertResponseTime``, this needs ``PROFILE_REQUESTS``.
+        """
+        profile = self._get_profile(response)
+        count = profile.rpc_count(service)
+        
+        error = 'Too many API calls for %s: expected %d (max) got %d %r' % (
+            profile.path, n, count, profile.rpc_counts
+        )
+        self.assertTrue(count <= n, error)
+    
+    def _get_profile(self, response):
+        profile = getattr(response, 'profile', None)
+        
+        error = 'Response was not profiled (set PROFILE_REQUESTS = True on the test case)'
+        self.assertTrue(profile is not None, error)
+        
+        return profile
+    
+    def _get_latency_waterfall(self, response):
+        if response is None:
+            return super(WebTestCase, self)._get_latency_waterfall(response)
+        return self._get_profile(response).waterfall
+    
+    def _get_route(self, method, path):
+        # The handler class serving ``path`` if APPLICATION is a webapp
+        # WSGIApplication, so the coverage map can tie routes to the modules
+        # defining them; otherwise the request's ``route_for()`` route.
+        for regexp, handler in getattr(self.APPLICATION, '_url_mapping', None) or []:
+            if regexp.match(path):
+                return '%s.%s' % (handler.__module__, handler.__name__)
+        return route_for(method, path)
+    
+    def _instrument_response(self, response):
+        environ = response.request.environ
+        
+        recorder = get_coverage_recorder()
+        if recorder.touched is not None:
+            recorder.add_route(self._get_route(environ.get('REQUEST_METHOD'), environ.get('PATH_INFO', '')))
+        response.profile = environ.get(ProfilingMiddleware.ENVIRON_KEY)
+        
+        timing = environ.get(TimingMiddleware.ENVIRON_KEY)
+        time_to_first_byte = None
+        if timing and timing['first_byte'] is not None:
+            time_to_first_byte = timing['first_byte'] - timing['start']
+        
+        response.payload = ResponsePayload(
+            method = environ.get('REQUEST_METHOD'),
+            url = response.request.path_qs,
+            body = response.body,
+            content_type = response.headers.get('Content-Type'),
+            time_to_first_byte = time_to_first_byte,
+            status = response.status_int,
+        )
+        
+        if not hasattr(self, '_response_payloads'):
+            self._response_payloads = []
+        self._response_payloads.append(response.payload)
+        
+        return response
+    
+    def assertMaxResponseSize(self, response, max_bytes, compressed=False):
+        """
+        Asserts that the body of ``response`` is no more than ``max_bytes``
+        bytes, or no more than that once gzipped if ``compressed`` is ``True``::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+                
+                def test_feed_size(self):
+                    response = self.get('/api/feed.json')
+                    self.assertMaxResponseSize(response, 64 * 1024)
+                    self.assertMaxResponseSize(response, 8 * 1024, compressed=True)
+                    self.assertCompressible(response)
+        """
+        payload = response.payload
+        size = payload.gzip_size if compressed else payload.size
+        
+        error = 'Response for %s is too large: expected %d bytes (max) got %d%s' % (
+            payload.url, max_bytes, size, compressed and ' (gzipped)' or ''
+        )
+        self.assertTrue(size <= max_bytes, error)
+    
+    def assertCompressible(self, response, max_ratio=0.9):
+        """
+        Asserts that ``response`` has a content type App Engine will gzip,
+        and that gzipping shrinks it to at most ``max_ratio`` of its size.
+        """
+        payload = response.payload
+        content_type = (payload.content_type or '').split(';')[0].strip().lower()
+        
+        compressible = [t for t in COMPRESSIBLE_CONTENT_TYPES if content_type.startswith(t)]
+        error = 'Response for %s has a content type that is not compressed: %s' % (payload.url, content_type)
+        self.assertTrue(compressible, error)
+        
+        ratio = payload.compression_ratio
+        if ratio is not None:
+            error = 'Response for %s does not compress well: gzipped to %d%% of %d bytes (expected %d%% max)' % (
+                payload.url, ratio * 100, payload.size, max_ratio * 100
+            )
+            self.assertTrue(ratio <= max_ratio, error)
+    
+    def get_response_size_report(self):
+        """
+        Returns a dictionary, keyed by URL, summarizing the responses made so
+        far in the test: the number of ``requests``, the largest ``size``
+        and ``gzip_size`` in bytes, and the mean ``time_to_first_byte`` in
+        seconds.
+        
+        ``304 Not Modified`` responses (ie, from ``revalidate``) don't send
+        the body again, so they're only counted, as ``not_modified``, and
+        left out of everything else.
+        """
+        payloads = {}
+        for payload in getattr(self, '_response_payloads', []):
+            payloads.setdefault(payload.url, []).append(payload)
+        
+        report = {}
+        for url, url_payloads in payloads.items():
+            full = [p for p in url_payloads if p.status != 304]
+            first_bytes = [p.time_to_first_byte for p in full if p.time_to_first_byte is not None]
+            report[url] = {
+                'requests': len(full),
+                'not_modified': len(url_payloads) - len(full),
+                'size': max([p.size for p in full] or [0]),
+                'gzip_size': max([p.gzip_size for p in full] or [0]),
+                'time_to_first_byte': mean(first_bytes),
+            }
+        
+        return report
+    
+    def load(self, path_or_script, concurrency=1, requests=1):
+        """
+        Runs a small load test against ``APPLICATION`` in-process, using the
+        same stubs as the rest of the test, and returns a ``LoadReport``.
+        
+        ``path_or_script`` is a path to ``GET``, a list of paths, or a
+        callable that makes one request with the ``webtest.TestApp`` it's
+        given (see ``gaetestbed.load.run_load``)::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+                
+                def test_home_page_under_load(self):
+                    report = self.load('/', concurrency=8, requests=400)
+                    self.assertThroughputAbove(report, 200)
+                    self.assertLatencyBelow(report, 25, percentile=95)
+                    self.assertMaxRPCsPerRequest(report, 2)
+        
+        Keep in mind that the SDK stubs were written for the single-threaded
+        dev_appserver; they're fine for reads but writes from many threads
+        at once may not behave like production.
+        """
+        self.get_application()
+        return run_load(self._get_test_app().app, path_or_script, concurrency, requests)
+    
+    def replay(self, requests, concurrency=1, speed=None, route=route_for):
+        """
+        Replays recorded traffic against ``APPLICATION`` and returns a
+        ``ReplayReport`` with latency and API call counts per route.
+        
+        ``requests`` is the path to an access log or HAR file, or a list of
+        ``gaetestbed.replay.ReplayRequest``. See ``gaetestbed.replay.replay``
+        for ``concurrency``, ``speed`` (pacing) and ``route``.
+        
+        Saving the report lets you compare two revisions of your code::
+            
+            class MyTestCase(FunctionalTestCase, unittest.TestCase):
+                APPLICATION = application
+                
+                def test_replay_production_traffic(self):
+                    report = self.replay('fixtures/access.log', concurrency=4)
+                    report.save('replay-current.json')
+                    
+                    # gaetestbed.replay.ReplayReport, compare_reports
+                    baseline = ReplayReport.load('replay-release.json')
+                    for row in compare_reports(baseline, report):
+                        self.assertTrue(row['mean_rpcs']['delta'] <= 0, row['route'])
+        """
+        if isinstance(requests, basestring):
+            requests = load_requests(requests)
+        
+        self.get_application()
+        return replay(self._get_test_app().app, requests, concurrency, speed, route)
+    
+    def measure_cold_start(self, path='/'):
+        """
+        Imports the module defining ``APPLICATION`` in a fresh Python
+        process, handles a ``GET`` for ``path`` there, and returns a
+        ``gaetestbed.coldstart.ColdStartReport`` with the import time (and a
+        per-module breakdown), first request latency and memory use.
+        
+        This is what a loading request costs on a new App Engine instance,
+        less the time it takes to start the instance itself.
+        """
+        module, attribute = self._get_application_location()
+        return measure_cold_start(module, attribute, path)
+    
+    def assertColdStartBelow(self, max_ms, path='/'):
+        """
+        Asserts that importing the module defining ``APPLICATION`` and
+        handling a first request for ``path`` took no more than ``max_ms``
+        milliseconds in a fresh process::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+                
+                def test_loading_request(self):
+                    self.assertColdStartBelow(500)
+        
+        On failure, the slowest module imports are included in the message.
+        """
+        report = self.measure_cold_start(path)
+        
+        error = 'Cold start too slow: expected %.1fms (max).\n%s' % (max_ms, report.format(limit=10))
+        self.assertTrue(report.total_time <= max_ms, error)
+    
+    def _get_application_location(self):
+        if self.COLD_START_MODULE:
+            return self.COLD_START_MODULE, self.COLD_START_ATTRIBUTE or 'application'
+        
+        # Functions know the module they were defined in; instances (like a
+        # webapp.WSGIApplication) only know their class's, so those need
+        # COLD_START_MODULE.
+        application = getattr(self.APPLICATION, 'im_func', self.APPLICATION)
+        module = sys.modules.get(getattr(application, '__module__', None) or '')
+        if module is not None:
+            for attribute, value in vars(module).items():
+                if value is application:
+                    return module.__name__, attribute
+        
+        self.fail(
+            'Unable to find the module defining APPLICATION %r: set COLD_START_MODULE '
+            '(and COLD_START_ATTRIBUTE, if it is not "application") on the test case.' % (self.APPLICATION,)
+        )
+    
+    def assertThroughputAbove(self, report, requests_per_second):
+        """
+        Asserts that a load test (see ``load``) managed at least
+        ``requests_per_second`` requests per second, without errors.
+        """
+        self.assertEqual(report.errors, 0, 'Load test had %d errors: %s' % (report.errors, report))
+        
+        error = 'Throughput too low: expected %.1f req/s (min) got %.1f req/s' % (
+            requests_per_second, report.throughput
+        )
+        self.assertTrue(report.throughput >= requests_per_second, error)
+    
+    def assertLatencyBelow(self, report, max_ms, percentile=95):
+        """
+        Asserts that the ``percentile``-th percentile latency of a load test
+        was no more than ``max_ms`` milliseconds.
+        """
+        latency = report.percentile(percentile) or 0.0
+        
+        error = 'p%s latency too high: expected %.1fms (max) got %.1fms' % (percentile, max_ms, latency)
+        self.assertTrue(latency <= max_ms, error)
+    
+    def assertMaxRPCsPerRequest(self, report, n):
+        """
+        Asserts that no request in a load test made more than ``n`` API calls.
+        """
+        count = report.max_rpcs_per_request
+        
+        error = 'Too many API calls per request: expected %d (max) got %d' % (n, count)
+        self.assertTrue(count <= n, error)
+    
+    def assertCacheable(self, response, min_max_age=None, public=True):
+        """
+        Asserts that ``response`` can be cached, by the edge cache if
+        ``public`` is ``True`` or just by the browser otherwise.
+        
+        The response's ``Cache-Control`` header must not include
+        ``no-cache`` or ``no-store`` (or ``private``, for public caching),
+        and it needs a positive lifetime from ``max-age`` (``s-maxage`` for
+        public caching) or ``Expires``. If ``min_max_age`` is given, the lifetime
+        must be at least that many seconds::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+                
+                def test_logo_is_cached(self):
+                    response = self.get('/images/logo.png')
+                    self.assertCacheable(response, min_max_age=3600)
+                    self.assertHasETag(response)
+        """
+        cache_control = self._get_cache_control(response)
+        header = response.headers.get('Cache-Control', '')
+        
+        for directive in ('no-cache', 'no-store'):
+            error = 'Response is not cacheable (Cache-Control: %s)' % header
+            self.assertFalse(directive in cache_control, error)
+        
+        if public:
+            error = 'Response is only privately cacheable (Cache-Control: %s)' % header
+            self.assertFalse('private' in cache_control, error)
+        
+        lifetime = self._get_cache_lifetime(response, public)
+        
+        error = 'Response has no cache lifetime (no max-age or Expires)'
+        self.assertTrue(lifetime is not None and lifetime > 0, error)
+        
+        if min_max_age is not None:
+            error = 'Response cache lifetime too short: expected %ds (min) got %ds' % (min_max_age, lifetime)
+            self.assertTrue(lifetime >= min_max_age, error)
+    
+    def assertNotCacheable(self, response):
+        """
+        Asserts that ``response`` tells caches not to store it, with
+        ``no-cache``, ``no-store``, ``private`` or a zero ``max-age``.
+        """
+        cache_control = self._get_cache_control(response)
+        
+        uncacheable = ('no-cache' in cache_control or 'no-store' in cache_control or
+                       'private' in cache_control or cache_control.get('max-age') == '0')
+        
+        error = 'Response is cacheable (Cache-Control: %s)' % response.headers.get('Cache-Control', '')
+        self.assertTrue(uncacheable, error)
+    
+    def assertHasETag(self, response):
+        """
+        Asserts that ``response`` has an ``ETag`` header.
+        """
+        self.assertTrue(response.headers.get('ETag'), 'Response has no ETag header')
+    
+    def assertHasLastModified(self, response):
+        """
+        Asserts that ``response`` has a valid ``Last-Modified`` header.
+        """
+        last_modified = response.headers.get('Last-Modified')
+        
+        self.assertTrue(last_modified, 'Response has no Last-Modified header')
+        
+        error = 'Response has an invalid Last-Modified header: %s' % last_modified
+        self.assertTrue(email.utils.parsedate_tz(last_modified) is not None, error)
+    
+    def revalidate(self, response):
+        """
+        Replays the ``GET`` that produced ``response`` as a conditional
+        request (using its ``ETag`` and ``Last-Modified`` headers), asserts
+        that the application answered ``304 Not Modified`` without any
+        Data Store calls, and returns the new response::
+            
+            class MyTestCase(WebTestCase, unittest.TestCase):
+                APPLICATION = application
+                
+                def test_article_revalidates_cheaply(self):
+                    response = self.get('/articles/1/')
+                    self.revalidate(response)
+        
+        Only responses to ``GET`` requests can be revalidated; anything else
+        raises a ``ValueError``.
+        """
+        method = response.request.method
+        if method != 'GET':
+            raise ValueError('Only responses to GET requests can be revalidated (got %s)' % method)
+        
+        headers = {}
+        if response.headers.get('ETag'):
+            headers['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = response.headers['Last-Modified']
+        
+        error = 'Response has no ETag or Last-Modified header to revalidate with'
+        self.assertTrue(headers, error)
+        
+        first_record = len(self.get_rpcs())
+        revalidated = self.get(response.request.path_qs, headers=headers)
+        datastore_calls = [r for r in self.get_rpcs()[first_record:] if r.service == 'datastore_v3']
+        
+        error = 'Conditional request was not answered with a 304 (status code was %i)' % revalidated.status_int
+        self.assertEqual(revalidated.status_int, 304, error)
+        
+        error = 'Conditional request made %d Data Store call(s): %s' % (
+            len(datastore_calls), ', '.join([r.method for r in datastore_calls])
+        )
+        self.assertEqual(len(datastore_calls), 0, error)
+        
+        return revalidated
+    
+    def _get_cache_control(self, response):
+        directives = {}
+        for directive in (response.headers.get('Cache-Control') or '').split(','):
+            directive = directive.strip().lower()
+            if not directive:
+                continue
+            if '=' in directive:
+                name, value = directive.split('=', 1)
+                directives[name.strip()] = value.strip().strip('"')
+            else:
+                directives[directive] = None
+        return directives
+    
+    def _get_cache_lifetime(self, response, public=True):
+        cache_control = self._get_cache_control(response)
+        
+        names = ['max-age']
+        if public:
+            names.insert(0, 's-maxage')
+        
+        for name in names:
+            if cache_control.get(name) is not None:
+                try:
+                    return int(cache_control[name])
+                except ValueError:
+                    return None
+        
+        expires = email.utils.parsedate_tz(response.headers.get('Expires') or '')
+        if expires is None:
+            return None
+        return email.utils.mktime_tz(expires) - int(time.time())
+    
     def assertNotFound(self, response):
         error = 'Response was found (status code was %i)' % response.status_int
         return self.assertEqual(response.status_int, 404, error)
@@ -109,23 +629,23 @@ class WebTestCase(BaseTestCase):
     def get(self, *args, **kwargs):
         if 'status' not in kwargs:
             kwargs['status'] = '*'
-        return self.app.get(*args, **kwargs)
+        return self._instrument_response(self.app.get(*args, **kwargs))
     
     def post(self, url, data, *args, **kwargs):
         data = self.url_encode(data)
         if 'status' not in kwargs:
             kwargs['status'] = '*'
-        return self.app.post(url, data, *args, **kwargs)
+        return self._instrument_response(self.app.post(url, data, *args, **kwargs))
     
     def delete(self, *args, **kwargs):
         if 'status' not in kwargs:
             kwargs['status'] = '*'
-        return self.app.delete(*args, **kwargs)
+        return self._instrument_response(self.app.delete(*args, **kwargs))
     
     def put(self, *args, **kwargs):
         if 'status' not in kwargs:
             kwargs['status'] = '*'
-        return self.app.put(*args, **kwargs)
+        return self._instrument_response(self.app.put(*args, **kwargs))
     
     def url_encode(self, data):
         if isinstance(data, dict):
@@ -67,6 +67,12 @@ setup(
     license='GPL v2',
     packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
     include_package_data=True,
-    zip_safe=True,
+    zip_safe=False,
     install_requires=[],
+    entry_points={
+        'nose.plugins.0.10': [
+            'gaetestbed-parallel = gaetestbed.parallel:ParallelPlugin',
+            'gaetestbed-impact = gaetestbed.impact:ImpactPlugin',
+        ],
+    },
 )
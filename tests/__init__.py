@@ -0,0 +1,22 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+"""
+GAE Testbed's own tests, run against the SDK's stubs::
+    
+    $ GAE_SDK=/path/to/google_appengine nosetests tests
+"""
+
+import os
+
+import gaetestbed
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# queue.yaml in this directory declares the queues the tests use
+gaetestbed.bootstrap(root_path=ROOT_PATH)
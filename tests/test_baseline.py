@@ -0,0 +1,134 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from google.appengine.api import memcache
+
+from gaetestbed import BaseTestCase, UnitTestCase
+from gaetestbed.baseline import PerformanceBaseline
+
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.baseline = PerformanceBaseline('/nonexistent/baseline.json')
+        self.baseline.update('test', {'wall_time': 2.0, 'rpc:datastore_v3.Put': 10, 'rpc:memcache.Get': 0})
+    
+    def compare(self, metrics, **kwargs):
+        return [name for name, old, new in self.baseline.compare('test', metrics, **kwargs)]
+    
+    def test_relative_tolerance(self):
+        self.assertEqual(self.compare({'rpc:datastore_v3.Put': 11}), [])
+        self.assertEqual(self.compare({'rpc:datastore_v3.Put': 12}), ['rpc:datastore_v3.Put'])
+    
+    def test_slack(self):
+        # 10ms is five times the baseline, but well within the slack
+        self.assertEqual(self.compare({'wall_time': 10.0}), ['wall_time'])
+        self.assertEqual(self.compare({'wall_time': 10.0}, slack={'wall_time': 50.0}), [])
+        self.assertEqual(self.compare({'wall_time': 60.0}, slack={'wall_time': 50.0}), ['wall_time'])
+    
+    def test_tolerance_beats_slack_for_large_baselines(self):
+        metrics = {'rpc:datastore_v3.Put': 15}
+        tolerances = {'rpc:datastore_v3.Put': 0.5}
+        self.assertEqual(self.compare(metrics, tolerances=tolerances, slack={'rpc:datastore_v3.Put': 1}), [])
+    
+    def test_zero_baseline(self):
+        self.assertEqual(self.compare({'rpc:memcache.Get': 0}), [])
+        self.assertEqual(self.compare({'rpc:memcache.Get': 1}, tolerance=10.0), ['rpc:memcache.Get'])
+        self.assertEqual(self.compare({'rpc:memcache.Get': 1}, slack={'rpc:memcache.Get': 1}), [])
+    
+    def test_missing_from_baseline(self):
+        self.assertEqual(self.compare({'rpc:memcache.Set': 1}), ['rpc:memcache.Set'])
+        self.assertEqual(self.compare({'rpc:memcache.Set': 1}, slack={'rpc:memcache.Set': 2}), [])
+    
+    def test_test_not_in_baseline(self):
+        self.assertEqual(self.baseline.compare('other', {'wall_time': 1000.0}), [])
+
+class AssertPerformanceBaselineTest(UnitTestCase, unittest.TestCase):
+    def setUp(self):
+        super(AssertPerformanceBaselineTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'baseline.json')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(AssertPerformanceBaselineTest, self).tearDown()
+    
+    def test_fast_test_within_slack(self):
+        baseline = PerformanceBaseline(self.path)
+        baseline.update(self.id(), {'wall_time': 0.0})
+        baseline.save()
+        
+        time.sleep(0.01)
+        self.assertPerformanceBaseline(self.path)
+
+class BaselineCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'baseline.json')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def run_case(self, method_name):
+        path = self.path
+        
+        class Case(BaseTestCase, unittest.TestCase):
+            PERFORMANCE_BASELINE = path
+            
+            def test_regressed(self):
+                memcache.set('key', 'value')
+            
+            def test_unchanged(self):
+                pass
+            
+            def test_fails(self):
+                memcache.set('key', 'value')
+                self.fail('Failed first')
+            
+            def test_error(self):
+                memcache.set('key', 'value')
+                raise ValueError('Error first')
+        
+        case = Case(method_name)
+        
+        # The baseline was recorded when the test made no API calls
+        baseline = PerformanceBaseline(path)
+        baseline.update(case.id(), {'wall_time': 1000.0})
+        baseline.save()
+        
+        result = unittest.TestResult()
+        case.run(result)
+        
+        self.assertFalse(method_name in case.__dict__)
+        return result
+    
+    def test_regression_is_a_failure(self):
+        result = self.run_case('test_regressed')
+        self.assertEqual(result.errors, [])
+        self.assertEqual(len(result.failures), 1)
+        self.assertTrue('Performance regressed' in result.failures[0][1])
+    
+    def test_no_regression(self):
+        self.assertTrue(self.run_case('test_unchanged').wasSuccessful())
+    
+    def test_not_checked_after_a_failure(self):
+        result = self.run_case('test_fails')
+        self.assertEqual(result.errors, [])
+        self.assertEqual(len(result.failures), 1)
+        self.assertTrue('Failed first' in result.failures[0][1])
+        self.assertFalse('Performance regressed' in result.failures[0][1])
+    
+    def test_not_checked_after_an_error(self):
+        result = self.run_case('test_error')
+        self.assertEqual(result.failures, [])
+        self.assertEqual(len(result.errors), 1)
+        self.assertTrue('Error first' in result.errors[0][1])
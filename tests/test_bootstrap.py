@@ -0,0 +1,160 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from gaetestbed import DataStoreTestCase, MemcacheTestCase, TaskQueueTestCase, UnitTestCase, WebTestCase
+from gaetestbed.bootstrap import find_sdk, required_stubs
+
+# ``gaetestbed.bootstrap`` is also the name of the function
+bootstrap_module = sys.modules['gaetestbed.bootstrap']
+
+ENVIRON_KEYS = ('HOME', 'PATH', 'GAE_SDK', 'APPENGINE_SDK')
+
+class FindSDKTest(unittest.TestCase):
+    def setUp(self):
+        self.environ = dict([(key, os.environ.get(key)) for key in ENVIRON_KEYS])
+        self.sdk_path = bootstrap_module._sdk_path
+        bootstrap_module._sdk_path = None
+        
+        self.root = tempfile.mkdtemp()
+        self.home = self.make_dir('home')
+        os.environ['HOME'] = self.home
+        os.environ['PATH'] = ''
+        os.environ.pop('GAE_SDK', None)
+        os.environ.pop('APPENGINE_SDK', None)
+    
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        bootstrap_module._sdk_path = self.sdk_path
+        for key, value in self.environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    
+    def make_dir(self, *parts):
+        path = os.path.join(self.root, *parts)
+        os.makedirs(path)
+        return path
+    
+    def make_sdk(self, *parts):
+        path = os.path.join(self.root, *parts)
+        self.make_dir(path, 'google', 'appengine', 'api')
+        open(os.path.join(path, 'google', 'appengine', 'api', 'apiproxy_stub_map.py'), 'w').close()
+        open(os.path.join(path, 'dev_appserver.py'), 'w').close()
+        return path
+    
+    def put_on_path(self, sdk):
+        bin_dir = self.make_dir('bin')
+        os.symlink(os.path.join(sdk, 'dev_appserver.py'), os.path.join(bin_dir, 'dev_appserver.py'))
+        os.environ['PATH'] = bin_dir
+    
+    def find(self):
+        # As in a new process, apart from the cache file
+        bootstrap_module._sdk_path = None
+        return find_sdk()
+    
+    def read_cache(self):
+        return open(os.path.join(self.home, '.gaetestbed-sdk')).read()
+    
+    def test_sdk_path_given(self):
+        sdk = self.make_sdk('given')
+        os.environ['GAE_SDK'] = self.make_sdk('environ')
+        self.assertEqual(find_sdk(sdk), sdk)
+        self.assertEqual(find_sdk(self.root), None)
+    
+    def test_order(self):
+        home_sdk = self.make_sdk('home', 'google_appengine')
+        self.assertEqual(self.find(), home_sdk)
+        os.remove(os.path.join(self.home, '.gaetestbed-sdk'))
+        
+        path_sdk = self.make_sdk('path')
+        self.put_on_path(path_sdk)
+        self.assertEqual(self.find(), path_sdk)
+        
+        os.environ['APPENGINE_SDK'] = appengine_sdk = self.make_sdk('appengine')
+        self.assertEqual(self.find(), appengine_sdk)
+        
+        os.environ['GAE_SDK'] = gae_sdk = self.make_sdk('gae')
+        self.assertEqual(self.find(), gae_sdk)
+    
+    def test_not_an_sdk_is_skipped(self):
+        os.environ['GAE_SDK'] = self.make_dir('empty')
+        os.environ['APPENGINE_SDK'] = sdk = self.make_sdk('appengine')
+        self.assertEqual(self.find(), sdk)
+    
+    def test_not_found(self):
+        self.assertEqual(self.find(), None)
+        self.assertFalse(os.path.exists(os.path.join(self.home, '.gaetestbed-sdk')))
+    
+    def test_remembered_in_process(self):
+        os.environ['GAE_SDK'] = sdk = self.make_sdk('gae')
+        self.assertEqual(find_sdk(), sdk)
+        
+        os.environ['GAE_SDK'] = self.make_sdk('other')
+        self.assertEqual(find_sdk(), sdk)
+    
+    def test_cache(self):
+        sdk = self.make_sdk('path')
+        self.put_on_path(sdk)
+        self.assertEqual(self.find(), sdk)
+        self.assertEqual(self.read_cache(), sdk)
+        
+        # The next run goes straight to the cached SDK, even though another
+        # one is now found first
+        self.make_sdk('home', 'google_appengine')
+        os.environ['PATH'] = ''
+        self.assertEqual(self.find(), sdk)
+    
+    def test_environment_beats_cache(self):
+        cached = self.make_sdk('cached')
+        os.environ['GAE_SDK'] = cached
+        self.assertEqual(self.find(), cached)
+        
+        os.environ['GAE_SDK'] = sdk = self.make_sdk('gae')
+        self.assertEqual(self.find(), sdk)
+        self.assertEqual(self.read_cache(), sdk)
+    
+    def test_stale_cache(self):
+        cached = self.make_sdk('cached')
+        os.environ['GAE_SDK'] = cached
+        self.find()
+        del os.environ['GAE_SDK']
+        shutil.rmtree(cached)
+        
+        sdk = self.make_sdk('home', 'google_appengine')
+        self.assertEqual(self.find(), sdk)
+        self.assertEqual(self.read_cache(), sdk)
+
+class RequiredStubsTest(unittest.TestCase):
+    def test_single_test_case(self):
+        self.assertEqual(required_stubs(DataStoreTestCase), ['datastore_v3'])
+    
+    def test_merged_across_mro(self):
+        class MyTestCase(DataStoreTestCase, MemcacheTestCase, unittest.TestCase):
+            REQUIRED_STUBS = ('mail', 'memcache')
+        
+        self.assertEqual(required_stubs(MyTestCase), ['mail', 'memcache', 'datastore_v3'])
+        self.assertEqual(required_stubs(MyTestCase('run')), ['mail', 'memcache', 'datastore_v3'])
+    
+    def test_unit_test_case(self):
+        self.assertEqual(sorted(required_stubs(UnitTestCase)), ['datastore_v3', 'mail', 'memcache', 'taskqueue'])
+    
+    def test_web_test_case(self):
+        class MyTestCase(TaskQueueTestCase, WebTestCase):
+            pass
+        
+        self.assertEqual(required_stubs(MyTestCase), ['taskqueue', 'user', 'urlfetch'])
+    
+    def test_none(self):
+        self.assertEqual(required_stubs(unittest.TestCase), [])
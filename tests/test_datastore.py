@@ -0,0 +1,53 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import unittest
+
+from google.appengine.ext import db
+
+from gaetestbed import DataStoreTestCase
+
+class Item(db.Model):
+    name = db.StringProperty()
+
+class CountingQuery(object):
+    """
+    Stands in for a query, remembering the limits it was counted with.
+    """
+    def __init__(self, count):
+        self.count_value = count
+        self.limits = []
+    
+    def count(self, limit):
+        self.limits.append(limit)
+        return min(self.count_value, limit)
+
+class QueryCountTest(DataStoreTestCase, unittest.TestCase):
+    def test_at_least_nothing_makes_no_call(self):
+        query = CountingQuery(0)
+        self.assertQueryCountAtLeast(query, 0)
+        self.assertQueryCountAtLeast(query, -1)
+        self.assertEqual(query.limits, [])
+    
+    def test_at_least(self):
+        query = CountingQuery(3)
+        self.assertQueryCountAtLeast(query, 3)
+        self.assertRaises(AssertionError, self.assertQueryCountAtLeast, query, 4)
+        self.assertEqual(query.limits, [3, 4])
+    
+    def test_counts_are_bounded_and_not_counted_as_queries(self):
+        db.put([Item(name=str(n)) for n in range(5)])
+        
+        self.assertQueryCount(Item.all(keys_only=True), 5)
+        self.assertQueryCountAtMost(Item.all(), 5)
+        self.assertRaises(AssertionError, self.assertQueryCountAtMost, Item.all(), 4)
+        self.assertQueryCountAtLeast(Item.all(), 2)
+        self.assertEntityCount(Item, 5)
+        
+        self.assertEqual(self.query_count, 0)
+        self.assertEqual(self.get_rpcs('datastore_v3', 'RunQuery'), [])
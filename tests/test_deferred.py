@@ -0,0 +1,88 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import sys
+import unittest
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db, deferred
+
+from gaetestbed import DataStoreTestCase, TaskQueueTestCase
+
+class Counter(db.Model):
+    count = db.IntegerProperty(default=0)
+
+def increment(key_name, payload=''):
+    counter = Counter.get_or_insert(key_name)
+    counter.count += 1
+    counter.put()
+
+def fail_permanently():
+    raise deferred.PermanentTaskFailure('Nothing to do')
+
+# Bigger than a task can carry, so the deferred library stores it
+LARGE_PAYLOAD = 'x' * 200000
+
+class DeferredTest(DataStoreTestCase, TaskQueueTestCase, unittest.TestCase):
+    def test_run(self):
+        deferred.defer(increment, 'a')
+        
+        call, = self.get_deferred_tasks()
+        self.assertEqual(call.name, '%s.increment' % __name__)
+        self.assertEqual(call.args, ('a',))
+        self.assertFalse(call.stored_in_datastore)
+        
+        calls = self.run_deferred_tasks()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(Counter.get_by_key_name('a').count, 1)
+        self.assertEqual(self.get_deferred_tasks(), [])
+        self.assertMaxDeferredRPCs(5)
+    
+    def test_permanent_failure(self):
+        deferred.defer(fail_permanently)
+        call, = self.run_deferred_tasks()
+        self.assertTrue(isinstance(call.error, deferred.PermanentTaskFailure))
+    
+    def test_unreadable_payload(self):
+        taskqueue.add(url=self.DEFERRED_URL, payload='not a pickle')
+        call, = self.get_deferred_tasks()
+        self.assertEqual(call.func, None)
+        self.assertEqual(call.name, '(unreadable payload)')
+        
+        call, = self.run_deferred_tasks()
+        self.assertTrue(isinstance(call.error, deferred.PermanentTaskFailure))
+    
+    def test_stored_in_datastore(self):
+        deferred.defer(increment, 'b', LARGE_PAYLOAD)
+        
+        call, = self.get_deferred_tasks()
+        self.assertTrue(call.stored_in_datastore)
+        self.assertTrue(call.pickled_size > len(LARGE_PAYLOAD))
+        self.assertRaises(AssertionError, self.assertMaxDeferredPayload, 100000)
+        
+        self.run_deferred_tasks()
+        self.assertEqual(Counter.get_by_key_name('b').count, 1)
+        
+        # The stored payload is gone once it has run, but the report
+        # still knows about it
+        self.assertTrue('%s.increment' % __name__ in self.get_deferred_report())
+    
+    def test_missing_stored_payload(self):
+        deferred.defer(increment, 'c', LARGE_PAYLOAD)
+        db.delete(deferred.deferred._DeferredTaskEntity.all(keys_only=True).fetch(10))
+        
+        # Nothing is looked up until the call is inspected
+        call, = self.get_deferred_tasks()
+        try:
+            call.name
+        except AssertionError:
+            self.assertTrue('_DeferredTaskEntity' in str(sys.exc_info()[1]))
+        else:
+            self.fail('Missing stored payload was not reported')
+        
+        self.assertRaises(AssertionError, self.run_deferred_tasks)
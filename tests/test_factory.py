@@ -0,0 +1,52 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import unittest
+
+from google.appengine.ext import db
+
+from gaetestbed import DataStoreTestCase
+from gaetestbed import factory
+
+class Post(db.Model):
+    title = db.StringProperty()
+    status = db.StringProperty(choices=['draft', 'published'])
+    priority = db.IntegerProperty(choices=[1, 2, 3])
+    section = db.StringProperty(default='news')
+    views = db.IntegerProperty(default=0)
+    tags = db.StringListProperty()
+
+class EntityFactoryTest(DataStoreTestCase, unittest.TestCase):
+    def test_choices(self):
+        posts = factory.EntityFactory(Post)
+        self.assertEqual(posts.create(50), 50)
+        
+        for post in Post.all():
+            self.assertTrue(post.status in ('draft', 'published'))
+            self.assertTrue(post.priority in (1, 2, 3))
+    
+    def test_defaults_are_kept(self):
+        posts = factory.EntityFactory(Post)
+        for post in posts.iter_batches(20).next():
+            self.assertEqual(post.section, 'news')
+            self.assertEqual(post.views, 0)
+    
+    def test_fields_override_defaults(self):
+        posts = factory.EntityFactory(Post, {'views': lambda rng, index: index * 10})
+        batch = posts.iter_batches(3).next()
+        self.assertEqual([p.views for p in batch], [0, 10, 20])
+    
+    def test_list_properties_are_generated(self):
+        posts = factory.EntityFactory(Post, seed=1)
+        values = list(posts.iter_values(20))
+        self.assertTrue([v for v in values if v['tags']])
+    
+    def test_create_is_not_recorded(self):
+        factory.EntityFactory(Post).create(10)
+        self.assertEqual(self.get_rpcs(), [])
+        self.assertEqual(Post.all().count(), 10)
@@ -0,0 +1,163 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+import subprocess
+import sys
+import unittest
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from gaetestbed import fixtures
+from gaetestbed.fixtures import FixtureTimer, timed_fixture
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+    
+    def time(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.now += seconds
+
+class Base(object):
+    @timed_fixture('Base.setUp')
+    def setUp(self):
+        fixtures.time.sleep(1.0)
+    
+    @timed_fixture('Base.tearDown')
+    def tearDown(self):
+        fixtures.time.sleep(0.5)
+
+class Mixin(Base):
+    @timed_fixture('Mixin.setUp')
+    def setUp(self):
+        fixtures.time.sleep(2.0)
+        super(Mixin, self).setUp()
+        fixtures.time.sleep(3.0)
+    
+    @timed_fixture('Mixin.tearDown')
+    def tearDown(self):
+        super(Mixin, self).tearDown()
+        fixtures.time.sleep(0.25)
+
+class Case(Mixin):
+    def setUp(self):
+        super(Case, self).setUp()
+        # Counted as part of the test body
+        fixtures.time.sleep(4.0)
+    
+    def run_once(self, seconds):
+        self.setUp()
+        fixtures.time.sleep(seconds)
+        self.tearDown()
+
+class FixtureTimerTest(unittest.TestCase):
+    def setUp(self):
+        self.time = fixtures.time
+        self.timer = fixtures._timer
+        fixtures.time = FakeTime()
+        fixtures._timer = FixtureTimer()
+    
+    def tearDown(self):
+        fixtures.time = self.time
+        fixtures._timer = self.timer
+    
+    def test_exclusive_times(self):
+        Case().run_once(10.0)
+        Case().run_once(20.0)
+        
+        timer = fixtures.get_fixture_timer()
+        self.assertEqual(timer.tests, 2)
+        self.assertEqual(timer.fixtures, {
+            'Base.setUp': [2, 2.0],
+            'Mixin.setUp': [2, 10.0],
+            'Base.tearDown': [2, 1.0],
+            'Mixin.tearDown': [2, 0.5],
+        })
+        self.assertEqual(timer.harness_time, 13.5)
+        self.assertEqual(timer.body_time, 38.0)
+        self.assertEqual([f[0] for f in timer.slowest(2)], ['Mixin.setUp', 'Base.setUp'])
+    
+    def test_failed_fixture(self):
+        class Broken(Base):
+            @timed_fixture('Broken.setUp')
+            def setUp(self):
+                super(Broken, self).setUp()
+                raise ValueError
+        
+        self.assertRaises(ValueError, Broken().setUp)
+        
+        timer = fixtures.get_fixture_timer()
+        self.assertEqual(timer.tests, 0)
+        self.assertEqual(timer.fixtures, {'Base.setUp': [1, 1.0], 'Broken.setUp': [1, 0.0]})
+        
+        # The next fixture isn't nested inside the one that failed
+        Case().run_once(1.0)
+        self.assertEqual(timer.tests, 1)
+        self.assertEqual(timer.fixtures['Mixin.setUp'], [1, 5.0])
+    
+    def test_format(self):
+        Case().run_once(4.5)
+        
+        self.assertEqual(fixtures.get_fixture_timer().format(limit=2).splitlines(), [
+            '1 tests: 6750.0ms in fixtures (44%), 8500.0ms in test bodies',
+            '      5000.0ms      1 calls  5000.00ms/call  Mixin.setUp',
+            '      1000.0ms      1 calls  1000.00ms/call  Base.setUp',
+        ])
+
+class ReportTest(unittest.TestCase):
+    def setUp(self):
+        self.stderr = sys.stderr
+        self.environ = os.environ.get(fixtures.REPORT_ENVIRON_KEY)
+        self.timer = fixtures._timer
+        sys.stderr = StringIO()
+        fixtures._timer = FixtureTimer()
+        fixtures._timer.fixtures = {'Base.setUp': [1, 0.5]}
+    
+    def tearDown(self):
+        sys.stderr = self.stderr
+        fixtures._timer = self.timer
+        if self.environ is None:
+            os.environ.pop(fixtures.REPORT_ENVIRON_KEY, None)
+        else:
+            os.environ[fixtures.REPORT_ENVIRON_KEY] = self.environ
+    
+    def test_off_by_default(self):
+        os.environ.pop(fixtures.REPORT_ENVIRON_KEY, None)
+        fixtures._print_report()
+        self.assertEqual(sys.stderr.getvalue(), '')
+        
+        os.environ[fixtures.REPORT_ENVIRON_KEY] = '0'
+        fixtures._print_report()
+        self.assertEqual(sys.stderr.getvalue(), '')
+    
+    def test_report(self):
+        os.environ[fixtures.REPORT_ENVIRON_KEY] = '1'
+        fixtures._print_report()
+        self.assertEqual(sys.stderr.getvalue(), '\n%s\n' % fixtures._timer.format())
+    
+    def test_printed_at_exit(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        environ = dict(os.environ)
+        environ[fixtures.REPORT_ENVIRON_KEY] = '1'
+        
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'nose', 'tests/test_memcache.py'],
+            cwd=root, env=environ, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        output = process.communicate()[1]
+        
+        self.assertEqual(process.returncode, 0)
+        self.assertTrue(' tests: ' in output)
+        self.assertTrue('MemcacheTestCase.setUp' in output)
+        self.assertTrue('BaseTestCase.tearDown' in output)
@@ -0,0 +1,71 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+from gaetestbed import DataStoreTestCase, MemcacheTestCase
+from gaetestbed.impact import CoverageMap, get_coverage_recorder, memcache_prefix
+
+class Author(db.Model):
+    name = db.StringProperty()
+
+class Book(db.Model):
+    title = db.StringProperty()
+
+class Review(db.Model):
+    text = db.StringProperty()
+
+class CoverageRecorderTest(DataStoreTestCase, MemcacheTestCase, unittest.TestCase):
+    def setUp(self):
+        super(CoverageRecorderTest, self).setUp()
+        self.recorder = get_coverage_recorder()
+        self.recorder.start_test()
+    
+    def tearDown(self):
+        self.recorder.stop_test()
+        super(CoverageRecorderTest, self).tearDown()
+    
+    def test_recorded_calls(self):
+        Author(name='a').put()
+        memcache.get('user:1')
+        
+        touched = self.recorder.stop_test()
+        self.assertEqual(touched['kinds'], ['Author'])
+        self.assertEqual(touched['memcache'], ['user'])
+    
+    def test_paused_calls(self):
+        # Neither is one of the test's API calls, but the test depends on both kinds
+        self.create_entities(Book, 3)
+        self.assertQueryCountAtLeast(Review.all(), 0)
+        self.assertQueryCountAtMost(Review.all(), 0)
+        
+        self.assertEqual(self.get_rpcs(), [])
+        self.assertEqual(self.recorder.stop_test()['kinds'], ['Book', 'Review'])
+
+class CoverageMapTest(unittest.TestCase):
+    def setUp(self):
+        self.coverage_map = CoverageMap('/nonexistent/coverage.json')
+        self.coverage_map.update('tests.a.Test.test_books', {'kinds': ['Book'], 'memcache': [], 'queues': [], 'routes': []})
+        self.coverage_map.update('tests.a.Test.test_mail', {'kinds': [], 'memcache': [], 'queues': ['mail'], 'routes': []})
+    
+    def test_named_changes(self):
+        changes = self.coverage_map.get_changes(['kinds:Book'])
+        self.assertTrue(self.coverage_map.is_affected('tests.a.Test.test_books', changes))
+        self.assertFalse(self.coverage_map.is_affected('tests.a.Test.test_mail', changes))
+        self.assertTrue(self.coverage_map.is_affected('tests.a.Test.test_new', changes))
+    
+    def test_untraceable_change(self):
+        self.assertEqual(self.coverage_map.get_changes(['templates/index.html']), None)
+        self.assertTrue(self.coverage_map.is_affected('tests.a.Test.test_mail', None))
+    
+    def test_memcache_prefix(self):
+        self.assertEqual(memcache_prefix('user:123'), 'user')
+        self.assertEqual(memcache_prefix('session42'), 'session')
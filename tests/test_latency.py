@@ -0,0 +1,115 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import unittest
+
+from google.appengine.ext import db
+
+from gaetestbed import DataStoreTestCase
+from gaetestbed.latency import Cost, LatencyModel
+from gaetestbed.rpc import RPCRecord
+from gaetestbed.waterfall import Waterfall
+
+def rpc(service, method, start, end):
+    record = RPCRecord(service, method, None, None, start)
+    record.end = end
+    return record
+
+class LatencyModelTest(unittest.TestCase):
+    def setUp(self):
+        self.model = LatencyModel({'svc.A': Cost(10), 'svc.B': Cost(20, 50)})
+    
+    def test_cost(self):
+        self.assertEqual(self.model.cost(rpc('svc', 'A', 0, 0)), 10)
+        self.assertEqual(self.model.cost(rpc('svc', 'A', 0, 0), 'p95'), 30)
+        self.assertEqual(self.model.cost(rpc('svc', 'B', 0, 0), 'p95'), 50)
+    
+    def test_cost_fallbacks(self):
+        model = LatencyModel({'svc': Cost(5)}, default=Cost(7))
+        self.assertEqual(model.cost(rpc('svc', 'X', 0, 0)), 5)
+        self.assertEqual(model.cost(rpc('other', 'Y', 0, 0)), 7)
+        self.assertEqual(model.cost(rpc('datastore_v3', 'Get', 0, 0)), 10)
+    
+    def test_per_kb(self):
+        self.assertEqual(Cost(10, per_kb=1.0).estimate(2048), 12.0)
+    
+    def test_serial(self):
+        # 1ms calls one after the other: each is stretched to its cost and
+        # pushes back everything after it
+        waterfall = Waterfall([rpc('svc', 'A', 0.000, 0.001), rpc('svc', 'B', 0.002, 0.003)], 0.0, 0.004)
+        projection = self.model.project(waterfall)
+        
+        self.assertAlmostEqual(projection.wall_time, 4.0)
+        self.assertAlmostEqual(projection.rpc_time, 30.0)
+        self.assertAlmostEqual(projection.projected_time, 4.0 + 9.0 + 19.0)
+        self.assertAlmostEqual(self.model.project(waterfall, 'p95').projected_time, 4.0 + 29.0 + 49.0)
+    
+    def test_overlapping(self):
+        # B starts before A finishes, so only the slower of the two counts
+        waterfall = Waterfall([rpc('svc', 'A', 0.000, 0.001), rpc('svc', 'B', 0.0005, 0.0015)], 0.0, 0.002)
+        projection = self.model.project(waterfall)
+        
+        self.assertAlmostEqual(projection.rpc_time, 30.0)
+        self.assertAlmostEqual(projection.projected_time, 2.0 + 19.0)
+    
+    def test_after_overlapping(self):
+        # C waits for both A and B, so it's pushed back by the slower one
+        waterfall = Waterfall([
+            rpc('svc', 'A', 0.000, 0.001),
+            rpc('svc', 'B', 0.000, 0.001),
+            rpc('svc', 'A', 0.002, 0.003),
+        ], 0.0, 0.003)
+        self.assertAlmostEqual(self.model.project(waterfall).projected_time, 3.0 + 19.0 + 9.0)
+    
+    def test_no_calls(self):
+        projection = self.model.project(Waterfall([], 0.0, 0.005))
+        self.assertAlmostEqual(projection.projected_time, 5.0)
+        self.assertEqual(projection.costs, [])
+    
+    def test_format(self):
+        waterfall = Waterfall([rpc('svc', 'A', 0.000, 0.001)], 0.0, 0.001)
+        self.assertEqual(self.model.project(waterfall).format().splitlines(), [
+            'Projected 10.0ms (1.0ms locally, 10.0ms of API calls)',
+            '      10.0ms  svc.A',
+        ])
+
+class Item(db.Model):
+    pass
+
+class ProjectedLatencyTest(DataStoreTestCase, unittest.TestCase):
+    LATENCY_MODEL = LatencyModel({'datastore_v3.Put': Cost(50), 'datastore_v3.Get': Cost(100)})
+    
+    def setUp(self):
+        super(ProjectedLatencyTest, self).setUp()
+        self.keys = db.put([Item() for n in range(3)])
+    
+    def test_serial_gets(self):
+        for key in self.keys:
+            db.get(key)
+        
+        projection = self.get_projected_latency()
+        self.assertEqual([cost for record, cost in projection.costs], [50, 100, 100, 100])
+        self.assertTrue(projection.projected_time >= 350)
+        
+        self.assertProjectedLatencyBelow(1000)
+        self.assertRaises(self.failureException, self.assertProjectedLatencyBelow, 350)
+    
+    def test_overlapping_gets(self):
+        rpcs = [db.get_async(key) for key in self.keys]
+        for async_rpc in rpcs:
+            async_rpc.get_result()
+        
+        self.assertProjectedLatencyBelow(300)
+    
+    def test_p95(self):
+        db.get(self.keys[0])
+        self.assertProjectedLatencyBelow(300)
+        self.assertRaises(self.failureException, self.assertProjectedLatencyBelow, 300, quantile='p95')
+    
+    def test_response_needs_web_test_case(self):
+        self.assertRaises(TypeError, self.get_projected_latency, object())
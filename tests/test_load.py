@@ -0,0 +1,109 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import time
+import unittest
+
+from google.appengine.api import memcache
+
+from gaetestbed import WebTestCase
+from gaetestbed.load import LoadReport, run_load
+
+def application(environ, start_response):
+    path = environ['PATH_INFO']
+    if path == '/boom':
+        raise ValueError('boom')
+    if path == '/error':
+        start_response('500 Internal Server Error', [('Content-Type', 'text/plain')])
+        return ['Error']
+    
+    # /rpcs/N makes N memcache calls, slowly enough that requests from
+    # different threads interleave
+    for n in range(int(path.split('/')[-1])):
+        memcache.get('key-%d' % n)
+        time.sleep(0.001)
+    
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['OK']
+
+def make_report(latencies, duration, rpc_counts=None, errors=0):
+    report = LoadReport(1)
+    report.latencies = latencies
+    report.duration = duration
+    report.rpc_counts = rpc_counts or [0] * len(latencies)
+    report.errors = errors
+    return report
+
+class LoadReportTest(unittest.TestCase):
+    def test_throughput(self):
+        self.assertEqual(make_report([0.1] * 10, 2.0).throughput, 5.0)
+        self.assertEqual(make_report([], 0.0).throughput, 0.0)
+    
+    def test_percentiles(self):
+        report = make_report([n / 1000.0 for n in range(1, 101)], 1.0)
+        self.assertAlmostEqual(report.p50, 50.5)
+        self.assertAlmostEqual(report.p99, 99.01)
+        self.assertEqual(make_report([], 0.0).p95, None)
+    
+    def test_rpcs_per_request(self):
+        report = make_report([0.1] * 4, 1.0, [1, 1, 3, 3])
+        self.assertEqual(report.rpcs_per_request, 2.0)
+        self.assertEqual(report.max_rpcs_per_request, 3)
+        self.assertEqual(make_report([], 0.0).max_rpcs_per_request, 0)
+
+class RunLoadTest(unittest.TestCase):
+    def test_rpcs_counted_per_thread(self):
+        report = run_load(application, ['/rpcs/1', '/rpcs/3'], concurrency=4, requests=20)
+        
+        self.assertEqual(report.requests, 20)
+        self.assertEqual(report.errors, 0)
+        self.assertEqual(report.statuses, {200: 20})
+        self.assertEqual(sorted(report.rpc_counts), [1] * 10 + [3] * 10)
+        self.assertEqual(report.max_rpcs_per_request, 3)
+    
+    def test_script(self):
+        paths = []
+        def script(app):
+            paths.append(1)
+            return app.get('/rpcs/2')
+        
+        report = run_load(application, script, concurrency=2, requests=5)
+        self.assertEqual(len(paths), 5)
+        self.assertEqual(report.rpc_counts, [2] * 5)
+    
+    def test_errors(self):
+        report = run_load(application, ['/boom', '/error', '/rpcs/0'], concurrency=1, requests=3)
+        
+        self.assertEqual(report.errors, 2)
+        self.assertEqual(report.statuses, {None: 1, 500: 1, 200: 1})
+        self.assertEqual([str(e) for e in report.exceptions], ['boom'])
+
+class LoadAssertionTest(WebTestCase, unittest.TestCase):
+    APPLICATION = staticmethod(application)
+    
+    def test_load(self):
+        report = self.load('/rpcs/2', concurrency=2, requests=6)
+        self.assertEqual(report.requests, 6)
+        self.assertMaxRPCsPerRequest(report, 2)
+        self.assertRaises(self.failureException, self.assertMaxRPCsPerRequest, report, 1)
+    
+    def test_throughput(self):
+        report = make_report([0.1] * 10, 2.0)
+        self.assertThroughputAbove(report, 5)
+        self.assertRaises(self.failureException, self.assertThroughputAbove, report, 6)
+    
+    def test_throughput_with_errors(self):
+        report = make_report([0.1] * 10, 1.0, errors=1)
+        self.assertRaises(self.failureException, self.assertThroughputAbove, report, 1)
+    
+    def test_latency(self):
+        report = make_report([n / 1000.0 for n in range(1, 101)], 1.0)
+        self.assertLatencyBelow(report, 96)
+        self.assertRaises(self.failureException, self.assertLatencyBelow, report, 94)
+        self.assertLatencyBelow(report, 51, percentile=50)
+        self.assertRaises(self.failureException, self.assertLatencyBelow, report, 50, percentile=50)
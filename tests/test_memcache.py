@@ -0,0 +1,133 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import unittest
+
+from google.appengine.api import memcache
+
+from gaetestbed import DataStoreTestCase, MemcacheTestCase, UnitTestCase
+from gaetestbed.memcache import _key_tracker
+
+class MemcacheTestCaseTest(MemcacheTestCase, unittest.TestCase):
+    def test_starts_empty(self):
+        self.assertMemcacheItems(0)
+        self.assertMemcacheHits(0)
+    
+    def test_hits(self):
+        memcache.set('key', 'value')
+        self.assertEqual(memcache.get('key'), 'value')
+        memcache.get('missing')
+        self.assertMemcacheItems(1)
+        self.assertMemcacheHits(1)
+    
+    def test_setUp_is_not_recorded(self):
+        # The flush that empties the cache belongs to the sandbox, not the test
+        self.assertEqual(self.get_rpcs(), [])
+    
+    def test_assertions_are_not_recorded(self):
+        memcache.get('key')
+        self.assertMemcacheHits(0)
+        self.assertMemcacheItems(0)
+        self.clear_memcache()
+        
+        self.assertEqual([r.method for r in self.get_rpcs('memcache')], ['Get'])
+    
+    def test_metrics_only_count_the_test(self):
+        memcache.set('key', 'value')
+        memcache.get('key')
+        
+        metrics = self.get_performance_metrics()
+        self.assertEqual(metrics['memcache_hits'], 1)
+        self.assertEqual(metrics['rpc:memcache.Set'], 1)
+        self.assertEqual(metrics['rpc:memcache.Get'], 1)
+        self.assertFalse('rpc:memcache.FlushAll' in metrics)
+        self.assertFalse('rpc:memcache.Stats' in metrics)
+    
+    def test_stub_sizes(self):
+        memcache.set('key', 'value')
+        sizes = self.get_stub_sizes()
+        self.assertEqual(sizes['memcache_items'], 1)
+        self.assertEqual(self.get_rpcs('memcache', 'Stats'), [])
+
+class KeyStatsTest(MemcacheTestCase, unittest.TestCase):
+    MEMCACHE_MAX_OPS_PER_KEY = 3
+    
+    def test_key_stats(self):
+        memcache.set('a', 1)
+        memcache.get('a')
+        memcache.incr('a')
+        memcache.get_multi(['a', 'b'])
+        
+        stats = self.get_memcache_key_stats()
+        self.assertEqual(sorted(stats), ['a', 'b'])
+        self.assertEqual(stats['a']['ops'], 4)
+        self.assertEqual(stats['a']['counts'], {'set': 1, 'get': 2, 'incr': 1})
+        self.assertEqual(stats['b']['counts'], {'get': 1})
+    
+    def test_hot_keys(self):
+        # Four reads of 'hot' in each second, and one of 'cold'
+        for second in range(2):
+            memcache.get('cold')
+            for n in range(4):
+                memcache.get('hot')
+            self.clock.advance(1)
+        
+        self.assertEqual(self.get_hot_keys(), [('hot', 4)])
+        self.assertEqual(self.get_hot_keys(max_ops_per_second=10), [])
+        self.assertRaises(self.failureException, self.assertNoHotKeys)
+        self.assertRaises(self.failureException, self.assertMaxOpsPerKey, 3, key='hot')
+        self.assertMaxOpsPerKey(1, key='cold')
+        self.assertMaxOpsPerKey(4)
+    
+    def test_spread_out_keys_are_not_hot(self):
+        for n in range(10):
+            memcache.get('key')
+            self.clock.advance(0.5)
+        
+        self.assertEqual(self.get_memcache_key_stats()['key']['ops_per_second'], 2)
+        self.assertNoHotKeys()
+    
+    def test_cas_retries(self):
+        client = memcache.Client()
+        memcache.set('counter', 0)
+        
+        # Another request changes the value between each of the first two
+        # gets and cas calls, so the loop has to try three times
+        attempts = 0
+        while True:
+            value = client.gets('counter')
+            if attempts < 2:
+                memcache.set('counter', value + 10)
+            attempts += 1
+            if client.cas('counter', value + 1):
+                break
+        
+        self.assertEqual(memcache.get('counter'), 21)
+        stats = self.get_memcache_key_stats()['counter']
+        self.assertEqual(stats['counts']['cas'], 3)
+        self.assertEqual(stats['counts']['gets'], 3)
+        self.assertEqual(stats['cas_failures'], 2)
+        self.assertEqual(stats['max_cas_retries'], 2)
+        
+        self.assertMaxCASRetries(2)
+        self.assertMaxCASRetries(2, key='counter')
+        self.assertMaxCASRetries(0, key='other')
+        self.assertRaises(self.failureException, self.assertMaxCASRetries, 1)
+    
+    def test_stats_only_cover_the_test(self):
+        self.assertEqual(self.get_memcache_key_stats(), {})
+
+class UnitTestCaseTest(UnitTestCase, unittest.TestCase):
+    def test_setUp_is_not_recorded(self):
+        self.assertEqual(self.get_rpcs(), [])
+        self.assertEqual(self.get_waterfall().records, [])
+
+class NotMemcacheTest(DataStoreTestCase, unittest.TestCase):
+    def test_keys_not_tracked(self):
+        memcache.set('key', 'value')
+        self.assertEqual(_key_tracker.keys, {})
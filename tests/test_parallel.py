@@ -0,0 +1,102 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import os
+import sys
+import tempfile
+import unittest
+
+# shard_tests isn't imported by name, or nose would take it for a test
+from gaetestbed import parallel
+from gaetestbed.parallel import ParallelPlugin, _ParallelRunner, _worker_args, _write_json
+
+class ShardTest(unittest.TestCase):
+    def test_balanced_by_duration(self):
+        durations = {'a': 8.0, 'b': 4.0, 'c': 3.0, 'd': 1.0}
+        shards = parallel.shard_tests(['a', 'b', 'c', 'd'], durations, 2)
+        self.assertEqual(shards, [['a'], ['b', 'c', 'd']])
+    
+    def test_original_order_kept(self):
+        durations = {'a': 1.0, 'b': 2.0, 'c': 3.0, 'd': 4.0}
+        shards = parallel.shard_tests(['a', 'b', 'c', 'd'], durations, 2)
+        self.assertEqual(sorted(shards), [['a', 'd'], ['b', 'c']])
+    
+    def test_unknown_durations_are_average(self):
+        # 'new' is assumed to take 2s, so it goes with 'short'
+        durations = {'long': 3.0, 'short': 1.0}
+        shards = parallel.shard_tests(['long', 'short', 'new'], durations, 2)
+        self.assertEqual(sorted(shards), [['long'], ['short', 'new']])
+    
+    def test_no_durations(self):
+        shards = parallel.shard_tests(['a', 'b', 'c', 'd'], {}, 2)
+        self.assertEqual([len(shard) for shard in shards], [2, 2])
+    
+    def test_more_workers_than_tests(self):
+        self.assertEqual(parallel.shard_tests(['a', 'b'], {}, 8), [['a'], ['b']])
+        self.assertEqual(parallel.shard_tests([], {}, 8), [])
+
+class WorkerCommandTest(unittest.TestCase):
+    def test_parallel_options_removed(self):
+        argv = [
+            '--with-gae', '--with-gaetestbed-parallel', '--gaetestbed-workers', '3',
+            '--gaetestbed-durations=times.json', '-v', 'tests',
+        ]
+        self.assertEqual(_worker_args(argv, set(['tests'])), ['--with-gae', '-v'])
+    
+    def test_runs_nose_module(self):
+        plugin = ParallelPlugin()
+        plugin.worker_args = ['--with-gae']
+        command = _ParallelRunner(plugin, None)._command('/tmp/out.json', ['tests.test_a:ATest'])
+        self.assertEqual(command, [
+            sys.executable, '-m', 'nose', '--with-gae',
+            '--gaetestbed-worker-output=/tmp/out.json', 'tests.test_a:ATest',
+        ])
+
+class _Process(object):
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.runner = _ParallelRunner(ParallelPlugin(), None)
+        self.result = unittest.TestResult()
+        self.durations = {}
+    
+    def merge(self, tests, returncode=0):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        if tests is not None:
+            _write_json(output, tests)
+        self.runner._merge(self.result, self.durations, _Process(returncode), output)
+        self.assertFalse(os.path.exists(output))
+    
+    def test_outcomes(self):
+        self.merge([
+            {'id': 'a', 'outcome': 'success', 'duration': 0.5, 'traceback': None},
+            {'id': 'b', 'outcome': 'failure', 'duration': 1.0, 'traceback': 'AssertionError'},
+            {'id': 'c', 'outcome': 'error', 'duration': 1.5, 'traceback': 'KeyError'},
+            {'id': 'd', 'outcome': 'skip', 'duration': 0.0, 'traceback': 'SkipTest', 'reason': 'no SDK'},
+        ], returncode=1)
+        
+        self.assertEqual(self.result.testsRun, 4)
+        self.assertEqual([(str(t), tb) for t, tb in self.result.failures], [('b', 'AssertionError')])
+        self.assertEqual([(str(t), tb) for t, tb in self.result.errors], [('c', 'KeyError')])
+        self.assertEqual([(str(t), reason) for t, reason in self.result.skipped], [('d', 'no SDK')])
+        self.assertEqual(self.durations, {'a': 0.5, 'b': 1.0, 'c': 1.5, 'd': 0.0})
+    
+    def test_several_workers(self):
+        self.merge([{'id': 'a', 'outcome': 'success', 'duration': 0.5, 'traceback': None}])
+        self.merge([{'id': 'b', 'outcome': 'skip', 'duration': 0.0, 'traceback': None, 'reason': 'later'}])
+        self.assertEqual(self.result.testsRun, 2)
+        self.assertEqual(len(self.result.skipped), 1)
+        self.assertTrue(self.result.wasSuccessful())
+    
+    def test_worker_crashed(self):
+        self.merge(None, returncode=2)
+        self.assertEqual(self.result.testsRun, 0)
+        self.assertEqual([(str(t), tb) for t, tb in self.result.errors], [('worker', 'Worker exited with status 2')])
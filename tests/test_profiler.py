@@ -0,0 +1,125 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import random
+import threading
+import time
+import unittest
+
+from gaetestbed.profiler import ProfilingMiddleware, ResponsePayload, TimingMiddleware
+
+def _start_response(status, headers):
+    pass
+
+def _request(application, path='/'):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    application(environ, _start_response)
+    return environ[ProfilingMiddleware.ENVIRON_KEY]
+
+class CPUTimeTest(unittest.TestCase):
+    def test_one_request_at_a_time(self):
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return [str(sum(range(10000)))]
+        
+        profile = _request(ProfilingMiddleware(application))
+        self.assertTrue(profile.cpu_time >= 0.0)
+        self.assertTrue(profile.wall_time >= 0.0)
+    
+    def test_overlapping_requests(self):
+        started, finish = threading.Event(), threading.Event()
+        
+        def application(environ, start_response):
+            if environ['PATH_INFO'] == '/slow':
+                started.set()
+                finish.wait(5)
+            start_response('200 OK', [])
+            return ['']
+        
+        middleware = ProfilingMiddleware(application)
+        profiles = []
+        thread = threading.Thread(target=lambda: profiles.append(_request(middleware, '/slow')))
+        thread.start()
+        started.wait(5)
+        
+        profiles.append(_request(middleware, '/fast'))
+        finish.set()
+        thread.join()
+        
+        self.assertEqual([p.cpu_time for p in profiles], [None, None])
+        self.assertTrue(_request(middleware).cpu_time >= 0.0)
+    
+    def test_failed_request(self):
+        def application(environ, start_response):
+            raise ValueError('broken')
+        
+        self.assertRaises(ValueError, _request, ProfilingMiddleware(application))
+        
+        # The failed request doesn't leave its timer running
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return ['']
+        
+        self.assertTrue(_request(ProfilingMiddleware(application)).cpu_time >= 0.0)
+
+class ResponsePayloadTest(unittest.TestCase):
+    def test_size(self):
+        payload = ResponsePayload('GET', '/feed', 'x' * 1000, 'application/json')
+        self.assertEqual(payload.size, 1000)
+        self.assertTrue(payload.gzip_size < 100)
+        self.assertEqual(payload.compression_ratio, payload.gzip_size / 1000.0)
+    
+    def test_incompressible(self):
+        body = ''.join([chr(random.Random(n).randint(0, 255)) for n in range(1000)])
+        payload = ResponsePayload('GET', '/noise', body)
+        self.assertTrue(payload.compression_ratio > 1.0)
+    
+    def test_empty(self):
+        payload = ResponsePayload('GET', '/empty', '', status=304)
+        self.assertEqual(payload.size, 0)
+        self.assertEqual(payload.compression_ratio, None)
+        self.assertEqual(payload.status, 304)
+
+class TimingMiddlewareTest(unittest.TestCase):
+    def test_time_to_first_byte(self):
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            yield ''
+            time.sleep(0.05)
+            yield 'first'
+            yield 'second'
+        
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        body = TimingMiddleware(application)(environ, _start_response)
+        
+        timing = environ[TimingMiddleware.ENVIRON_KEY]
+        self.assertEqual(timing['first_byte'], None)
+        self.assertEqual(list(body), ['', 'first', 'second'])
+        self.assertTrue(timing['first_byte'] - timing['start'] >= 0.05)
+    
+    def test_empty_body(self):
+        def application(environ, start_response):
+            start_response('204 No Content', [])
+            return []
+        
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+        self.assertEqual(list(TimingMiddleware(application)(environ, _start_response)), [])
+        self.assertEqual(environ[TimingMiddleware.ENVIRON_KEY]['first_byte'], None)
+    
+    def test_closes_result(self):
+        closed = []
+        class Result(list):
+            def close(self):
+                closed.append(True)
+        
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return Result(['body'])
+        
+        self.assertEqual(list(TimingMiddleware(application)({}, _start_response)), ['body'])
+        self.assertEqual(closed, [True])
@@ -0,0 +1,58 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import time
+import unittest
+
+import webtest
+
+from gaetestbed import replay
+
+def application(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [environ.get('HTTP_COOKIE', '')]
+
+class MakeRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.app = webtest.TestApp(application)
+    
+    def get_cookie_header(self, cookies):
+        request = replay.ReplayRequest('GET', '/', cookies=cookies)
+        return replay._make_request(self.app, request).body
+    
+    def test_cookie_values_are_sent_unchanged(self):
+        self.assertEqual(self.get_cookie_header({'session': 'a%2Fb=="c"'}), 'session=a%2Fb=="c"')
+    
+    def test_har_cookies(self):
+        requests = replay.parse_har({'log': {'entries': [{
+            'startedDateTime': '2009-10-10T13:55:36.000Z',
+            'request': {
+                'method': 'GET',
+                'url': 'http://example.com/',
+                'cookies': [{'name': 'prefs', 'value': 'lang:en|tz:UTC+1'}],
+            },
+        }]}})
+        self.assertEqual(replay._make_request(self.app, requests[0]).body, 'prefs=lang:en|tz:UTC+1')
+
+class PacingTest(unittest.TestCase):
+    def replay_time(self, timestamps, speed):
+        requests = [replay.ReplayRequest('GET', '/', timestamp=t) for t in timestamps]
+        start = time.time()
+        replay.replay(application, requests, speed=speed)
+        return time.time() - start
+    
+    def test_paced(self):
+        self.assertTrue(self.replay_time([1000.0, 1000.2], speed=1) >= 0.2)
+        self.assertTrue(self.replay_time([1000.0, 1000.2], speed=4) < 0.15)
+    
+    def test_timestamp_zero(self):
+        # Relative timestamps can start at zero
+        self.assertTrue(self.replay_time([0.0, 0.2], speed=1) >= 0.2)
+    
+    def test_not_paced(self):
+        self.assertTrue(self.replay_time([0.0, 10.0], speed=None) < 1.0)
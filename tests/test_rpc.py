@@ -0,0 +1,88 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import threading
+import unittest
+
+from google.appengine.api import memcache
+
+from gaetestbed import MemcacheTestCase
+from gaetestbed.rpc import get_rpc_recorder
+
+class RPCRecorderTest(MemcacheTestCase, unittest.TestCase):
+    def test_pause(self):
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        try:
+            self.assertTrue(recorder.paused)
+            memcache.get('paused')
+        finally:
+            recorder.resume()
+        
+        self.assertFalse(recorder.paused)
+        memcache.get('recorded')
+        self.assertEqual([r.request.key_list() for r in self.get_rpcs('memcache', 'Get')], [['recorded']])
+    
+    def test_nested_pause(self):
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        recorder.pause()
+        recorder.resume()
+        try:
+            self.assertTrue(recorder.paused)
+        finally:
+            recorder.resume()
+        self.assertFalse(recorder.paused)
+    
+    def test_pause_only_affects_the_current_thread(self):
+        recorder = get_rpc_recorder()
+        paused_in_thread = []
+        
+        def worker():
+            paused_in_thread.append(recorder.paused)
+            memcache.get('from-thread')
+        
+        recorder.pause()
+        try:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+            memcache.get('paused')
+        finally:
+            recorder.resume()
+        
+        self.assertEqual(paused_in_thread, [False])
+        self.assertEqual([r.request.key_list() for r in self.get_rpcs('memcache', 'Get')], [['from-thread']])
+    
+    def test_paused_listeners(self):
+        recorder = get_rpc_recorder()
+        seen, seen_paused = [], []
+        
+        # Listeners can't be removed, so these only listen during the test
+        listening = [True]
+        def listener(calls):
+            def listen(record):
+                if listening and record.service == 'memcache' and record.method == 'Get':
+                    calls.append(record.request.key_list())
+            return listen
+        recorder.add_listener(listener(seen))
+        recorder.add_listener(listener(seen_paused), paused=True)
+        
+        try:
+            recorder.pause()
+            try:
+                memcache.get('paused')
+            finally:
+                recorder.resume()
+            memcache.get('recorded')
+        finally:
+            listening.pop()
+        
+        self.assertEqual(seen, [['recorded']])
+        self.assertEqual(seen_paused, [['paused'], ['recorded']])
+        self.assertEqual([r.request.key_list() for r in self.get_rpcs('memcache', 'Get')], [['recorded']])
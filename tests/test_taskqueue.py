@@ -0,0 +1,192 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import json
+import unittest
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+from gaetestbed import TaskQueueTestCase
+from gaetestbed.rpc import get_rpc_recorder
+
+class TaskQueueTestCaseTest(TaskQueueTestCase, unittest.TestCase):
+    def test_starts_empty(self):
+        self.assertTasksInQueue(0)
+        self.assertEqual(self.get_task_count(), 0)
+    
+    def test_add(self):
+        taskqueue.add(url='/worker/', params={'n': '1'})
+        self.assertTasksInQueue(1, url='/worker/')
+        self.assertEqual(self.get_task_count(), 1)
+    
+    def test_batched(self):
+        taskqueue.Queue('default').add([taskqueue.Task(url='/worker/') for n in range(10)])
+        self.assertTasksAddedInBatches()
+        self.assertEqual(self.get_task_add_calls(), [
+            {'method': 'BulkAdd', 'tasks': 10, 'queue_names': ['default']},
+        ])
+    
+    def test_not_batched(self):
+        for n in range(3):
+            taskqueue.add(url='/worker/')
+        self.assertRaises(AssertionError, self.assertTasksAddedInBatches)
+        self.assertTasksAddedInBatches(max_calls=3)
+    
+    def test_batched_by_queue(self):
+        taskqueue.Queue('default').add([taskqueue.Task(url='/worker/') for n in range(2)])
+        taskqueue.add(url='/mail/', queue_name='mail')
+        taskqueue.add(url='/mail/', queue_name='mail')
+        self.assertTasksAddedInBatches(queue_names=['default'])
+        self.assertRaises(AssertionError, self.assertTasksAddedInBatches, queue_names=['mail'])
+    
+    def test_cleared_1_add_while_paused(self):
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        try:
+            taskqueue.add(url='/mail/', queue_name='mail')
+        finally:
+            recorder.resume()
+        
+        self.assertEqual(self.get_task_add_calls(), [])
+        self.assertEqual(self.get_task_count(queue_names=['mail']), 1)
+    
+    def test_cleared_2_by_the_next_test(self):
+        self.assertTasksInQueue(0, queue_names=['mail'])
+        self.assertEqual(self.get_task_count(), 0)
+    
+    def test_cleared_3_transactional_add(self):
+        db.run_in_transaction(taskqueue.add, url='/mail/', queue_name='mail', transactional=True)
+        self.assertEqual(self.get_task_count(queue_names=['mail']), 1)
+    
+    def test_cleared_4_by_the_next_test(self):
+        self.assertTasksInQueue(0, queue_names=['mail'])
+    
+    def test_clearing_does_not_read_queues(self):
+        stub = self.get_task_queue_stub()
+        calls = []
+        def GetQueues():
+            calls.append(1)
+            return stub.__class__.GetQueues(stub)
+        
+        stub.GetQueues = GetQueues
+        try:
+            self.clear_task_queue()
+            self.assertEqual(self.get_task_count(), 0)
+            self.assertEqual(calls, [])
+            
+            taskqueue.add(url='/worker/')
+            self.clear_task_queue()
+            self.assertEqual(calls, [])
+            self.assertEqual(self.get_task_count(), 0)
+        finally:
+            del stub.GetQueues
+    
+    def test_partial_bulk_add(self):
+        taskqueue.add(url='/worker/', name='taken')
+        tasks = [taskqueue.Task(url='/worker/', name='taken'), taskqueue.Task(url='/worker/')]
+        self.assertRaises(taskqueue.Error, taskqueue.Queue('default').add, tasks)
+        self.assertEqual(self.get_task_count(), 2)
+        
+        self.clear_task_queue()
+        self.assertTasksInQueue(0)
+        self.assertEqual(self.get_task_count(), 0)
+    
+    def test_stub_sizes(self):
+        taskqueue.add(url='/worker/', name='recorded')
+        
+        recorder = get_rpc_recorder()
+        recorder.pause()
+        try:
+            taskqueue.add(url='/worker/')
+        finally:
+            recorder.resume()
+        self.assertEqual(self.get_stub_sizes()['queued_tasks'], 2)
+        
+        self.get_task_queue_stub().DeleteTask('default', 'recorded')
+        self.assertEqual(self.get_stub_sizes()['queued_tasks'], 1)
+
+class TaskParamsTest(TaskQueueTestCase, unittest.TestCase):
+    def test_params(self):
+        taskqueue.add(url='/worker/', params={'name': 'a b&c', 'ids': ['1', '2']})
+        params = self.get_tasks()[0]['params']
+        
+        self.assertTrue(isinstance(params, dict))
+        self.assertEqual(params, {'name': 'a b&c', 'ids': '2'})
+        self.assertEqual(dict(params), {'name': 'a b&c', 'ids': '2'})
+        self.assertEqual(json.loads(json.dumps(params)), {'name': 'a b&c', 'ids': '2'})
+        self.assertEqual(params.getall('ids'), ['1', '2'])
+        self.assertEqual(params.getall('missing'), [])
+    
+    def test_shared_between_calls(self):
+        taskqueue.add(url='/worker/', params={'n': '1'})
+        self.assertTrue(self.get_tasks()[0]['params'] is self.get_tasks()[0]['params'])
+
+class PullQueueTest(TaskQueueTestCase, unittest.TestCase):
+    def add(self, name, tag=None, countdown=None):
+        task = taskqueue.Task(payload=name, name=name, method='PULL', tag=tag, countdown=countdown)
+        taskqueue.Queue('pull-queue').add(task)
+    
+    def lease(self, *args, **kwargs):
+        return [t['name'] for t in self.lease_tasks('pull-queue', 60, 10, *args, **kwargs)]
+    
+    def test_lease_expires(self):
+        self.add('a')
+        self.assertEqual(self.lease(), ['a'])
+        self.assertEqual(self.lease(), [])
+        
+        self.clock.advance(61)
+        self.assertEqual(self.lease(), ['a'])
+        self.assertEqual(self.get_pull_queue_stats('pull-queue')['redelivered'], 1)
+        self.assertRaises(AssertionError, self.assertNoOutstandingLeases, 'pull-queue')
+    
+    def test_delete(self):
+        self.add('a')
+        self.add('b')
+        self.delete_tasks('pull-queue', self.lease_tasks('pull-queue', 60, 10))
+        
+        self.assertNoOutstandingLeases('pull-queue')
+        self.assertEqual(self.get_task_count(queue_names=['pull-queue']), 0)
+        self.clock.advance(61)
+        self.assertEqual(self.lease(), [])
+    
+    def test_eta(self):
+        self.add('later', countdown=300)
+        self.add('now')
+        self.assertEqual(self.lease(), ['now'])
+        self.delete_tasks('pull-queue', ['now'])
+        
+        self.clock.advance(301)
+        self.assertEqual(self.lease(), ['later'])
+    
+    def test_tag(self):
+        self.add('a', tag='user-1')
+        self.add('b', tag='user-2')
+        self.add('c', tag='user-1')
+        self.add('d')
+        self.assertEqual(sorted(self.lease(tag='user-1')), ['a', 'c'])
+    
+    def test_lease_by_tag(self):
+        self.add('a', tag='user-1')
+        self.add('b', tag='user-2')
+        self.add('c', tag='user-1')
+        
+        tasks = self.lease_tasks_by_tag('pull-queue', 60, 10)
+        self.assertEqual(len(tasks), 2)
+        self.assertEqual(set([t['tag'] for t in tasks]), set(['user-1']))
+        self.assertEqual([t['name'] for t in self.lease_tasks_by_tag('pull-queue', 60, 10)], ['b'])
+    
+    def test_lease_untagged_by_tag(self):
+        self.add('a')
+        self.add('b', tag='user-1')
+        self.assertEqual([t['name'] for t in self.lease_tasks_by_tag('pull-queue', 60, 10)], ['a'])
+    
+    def test_leasing_is_not_recorded(self):
+        self.add('a')
+        self.lease()
+        self.assertEqual([r.method for r in self.get_rpcs('taskqueue')], ['BulkAdd'])
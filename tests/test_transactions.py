@@ -0,0 +1,114 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import unittest
+
+from google.appengine.ext import db
+
+from gaetestbed import DataStoreTestCase
+
+class Counter(db.Model):
+    count = db.IntegerProperty(default=0)
+
+class Item(db.Model):
+    name = db.StringProperty()
+
+def increment(key_name):
+    def txn():
+        counter = Counter.get_by_key_name(key_name) or Counter(key_name=key_name)
+        counter.count += 1
+        counter.put()
+        return counter
+    return db.run_in_transaction(txn)
+
+class TransactionTest(DataStoreTestCase, unittest.TestCase):
+    def test_get_transactions(self):
+        increment('a')
+        increment('a')
+        
+        runs = self.get_transactions()
+        self.assertEqual(len(runs), 2)
+        for run in runs:
+            self.assertTrue(run.committed)
+            self.assertEqual(run.retries, 0)
+            self.assertEqual(run.writes, 1)
+            self.assertEqual(run.entity_groups, set(['Counter:a']))
+        
+        self.assertTransactionsCommitted()
+        self.assertMaxTransactionRetries(0)
+        self.assertEqual(self.get_performance_metrics()['transactions'], 2)
+    
+    def test_report(self):
+        increment('a')
+        report = self.get_transaction_report()
+        self.assertTrue(report.startswith('1 transactions, 0 retries'))
+        self.assertTrue('committed' in report)
+    
+    def test_writes_and_entity_groups(self):
+        parent = Item(key_name='parent', name='p')
+        parent.put()
+        
+        def txn():
+            db.put([Item(parent=parent, name=str(n)) for n in range(3)])
+        db.run_in_transaction(txn)
+        
+        self.assertMaxTransactionWrites(3)
+        self.assertRaises(AssertionError, self.assertMaxTransactionWrites, 2)
+        self.assertMaxEntityGroupsPerTransaction(1)
+        self.assertRaises(AssertionError, self.assertMaxEntityGroupsPerTransaction, 0)
+    
+    def test_injected_collisions_are_retried(self):
+        self.inject_transaction_collisions(0.5, seed=1)
+        for n in range(5):
+            increment('a')
+        
+        self.assertEqual(Counter.get_by_key_name('a').count, 5)
+        self.assertTransactionsCommitted()
+        
+        runs = self.get_transactions()
+        self.assertEqual(len(runs), 5)
+        retries = sum([run.retries for run in runs])
+        self.assertTrue(retries > 0)
+        self.assertEqual(retries, sum([run.collisions for run in runs]))
+        self.assertRaises(AssertionError, self.assertMaxTransactionRetries, 0)
+        self.assertEqual(self.get_performance_metrics()['transaction_retries'], retries)
+    
+    def test_same_seed_same_collisions(self):
+        self.inject_transaction_collisions(0.5, seed=1)
+        increment('a')
+        increment('a')
+        first = [run.retries for run in self.get_transactions()]
+        
+        self.clear_datastore()
+        get_runs = len(self.get_transactions())
+        self.inject_transaction_collisions(0.5, seed=1)
+        increment('a')
+        increment('a')
+        self.assertEqual([run.retries for run in self.get_transactions()[get_runs:]], first)
+    
+    def test_every_commit_collides(self):
+        self.inject_transaction_collisions(1.0)
+        self.assertRaises(db.TransactionFailedError, increment, 'a')
+        
+        run, = self.get_transactions()
+        self.assertFalse(run.committed)
+        self.assertTrue(run.retries > 0)
+        self.assertEqual(run.collisions, len(run.attempts))
+        self.assertRaises(AssertionError, self.assertTransactionsCommitted)
+        self.assertEqual(Counter.get_by_key_name('a'), None)
+        self.assertTrue('failed' in self.get_transaction_report())
+    
+    def test_collision_rate_resets_between_tests(self):
+        increment('a')
+        self.assertMaxTransactionRetries(0)
+
+class CollisionRateTest(DataStoreTestCase, unittest.TestCase):
+    TRANSACTION_COLLISION_RATE = 1.0
+    
+    def test_collision_rate(self):
+        self.assertRaises(db.TransactionFailedError, increment, 'a')
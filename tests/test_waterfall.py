@@ -0,0 +1,120 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+from __future__ import with_statement
+
+import json
+import unittest
+
+from google.appengine.ext import db
+
+from gaetestbed import DataStoreTestCase
+from gaetestbed.rpc import RPCRecord
+from gaetestbed.waterfall import Waterfall
+
+def rpc(service, method, start, end):
+    record = RPCRecord(service, method, None, None, start)
+    record.end = end
+    return record
+
+class WaterfallTest(unittest.TestCase):
+    def setUp(self):
+        # Two overlapping async gets, then three puts one after the other
+        self.waterfall = Waterfall([
+            rpc('datastore_v3', 'Put', 100.030, 100.040),
+            rpc('datastore_v3', 'Get', 100.000, 100.010),
+            rpc('memcache', 'Get', 100.005, 100.015),
+            rpc('datastore_v3', 'Put', 100.040, 100.050),
+            rpc('datastore_v3', 'Put', 100.055, 100.060),
+        ], 100.0, 100.070)
+    
+    def test_times(self):
+        self.assertAlmostEqual(self.waterfall.wall_time, 0.070)
+        self.assertAlmostEqual(self.waterfall.serial_time, 0.045)
+        self.assertAlmostEqual(self.waterfall.busy_time, 0.040)
+        self.assertAlmostEqual(self.waterfall.overlapped_time, 0.005)
+    
+    def test_sorted_by_start(self):
+        self.assertEqual([r.start for r in self.waterfall.records], [100.000, 100.005, 100.030, 100.040, 100.055])
+    
+    def test_unfinished_calls_left_out(self):
+        waterfall = Waterfall([rpc('memcache', 'Get', 1.0, 1.5), rpc('memcache', 'Set', 1.5, None)])
+        self.assertEqual(len(waterfall.records), 1)
+        self.assertEqual((waterfall.start, waterfall.end), (1.0, 1.5))
+    
+    def test_empty(self):
+        waterfall = Waterfall([])
+        self.assertEqual(waterfall.wall_time, 0.0)
+        self.assertEqual(waterfall.busy_time, 0.0)
+        self.assertEqual(waterfall.parallelizable(), [])
+    
+    def test_parallelizable(self):
+        runs = self.waterfall.parallelizable()
+        self.assertEqual(len(runs), 1)
+        self.assertEqual((runs[0]['service'], runs[0]['method']), ('datastore_v3', 'Put'))
+        self.assertEqual(len(runs[0]['records']), 3)
+        self.assertAlmostEqual(runs[0]['savings'], 0.015)
+    
+    def test_overlapping_calls_are_not_parallelizable(self):
+        waterfall = Waterfall([rpc('datastore_v3', 'Get', 0.0, 1.0), rpc('datastore_v3', 'Get', 0.5, 1.5)])
+        self.assertEqual(waterfall.parallelizable(), [])
+    
+    def test_format_text(self):
+        lines = self.waterfall.format_text(width=7).splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[0], 'datastore_v3.Get                    0.0ms    10.0ms |#      |')
+        self.assertEqual(lines[4], 'datastore_v3.Put                   55.0ms     5.0ms |     # |')
+        self.assertEqual(lines[5], '5 RPCs in 70.0ms: 45.0ms serial, 40.0ms waiting (5.0ms saved by overlap)')
+        self.assertEqual(lines[6], '3 sequential datastore_v3.Put calls could run in parallel (saving ~15.0ms)')
+    
+    def test_format_html(self):
+        html = Waterfall([rpc('<svc>', 'Get', 0.0, 0.5), rpc('<svc>', 'Get', 0.5, 1.0)]).format_html()
+        self.assertEqual(html.count('<tr>'), 2)
+        self.assertTrue('&lt;svc&gt;.Get' in html)
+        self.assertTrue('<svc>' not in html)
+        self.assertTrue('margin-left:50.00%;width:50.00%' in html)
+        self.assertTrue('2 sequential &lt;svc&gt;.Get calls could run in parallel' in html)
+    
+    def test_to_json(self):
+        data = json.loads(self.waterfall.to_json())
+        self.assertAlmostEqual(data['wall_time'], 70.0)
+        self.assertAlmostEqual(data['busy_time'], 40.0)
+        self.assertEqual(len(data['rpcs']), 5)
+        self.assertAlmostEqual(data['rpcs'][1]['start'], 5.0)
+        self.assertAlmostEqual(data['rpcs'][1]['end'], 15.0)
+        self.assertEqual(data['rpcs'][1]['service'], 'memcache')
+        self.assertEqual(len(data['parallelizable']), 1)
+        self.assertEqual(data['parallelizable'][0]['count'], 3)
+        self.assertAlmostEqual(data['parallelizable'][0]['savings'], 15.0)
+
+class Item(db.Model):
+    pass
+
+class RecordedWaterfallTest(DataStoreTestCase, unittest.TestCase):
+    def test_gets_in_a_loop(self):
+        keys = db.put([Item() for n in range(3)])
+        
+        with self.rpc_timeline() as waterfall:
+            for key in keys:
+                db.get(key)
+        
+        self.assertEqual([(r.service, r.method) for r in waterfall.records], [('datastore_v3', 'Get')] * 3)
+        runs = waterfall.parallelizable()
+        self.assertEqual([len(run['records']) for run in runs], [3])
+    
+    def test_async_gets_overlap(self):
+        keys = db.put([Item() for n in range(2)])
+        
+        with self.rpc_timeline() as waterfall:
+            rpcs = [db.get_async(key) for key in keys]
+            for async_rpc in rpcs:
+                async_rpc.get_result()
+        
+        self.assertEqual(len(waterfall.records), 2)
+        self.assertEqual(waterfall.parallelizable(), [])
+        self.assertTrue(waterfall.records[1].start <= waterfall.records[0].end)
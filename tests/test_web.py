@@ -0,0 +1,294 @@
+# This file is part of GAE Testbed (http://github.com/jgeewax/gaetestbed).
+# 
+# Copyright (C) 2009 JJ Geewax http://geewax.org/
+# All rights reserved.
+# 
+# This software is licensed as described in the file COPYING.txt,
+# which you should have received as part of this distribution.
+
+import email.utils
+import functools
+import json
+import random
+import time
+import unittest
+
+from google.appengine.ext import db
+
+from gaetestbed import WebTestCase
+from gaetestbed.profiler import ProfilingMiddleware
+
+def _expires(seconds):
+    return email.utils.formatdate(time.time() + seconds, usegmt=True)
+
+# Path -> the caching headers it's served with
+CACHING_HEADERS = {
+    '/public': [('Cache-Control', 'public, max-age=3600'), ('ETag', '"v1"')],
+    '/private': [('Cache-Control', 'private, max-age=60')],
+    '/no-store': [('Cache-Control', 'no-store')],
+    '/expires': [('Expires', _expires(3600))],
+    '/expired': [('Expires', _expires(-3600))],
+    '/none': [],
+}
+
+def application(environ, start_response):
+    path = environ['PATH_INFO']
+    if path not in CACHING_HEADERS:
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return ['Not found']
+    
+    start_response('200 OK', [('Content-Type', 'text/plain')] + CACHING_HEADERS[path])
+    return ['Hello from %s' % path]
+
+class CachingTest(WebTestCase, unittest.TestCase):
+    APPLICATION = staticmethod(application)
+    
+    def test_cacheable(self):
+        response = self.get('/public')
+        self.assertCacheable(response, min_max_age=3600)
+        self.assertHasETag(response)
+    
+    def test_lifetime_too_short(self):
+        self.assertRaises(AssertionError, self.assertCacheable, self.get('/public'), min_max_age=7200)
+    
+    def test_private(self):
+        response = self.get('/private')
+        self.assertCacheable(response, public=False)
+        self.assertRaises(AssertionError, self.assertCacheable, response)
+        self.assertNotCacheable(response)
+    
+    def test_no_store(self):
+        response = self.get('/no-store')
+        self.assertRaises(AssertionError, self.assertCacheable, response)
+        self.assertNotCacheable(response)
+    
+    def test_expires_only(self):
+        response = self.get('/expires')
+        self.assertCacheable(response)
+        self.assertCacheable(response, min_max_age=3000)
+        self.assertRaises(AssertionError, self.assertNotCacheable, response)
+    
+    def test_expired(self):
+        self.assertRaises(AssertionError, self.assertCacheable, self.get('/expired'))
+    
+    def test_no_caching_headers(self):
+        response = self.get('/none')
+        self.assertRaises(AssertionError, self.assertCacheable, response)
+        self.assertRaises(AssertionError, self.assertNotCacheable, response)
+        self.assertRaises(AssertionError, self.assertHasETag, response)
+        self.assertRaises(AssertionError, self.assertHasLastModified, response)
+
+# Like a webapp.WSGIApplication, this only knows its class's module
+partial_application = functools.partial(application)
+
+class ColdStartTest(WebTestCase, unittest.TestCase):
+    APPLICATION = staticmethod(application)
+    
+    def test_application_location(self):
+        self.assertEqual(self._get_application_location(), (__name__, 'application'))
+    
+    def test_cold_start(self):
+        report = self.measure_cold_start('/public')
+        self.assertEqual(report.module, __name__)
+        self.assertColdStartBelow(60000, '/public')
+
+class ColdStartPartialTest(WebTestCase, unittest.TestCase):
+    APPLICATION = partial_application
+    
+    def test_needs_cold_start_module(self):
+        self.assertRaises(AssertionError, self._get_application_location)
+    
+    def test_cold_start_module(self):
+        self.COLD_START_MODULE = __name__
+        self.COLD_START_ATTRIBUTE = 'partial_application'
+        self.assertEqual(self._get_application_location(), (__name__, 'partial_application'))
+
+def session_application(environ, start_response):
+    headers = [('Content-Type', 'text/plain')]
+    if environ['PATH_INFO'] == '/login':
+        headers.append(('Set-Cookie', 'session=abc; Path=/'))
+    start_response('200 OK', headers)
+    return [environ.get('HTTP_COOKIE', '')]
+
+def other_application(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['Other']
+
+class SharedApplicationTest(WebTestCase, unittest.TestCase):
+    APPLICATION = staticmethod(session_application)
+    
+    def test_cookies_1_set(self):
+        self.app.get('/login')
+        self.assertEqual(self.app.get('/').body, 'session=abc')
+    
+    def test_cookies_2_gone_in_the_next_test(self):
+        self.assertEqual(self.app.get('/').body, '')
+    
+    def test_shared_between_test_cases(self):
+        class SameApplication(WebTestCase):
+            APPLICATION = staticmethod(session_application)
+        
+        self.assertTrue(SameApplication._get_test_app() is self.app)
+    
+    def test_new_application(self):
+        class OtherApplication(WebTestCase):
+            APPLICATION = staticmethod(other_application)
+        
+        app = OtherApplication._get_test_app()
+        self.assertTrue(app is not self.app)
+        self.assertEqual(app.get('/').body, 'Other')
+    
+    def test_new_profile_dir(self):
+        class Profiled(WebTestCase):
+            APPLICATION = staticmethod(session_application)
+            PROFILE_DIR = '/tmp/profiles'
+        
+        class ProfiledElsewhere(Profiled):
+            PROFILE_DIR = '/tmp/other-profiles'
+        
+        app = Profiled._get_test_app()
+        self.assertTrue(app is not self.app)
+        self.assertTrue(isinstance(app.app, ProfilingMiddleware))
+        self.assertEqual(app.app.profile_dir, '/tmp/profiles')
+        self.assertTrue(ProfiledElsewhere._get_test_app() is not app)
+        self.assertTrue(Profiled._get_test_app() is app)
+    
+    def test_prepare_application(self):
+        class Prepared(WebTestCase):
+            APPLICATION = staticmethod(other_application)
+            PROFILE_REQUESTS = True
+        
+        Prepared.prepare_application()
+        self.assertTrue(Prepared._get_test_app() is Prepared._get_test_app())
+        self.assertTrue(isinstance(Prepared._get_test_app().app, ProfilingMiddleware))
+
+FEED = json.dumps([{'title': 'Article %d' % n, 'body': 'Lorem ipsum dolor sit amet'} for n in range(50)])
+LOGO = ''.join([chr(random.Random(n).randint(0, 255)) for n in range(2000)])
+
+def sized_application(environ, start_response):
+    path = environ['PATH_INFO']
+    if path == '/feed.json':
+        start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')])
+        return [FEED]
+    if path == '/logo.png':
+        start_response('200 OK', [('Content-Type', 'image/png')])
+        return [LOGO]
+    if path == '/noise.txt':
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [LOGO]
+    
+    if environ.get('HTTP_IF_NONE_MATCH') == '"v1"':
+        start_response('304 Not Modified', [('ETag', '"v1"')])
+        return []
+    start_response('200 OK', [('Content-Type', 'text/html'), ('ETag', '"v1"')])
+    return ['<html>%s</html>' % ('article ' * 100)]
+
+class ResponseSizeTest(WebTestCase, unittest.TestCase):
+    APPLICATION = staticmethod(sized_application)
+    
+    def test_max_response_size(self):
+        response = self.get('/feed.json')
+        size = len(FEED)
+        
+        self.assertEqual(response.payload.size, size)
+        self.assertMaxResponseSize(response, size)
+        self.assertRaises(self.failureException, self.assertMaxResponseSize, response, size - 1)
+        self.assertMaxResponseSize(response, size / 4, compressed=True)
+        self.assertRaises(self.failureException, self.assertMaxResponseSize, response, 10, compressed=True)
+    
+    def test_compressible(self):
+        self.assertCompressible(self.get('/feed.json'))
+    
+    def test_not_compressible_content_type(self):
+        self.assertRaises(self.failureException, self.assertCompressible, self.get('/logo.png'))
+    
+    def test_does_not_compress_well(self):
+        self.assertRaises(self.failureException, self.assertCompressible, self.get('/noise.txt'))
+    
+    def test_report(self):
+        self.get('/feed.json')
+        self.get('/feed.json')
+        self.get('/logo.png')
+        
+        report = self.get_response_size_report()
+        self.assertEqual(sorted(report), ['/feed.json', '/logo.png'])
+        self.assertEqual(report['/feed.json']['requests'], 2)
+        self.assertEqual(report['/feed.json']['not_modified'], 0)
+        self.assertEqual(report['/feed.json']['size'], len(FEED))
+        self.assertTrue(report['/feed.json']['gzip_size'] < len(FEED))
+        self.assertTrue(report['/feed.json']['time_to_first_byte'] >= 0)
+        self.assertEqual(report['/logo.png']['requests'], 1)
+    
+    def test_report_counts_not_modified_separately(self):
+        response = self.get('/article')
+        self.revalidate(response)
+        
+        report = self.get_response_size_report()['/article']
+        self.assertEqual(report['requests'], 1)
+        self.assertEqual(report['not_modified'], 1)
+        self.assertEqual(report['size'], response.payload.size)
+    
+    def test_report_only_not_modified(self):
+        self.get('/article', headers={'If-None-Match': '"v1"'})
+        
+        report = self.get_response_size_report()['/article']
+        self.assertEqual(report['requests'], 0)
+        self.assertEqual(report['not_modified'], 1)
+        self.assertEqual(report['size'], 0)
+        self.assertEqual(report['time_to_first_byte'], None)
+
+LAST_MODIFIED = 'Mon, 19 Oct 2026 10:00:00 GMT'
+
+class Article(db.Model):
+    pass
+
+def conditional_application(environ, start_response):
+    path = environ['PATH_INFO']
+    if path == '/dated':
+        headers = [('Last-Modified', LAST_MODIFIED)]
+        not_modified = environ.get('HTTP_IF_MODIFIED_SINCE') == LAST_MODIFIED
+    else:
+        headers = [('ETag', '"v2"')]
+        not_modified = environ.get('HTTP_IF_NONE_MATCH') == '"v2"' and path != '/stale'
+        if path == '/expensive':
+            # Checks the ETag against the entity before answering
+            Article.get_by_key_name('1')
+    
+    if not_modified:
+        start_response('304 Not Modified', headers)
+        return []
+    start_response('200 OK', [('Content-Type', 'text/plain')] + headers)
+    return ['Article']
+
+class RevalidateTest(WebTestCase, unittest.TestCase):
+    APPLICATION = staticmethod(conditional_application)
+    
+    def test_etag(self):
+        response = self.get('/article')
+        self.assertEqual(response.status_int, 200)
+        
+        revalidated = self.revalidate(response)
+        self.assertEqual(revalidated.status_int, 304)
+        self.assertEqual(revalidated.request.headers['If-None-Match'], '"v2"')
+        self.assertEqual(revalidated.body, '')
+    
+    def test_last_modified(self):
+        revalidated = self.revalidate(self.get('/dated'))
+        self.assertEqual(revalidated.status_int, 304)
+        self.assertEqual(revalidated.request.headers['If-Modified-Since'], LAST_MODIFIED)
+    
+    def test_not_answered_with_304(self):
+        self.assertRaises(self.failureException, self.revalidate, self.get('/stale'))
+    
+    def test_datastore_calls(self):
+        self.assertRaises(self.failureException, self.revalidate, self.get('/expensive'))
+    
+    def test_no_validators(self):
+        response = self.get('/article')
+        del response.headers['ETag']
+        self.assertRaises(self.failureException, self.revalidate, response)
+    
+    def test_only_get(self):
+        response = self.post('/article', {'title': 'Article'})
+        self.assertEqual(response.status_int, 200)
+        self.assertRaises(ValueError, self.revalidate, response)